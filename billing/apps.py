@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class BillingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'billing'
+
+    def ready(self):
+        from django.db.models.signals import post_save
+        from .models import Payment
+        from .documents import prerender_receipt
+
+        post_save.connect(prerender_receipt, sender=Payment)
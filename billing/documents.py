@@ -0,0 +1,51 @@
+"""PDF payment receipts, see core.pdf"""
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Trim
+
+from core import pdf
+from core.context_processors import CLINIC
+
+from .models import Payment
+
+TEMPLATE = 'billing/receipt_pdf.html'
+
+
+def receipt(payment_id):
+    """Context of a payment's receipt in one query, or None for an unknown payment"""
+    row = Payment.objects.filter(payment_id=payment_id).values(
+        'payment_id', 'receipt_number', 'payment_type', 'payment_method', 'status', 'amount', 'notes',
+        'created_at', 'completed_at',
+        'patient__patient_id', 'patient__first_name', 'patient__last_name', 'patient__phone',
+        'visit__visit_id', 'lab_request__request_id', 'lab_request__test_type__name',
+        'prescription__prescription_id',
+        processed_by_name=Trim(Concat(F('processed_by__first_name'), Value(' '), F('processed_by__last_name'))),
+    ).first()
+    if row is None:
+        return None
+    row['payment_type_display'] = str(Payment.PaymentType(row['payment_type']).label)
+    row['payment_method_display'] = str(Payment.PaymentMethod(row['payment_method']).label)
+    row['status_display'] = str(Payment.Status(row['status']).label)
+    return {**CLINIC, 'payment': row}
+
+
+def serve_receipt(request, payment_id):
+    """The stored PDF receipt of a payment, or None for an unknown payment"""
+    context = receipt(payment_id)
+    if context is None:
+        return None
+    return pdf.serve(request, TEMPLATE, context, f'receipt-{context["payment"]["receipt_number"] or payment_id}.pdf')
+
+
+def prerender_receipt(sender, instance, created, raw=False, **kwargs):
+    """post_save for Payment: render the receipt once the payment completes"""
+    if raw or 'status' not in instance.changed_fields or instance.status != Payment.Status.COMPLETED:
+        return
+    payment_id = instance.payment_id
+
+    def queue():
+        context = receipt(payment_id)
+        if context is not None:
+            pdf.submit(TEMPLATE, context)
+
+    transaction.on_commit(queue, robust=True)
@@ -1,11 +1,12 @@
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from users.models import User
+from core.models import TrackedFieldsMixin
 from patients.models import Patient, Visit
 from laboratory.models import LabTestRequest
 from pharmacy.models import Prescription
 
-class Payment(models.Model):
+class Payment(TrackedFieldsMixin, models.Model):
     class PaymentType(models.TextChoices):
         REGISTRATION = 'REGISTRATION', _('Registration Fee')
         LAB_TEST = 'LAB_TEST', _('Lab Test')
@@ -47,6 +48,18 @@ class Payment(models.Model):
     completed_at = models.DateTimeField(null=True, blank=True)
     receipt_number = models.CharField(max_length=50, unique=True, null=True, blank=True)
 
+    tracked_fields = ('status',)
+
+    class Meta:
+        indexes = [
+            # Pending/completed payments of a type, by date (payment list, reports)
+            models.Index(fields=['status', 'payment_type', 'created_at'], name='payment_status_type_idx'),
+            # Newest-first payment list and date-range exports
+            models.Index(fields=['created_at'], name='payment_created_idx'),
+            # Rollup reconciliation looks up recently completed payments
+            models.Index(fields=['completed_at'], name='payment_completed_idx'),
+        ]
+
 class Invoice(models.Model):
     invoice_number = models.CharField(max_length=20, unique=True)
     patient = models.ForeignKey(Patient, on_delete=models.PROTECT)
@@ -1,3 +1,101 @@
-from django.test import TestCase
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from core import pdf
+from core.testing import make_medicine, make_payment, make_prescription, make_user
+from patients.models import Patient
+from pharmacy.models import Prescription, StockMovement
+from users.models import User
+
+from . import documents
+from .models import Payment
+
+
+class MedicinePaymentTests(TestCase):
+    def setUp(self):
+        self.medicine = make_medicine(quantity_in_stock=10)
+        self.prescription = make_prescription(items=[(self.medicine, 2)], status=Prescription.Status.READY)
+        make_payment(
+            visit=self.prescription.visit, prescription=self.prescription,
+            payment_type=Payment.PaymentType.MEDICINE, payment_method=Payment.PaymentMethod.PENDING,
+            amount=self.prescription.total_cost,
+        )
+        self.client.force_login(make_user(User.Role.CASHIER))
+        self.url = reverse('process_medicine_payment', args=[self.prescription.prescription_id])
+
+    def test_second_submission_does_not_dispense_again(self):
+        self.client.post(self.url, {'payment_method': 'CASH'})
+        response = self.client.post(self.url, {'payment_method': 'CASH'})
+        self.assertRedirects(response, reverse('payment_list'), fetch_redirect_response=False)
+
+        self.medicine.refresh_from_db()
+        self.assertEqual(self.medicine.quantity_in_stock, 8)
+        self.assertEqual(
+            StockMovement.objects.filter(reference=self.prescription.prescription_id).count(), 1
+        )
+        payments = Payment.objects.filter(prescription=self.prescription)
+        self.assertEqual(payments.filter(status=Payment.Status.COMPLETED).count(), 1)
+        self.assertFalse(payments.filter(status=Payment.Status.PENDING).exists())
+
+    def test_unready_prescription_is_not_charged(self):
+        Prescription.objects.filter(pk=self.prescription.pk).update(status=Prescription.Status.CANCELLED)
+        self.client.post(self.url, {'payment_method': 'CASH'})
+        self.medicine.refresh_from_db()
+        self.assertEqual(self.medicine.quantity_in_stock, 10)
+        self.assertFalse(Payment.objects.filter(status=Payment.Status.COMPLETED).exists())
+
+    def test_concurrent_submission_is_caught_under_the_lock(self):
+        # Read READY before the other submission committed DISPENSED
+        stale = Prescription.objects.select_related('visit__patient').get(pk=self.prescription.pk)
+        Prescription.objects.filter(pk=self.prescription.pk).update(status=Prescription.Status.DISPENSED)
+        with mock.patch('billing.views.get_object_or_404', return_value=stale):
+            self.client.post(self.url, {'payment_method': 'CASH'})
+        self.medicine.refresh_from_db()
+        self.assertEqual(self.medicine.quantity_in_stock, 10)
+        self.assertFalse(Payment.objects.filter(status=Payment.Status.COMPLETED).exists())
+
+
+def _fake_render(template_name, context, path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b'%PDF-1.4 ' + context['payment']['status'].encode())
+
+
+@mock.patch('core.pdf._render', side_effect=_fake_render)
+class ReceiptPdfTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.payment = make_payment()
+        self.client.force_login(make_user(User.Role.CASHIER))
+        self.url = reverse('payment_receipt_pdf', args=[self.payment.payment_id])
+
+    def test_receipt_is_rendered_once_and_revalidated_by_etag(self, render):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(render.call_count, 1)
+
+    def test_editing_the_payment_changes_the_key(self, render):
+        before = documents.receipt(self.payment.payment_id)
+        self.assertEqual(
+            pdf.document_key(documents.TEMPLATE, before),
+            pdf.document_key(documents.TEMPLATE, documents.receipt(self.payment.payment_id)),
+        )
+        etag = self.client.get(self.url)['ETag']
+
+        Payment.objects.filter(pk=self.payment.pk).update(status=Payment.Status.COMPLETED)
+        Patient.objects.filter(pk=self.payment.patient_id).update(first_name='Chaltu')
+        after = documents.receipt(self.payment.payment_id)
+        self.assertNotEqual(pdf.document_key(documents.TEMPLATE, before), pdf.document_key(documents.TEMPLATE, after))
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF-1.4 COMPLETED')
+        self.assertEqual(render.call_count, 2)
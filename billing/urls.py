@@ -4,6 +4,7 @@ from . import views
 urlpatterns = [
     path('', views.payment_list, name='payment_list'),
     path('<str:payment_id>/', views.payment_detail, name='payment_detail'),
+    path('<str:payment_id>/receipt.pdf', views.payment_receipt_pdf, name='payment_receipt_pdf'),
     path('lab/<str:request_id>/', views.process_lab_payment, name='process_lab_payment'),
     path('medicine/<str:prescription_id>/', views.process_medicine_payment, name='process_medicine_payment'),
     path('pending-medicine/', views.pending_medicine_payments, name='pending_medicine_payments'),  
@@ -1,18 +1,21 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import Http404, JsonResponse
 from django.utils import timezone
-from django.db.models import Sum, Count
+from django.db.models import Q, Sum, Count
 from django.db import transaction
 from .models import Payment, Invoice
+from . import documents
 from .forms import PaymentForm, LabTestPaymentForm, MedicinePaymentForm, PaymentSearchForm
 from laboratory.models import LabTestRequest
 from pharmacy.models import Prescription
 from core.models import Notification
+from pharmacy import stock
 from users.models import User
 from patients.models import Patient, Visit
-import random
+from core.utils import generate_payment_id, generate_receipt_number
 
 @login_required
 def process_lab_payment(request, request_id):
@@ -34,7 +37,7 @@ def process_lab_payment(request, request_id):
             with transaction.atomic():
                 # Create payment record
                 payment = Payment(
-                    payment_id=f"PAY{timezone.now().strftime('%y%m%d')}{random.randint(1000, 9999)}",
+                    payment_id=generate_payment_id(),
                     patient=lab_request.visit.patient,
                     visit=lab_request.visit,
                     payment_type=Payment.PaymentType.LAB_TEST,
@@ -44,7 +47,7 @@ def process_lab_payment(request, request_id):
                     processed_by=request.user,
                     status=Payment.Status.COMPLETED,
                     completed_at=timezone.now(),
-                    receipt_number=f"RCP{timezone.now().strftime('%y%m%d')}{random.randint(1000, 9999)}"
+                    receipt_number=generate_receipt_number()
                 )
                 payment.save()
                 
@@ -53,6 +56,10 @@ def process_lab_payment(request, request_id):
                 lab_request.payment_completed_at = timezone.now()
                 lab_request.save()
                 
+                if settings.LAB_AUTO_DISPATCH:
+                    # laboratory.dispatch assigns a technician once this commits
+                    messages.success(request, f'Payment of {lab_request.test_type.price} ETB processed successfully. Lab test has been sent to the lab queue.')
+                    return redirect('lab_requests_list')
                 messages.success(request, f'Payment of {lab_request.test_type.price} ETB processed successfully. Lab test is ready for assignment.')
                 return redirect('assign_lab_request', request_id=request_id)
                 
@@ -141,15 +148,17 @@ def pending_medicine_payments(request):
 @login_required
 def process_medicine_payment(request, prescription_id):
     """Cashier processes medicine payment"""
-    prescription = get_object_or_404(Prescription, prescription_id=prescription_id)
+    prescription = get_object_or_404(
+        Prescription.objects.select_related('visit__patient'), prescription_id=prescription_id
+    )
     
     if request.user.role not in ['CASHIER', 'RECEPTIONIST', 'ADMIN']:
         messages.error(request, "You don't have permission to process payments.")
         return redirect('payment_list')
     
-    print(f"DEBUG: Processing payment for prescription {prescription_id}")
-    print(f"DEBUG: Prescription status: {prescription.status}")
-    print(f"DEBUG: Prescription total cost: {prescription.total_cost}")
+    if prescription.status != Prescription.Status.READY:
+        messages.warning(request, f"This prescription is {prescription.get_status_display().lower()}, not awaiting payment.")
+        return redirect('payment_list')
     
     # Get the pending payment for this prescription
     try:
@@ -158,12 +167,10 @@ def process_medicine_payment(request, prescription_id):
             status=Payment.Status.PENDING,
             payment_type=Payment.PaymentType.MEDICINE
         )
-        print(f"DEBUG: Found pending payment: {payment.payment_id}")
     except Payment.DoesNotExist:
-        print(f"DEBUG: No pending payment found, creating one...")
         # Create a payment record if it doesn't exist
         payment = Payment(
-            payment_id=f"PAY{timezone.now().strftime('%y%m%d')}{random.randint(1000, 9999)}",
+            payment_id=generate_payment_id(),
             patient=prescription.visit.patient,
             visit=prescription.visit,
             payment_type=Payment.PaymentType.MEDICINE,
@@ -172,18 +179,29 @@ def process_medicine_payment(request, prescription_id):
             prescription=prescription,
             processed_by=request.user,
             status=Payment.Status.PENDING,
-            receipt_number=f"RCP{timezone.now().strftime('%y%m%d')}{random.randint(1000, 9999)}"
+            receipt_number=generate_receipt_number()
         )
         payment.save()
-        print(f"DEBUG: Created new payment: {payment.payment_id}")
     
     if request.method == 'POST':
         payment_method = request.POST.get('payment_method', 'CASH')
-        print(f"DEBUG: POST request received, payment method: {payment_method}")
         
         try:
             with transaction.atomic():
-                print(f"DEBUG: Starting transaction...")
+                # Lock the prescription: a concurrent submission of this form
+                # waits here and then finds it dispensed instead of taking stock again
+                current_status = Prescription.objects.select_for_update().values_list(
+                    'status', flat=True
+                ).get(pk=prescription.pk)
+                if current_status != Prescription.Status.READY:
+                    messages.warning(
+                        request,
+                        f"This prescription is {Prescription.Status(current_status).label.lower()}, not awaiting payment."
+                    )
+                    return redirect('payment_list')
+                
+                # Take every item out of stock first; a shortfall rolls back the whole payment
+                stock.take_prescription_stock(prescription, user=request.user)
                 
                 # Update payment record
                 payment.payment_method = payment_method
@@ -191,87 +209,73 @@ def process_medicine_payment(request, prescription_id):
                 payment.completed_at = timezone.now()
                 payment.processed_by = request.user
                 payment.save()
-                print(f"DEBUG: Payment updated to COMPLETED")
                 
                 # Update prescription status to DISPENSED
                 prescription.status = Prescription.Status.DISPENSED
                 prescription.dispensed_at = timezone.now()
                 prescription.save()
-                print(f"DEBUG: Prescription updated to DISPENSED")
-                
-                # Update medicine stock
-                for item in prescription.items.all():
-                    medicine = item.medicine
-                    print(f"DEBUG: Processing medicine {medicine.name}, stock: {medicine.quantity_in_stock}, needed: {item.quantity}")
-                    if medicine.quantity_in_stock >= item.quantity:
-                        medicine.quantity_in_stock -= item.quantity
-                        medicine.save()
-                        print(f"DEBUG: Updated stock for {medicine.name} to {medicine.quantity_in_stock}")
-                    else:
-                        error_msg = f'Insufficient stock for {medicine.name}'
-                        print(f"DEBUG: {error_msg}")
-                        messages.error(request, error_msg)
-                        return redirect('process_medicine_payment', prescription_id=prescription_id)
                 
                 # Update visit status to COMPLETED
                 prescription.visit.status = Visit.Status.COMPLETED
                 prescription.visit.completion_time = timezone.now()
                 prescription.visit.save()
-                print(f"DEBUG: Visit updated to COMPLETED")
                 
                 # Create completion notification
                 Notification.objects.create(
-                    recipient=prescription.prescribed_by,
+                    recipient_id=prescription.prescribed_by_id,
                     notification_type=Notification.NotificationType.SYSTEM,
                     title='Patient Treatment Completed',
                     message=f'Patient {prescription.visit.patient} has completed treatment and paid for medicines',
                     related_object_id=prescription.visit.visit_id
                 )
-                print(f"DEBUG: Notification created")
-                
-                messages.success(request, f'Payment of {payment.amount} ETB processed successfully. Treatment completed.')
-                print(f"DEBUG: Redirecting to payment detail")
-                return redirect('payment_detail', payment_id=payment.payment_id)
-                
+        except stock.InsufficientStock as e:
+            for name, needed, available in e.shortfalls:
+                messages.error(request, f'Insufficient stock for {name}: {needed} needed, {available} available')
+            return redirect('process_medicine_payment', prescription_id=prescription_id)
         except Exception as e:
-            error_msg = f'Error processing payment: {str(e)}'
-            print(f"DEBUG: Exception: {error_msg}")
-            messages.error(request, error_msg)
+            messages.error(request, f'Error processing payment: {str(e)}')
+        else:
+            messages.success(request, f'Payment of {payment.amount} ETB processed successfully. Treatment completed.')
+            return redirect('payment_detail', payment_id=payment.payment_id)
     
     context = {
         'prescription': prescription,
         'payment': payment,
     }
-    print(f"DEBUG: Rendering template with context")
     return render(request, 'billing/process_medicine_payment.html', context)
 
-@login_required
-def payment_list(request):
-    form = PaymentSearchForm(request.GET or None)
-    payments = Payment.objects.all().order_by('-created_at')
-    
-    if form.is_valid():
-        if form.cleaned_data['patient_id']:
-            payments = payments.filter(patient__patient_id__icontains=form.cleaned_data['patient_id'])
-        if form.cleaned_data['payment_id']:
-            payments = payments.filter(payment_id__icontains=form.cleaned_data['payment_id'])
-        if form.cleaned_data['date_from']:
-            payments = payments.filter(created_at__date__gte=form.cleaned_data['date_from'])
-        if form.cleaned_data['date_to']:
-            payments = payments.filter(created_at__date__lte=form.cleaned_data['date_to'])
+def filter_payments(user, filters=None):
+    """The payments ``user`` may list, newest first, narrowed by ``PaymentSearchForm`` data"""
+    payments = Payment.objects.select_related(
+        'patient', 'processed_by', 'prescription', 'lab_request'
+    ).order_by('-created_at')
+    if filters:
+        if filters['patient_id']:
+            payments = payments.filter(patient__patient_id__icontains=filters['patient_id'])
+        if filters['payment_id']:
+            payments = payments.filter(payment_id__icontains=filters['payment_id'])
+        if filters['date_from']:
+            payments = payments.filter(created_at__date__gte=filters['date_from'])
+        if filters['date_to']:
+            payments = payments.filter(created_at__date__lte=filters['date_to'])
     
     # Show pending medicine payments first for cashiers
-    if request.user.role in ['CASHIER', 'RECEPTIONIST']:
+    if user.role in ['CASHIER', 'RECEPTIONIST']:
         payments = payments.filter(status=Payment.Status.PENDING, payment_type=Payment.PaymentType.MEDICINE)
+    return payments
+
+@login_required
+def payment_list(request):
+    form = PaymentSearchForm(request.GET or None)
+    payments = filter_payments(request.user, form.cleaned_data if form.is_valid() else None)
     
-    # Calculate totals
-    total_completed = payments.filter(status=Payment.Status.COMPLETED).aggregate(
-        total=Sum('amount')
-    )['total'] or 0
-    
-    total_pending = payments.filter(status=Payment.Status.PENDING).aggregate(
-        total=Sum('amount')
-    )['total'] or 0
+    # Calculate both totals in one query
+    totals = payments.aggregate(
+        total_completed=Sum('amount', filter=Q(status=Payment.Status.COMPLETED)),
+        total_pending=Sum('amount', filter=Q(status=Payment.Status.PENDING)),
+    )
+    total_completed = totals['total_completed'] or 0
+    total_pending = totals['total_pending'] or 0
     
     context = {
         'payments': payments,
@@ -284,4 +288,12 @@ def payment_list(request):
 @login_required
 def payment_detail(request, payment_id):
     payment = get_object_or_404(Payment, payment_id=payment_id)
-    return render(request, 'billing/payment_detail.html', {'payment': payment})
\ No newline at end of file
+    return render(request, 'billing/payment_detail.html', {'payment': payment})
+
+@login_required
+def payment_receipt_pdf(request, payment_id):
+    """Download the printable receipt, rendered once and stored"""
+    response = documents.serve_receipt(request, payment_id)
+    if response is None:
+        raise Http404('No such payment')
+    return response
\ No newline at end of file
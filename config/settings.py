@@ -3,6 +3,7 @@ Django settings for patient_management_system project.
 """
 
 import os
+import sys
 from pathlib import Path
 from decouple import config
 
@@ -55,8 +56,26 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'allauth.account.middleware.AccountMiddleware',
+    'core.middleware.QueryInstrumentationMiddleware',
 ]
 
+# Per-view query budgets (URL name -> max queries), see core.middleware.
+# Exceeding a budget is logged, and raises while the test suite runs.
+QUERY_BUDGETS = {
+    'dashboard': 10,
+    'patient_list': 8,
+    'payment_list': 10,
+    'lab_requests_list': 10,
+    'prescription_list': 8,
+    'pharmacy_dashboard': 15,
+    'financial_reports': 12,
+    'notifications': 8,
+    'visit_queue': 6,
+    'cart_batch': 20,
+    'batch_lab_results': 25,
+}
+QUERY_BUDGET_ENFORCE = config('QUERY_BUDGET_ENFORCE', default=sys.argv[1:2] == ['test'], cast=bool)
+
 ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
@@ -89,6 +108,48 @@ DATABASES = {
     }
 }
 
+# Cache (sidebar badge counters, see core.counters). Use a shared backend such
+# as Redis or Memcached in production so every worker sees the same counts.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='clinic-cache'),
+    }
+}
+# Outside DEBUG a per-process cache fails the system checks (core.checks).
+# The test suite runs in a single process and may keep the default.
+REQUIRE_SHARED_CACHE = config('REQUIRE_SHARED_CACHE', default=not DEBUG and sys.argv[1:2] != ['test'], cast=bool)
+
+BADGE_COUNTER_TIMEOUT = config('BADGE_COUNTER_TIMEOUT', default=3600, cast=int)
+
+# Read notifications older than this are removed by compact_notifications
+NOTIFICATION_RETENTION_DAYS = config('NOTIFICATION_RETENTION_DAYS', default=90, cast=int)
+
+# Hand paid lab requests to the least-loaded lab tech automatically, see
+# laboratory.dispatch. Off: techs pull work or staff assign it by hand.
+LAB_AUTO_DISPATCH = config('LAB_AUTO_DISPATCH', default=True, cast=bool)
+
+# Reorder forecasting (pharmacy.forecast): days from order to delivery,
+# and days between orders
+PHARMACY_LEAD_TIME_DAYS = config('PHARMACY_LEAD_TIME_DAYS', default=7, cast=int)
+PHARMACY_REVIEW_DAYS = config('PHARMACY_REVIEW_DAYS', default=14, cast=int)
+
+# Lab report and receipt PDFs (core.pdf): render threads per process,
+# seconds a download waits for a render, and days an unused file is kept
+PDF_RENDER_WORKERS = config('PDF_RENDER_WORKERS', default=2, cast=int)
+PDF_RENDER_WAIT = config('PDF_RENDER_WAIT', default=10, cast=float)
+PDF_RETENTION_DAYS = config('PDF_RETENTION_DAYS', default=90, cast=int)
+
+# Business keys (PAT/VIS/PAY/...) are reserved in blocks per worker, see core.sequences
+ID_BLOCK_SIZE = config('ID_BLOCK_SIZE', default=20, cast=int)
+
+# Pub/sub used to push live queue updates to browsers, see core.events.
+# Server-Sent Events need the ASGI application (config/asgi.py).
+EVENTS_BACKEND = config('EVENTS_BACKEND', default='core.events.InProcessBackend')
+# Turn on only when serving config/asgi.py. Pages then subscribe to the event
+# stream; under WSGI every open stream would hold a worker thread for good.
+LIVE_UPDATES = config('LIVE_UPDATES', default=False, cast=bool)
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -5,13 +5,35 @@ class CoreConfig(AppConfig):
     name = 'core'
 
     def ready(self):
+        from django.core import checks
+        from .checks import check_shared_cache
+
+        checks.register(check_shared_cache, checks.Tags.caches)
+
         # Import models here to avoid circular imports
-        from django.db.models.signals import post_save
+        from django.db.models.signals import post_save, post_delete
+        from users.models import User
+        from patients.models import Visit
         from laboratory.models import LabTestRequest, TestResult
         from pharmacy.models import Prescription
-        from .models import create_lab_notification, create_lab_result_notification, create_prescription_notification
+        from billing.models import Payment
+        from .models import (
+            Notification, update_unread_counter, update_status_counters, update_medicine_payment_counter,
+            create_lab_notification, create_lab_result_notification, create_prescription_notification,
+        )
+        from .fanout import invalidate_role_rosters
+        from .events import publish_visit_change, publish_lab_request_change
         
         # Connect signals
+        post_save.connect(invalidate_role_rosters, sender=User)
+        post_delete.connect(invalidate_role_rosters, sender=User)
+        post_save.connect(update_unread_counter, sender=Notification)
+        post_save.connect(update_status_counters, sender=LabTestRequest)
+        post_save.connect(update_status_counters, sender=Prescription)
+        post_save.connect(update_medicine_payment_counter, sender=Prescription)
+        post_save.connect(update_medicine_payment_counter, sender=Payment)
         post_save.connect(create_lab_notification, sender=LabTestRequest)
         post_save.connect(create_lab_result_notification, sender=TestResult)
-        post_save.connect(create_prescription_notification, sender=Prescription)
\ No newline at end of file
+        post_save.connect(create_prescription_notification, sender=Prescription)
+        post_save.connect(publish_visit_change, sender=Visit)
+        post_save.connect(publish_lab_request_change, sender=LabTestRequest)
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core import checks
+
+from . import counters
+
+
+def check_shared_cache(app_configs, **kwargs):
+    """The badge counters need a cache every worker process shares"""
+    if not settings.REQUIRE_SHARED_CACHE or counters.cache_is_shared():
+        return []
+    return [checks.Error(
+        f"The default cache ({settings.CACHES['default']['BACKEND']}) is private to each process, "
+        'so every worker would serve its own badge counts.',
+        hint='Point CACHE_BACKEND and CACHE_LOCATION at a shared cache such as Redis or Memcached.',
+        id='core.E001',
+    )]
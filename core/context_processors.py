@@ -1,6 +1,14 @@
-from .models import Notification
-from laboratory.models import LabTestRequest
-from pharmacy.models import Prescription
+from django.conf import settings
+
+from . import counters
+
+# Clinic details shown on every page and printed on PDFs (see core.pdf)
+CLINIC = {
+    'clinic_name': "Dr. Gudeta Healthcare Clinic",
+    'clinic_phone': "+251 XXX XXX XXX", 
+    'clinic_email': "info@gudetaclinic.com",
+    'clinic_address': "Addis Ababa, Ethiopia",
+}
 
 def clinic_info(request):
     """Provide clinic information to all templates"""
@@ -9,32 +17,22 @@ def clinic_info(request):
     pending_medicine_payments_count = 0
     pending_prescriptions = 0
     
-    # Calculate statistics if user is authenticated
+    # Badge counts come from the counter cache; see core.counters
     if request.user.is_authenticated:
         try:
-            unread_count = Notification.objects.filter(
-                recipient=request.user, 
-                is_read=False
-            ).count()
+            unread_count = counters.get_count(
+                counters.UNREAD_NOTIFICATIONS, user_id=request.user.pk
+            )
             
             # Role-based counts for sidebar badges
             if request.user.role in ['CASHIER', 'RECEPTIONIST', 'ADMIN']:
-                pending_lab_payments = LabTestRequest.objects.filter(
-                    status=LabTestRequest.Status.PAYMENT_PENDING
-                ).count()
-                
-                # Count pending medicine payments
-                pending_medicine_payments_count = Prescription.objects.filter(
-                    status=Prescription.Status.DISPENSED
-                ).exclude(
-                    visit__payment__payment_type='MEDICINE',
-                    visit__payment__status='COMPLETED'
-                ).count()
+                pending_lab_payments = counters.get_count(counters.PENDING_LAB_PAYMENTS)
+                pending_medicine_payments_count = counters.get_count(
+                    counters.PENDING_MEDICINE_PAYMENTS
+                )
             
             if request.user.role in ['PHARMACIST', 'ADMIN']:
-                pending_prescriptions = Prescription.objects.filter(
-                    status=Prescription.Status.PENDING
-                ).count()
+                pending_prescriptions = counters.get_count(counters.PENDING_PRESCRIPTIONS)
                 
         except:
             # If models aren't ready yet (during initial setup)
@@ -44,13 +42,11 @@ def clinic_info(request):
             pending_prescriptions = 0
     
     return {
-        'clinic_name': "Dr. Gudeta Healthcare Clinic",
-        'clinic_phone': "+251 XXX XXX XXX", 
-        'clinic_email': "info@gudetaclinic.com",
-        'clinic_address': "Addis Ababa, Ethiopia",
+        **CLINIC,
         'registration_fee': 50.00,
         'unread_notifications_count': unread_count,
         'pending_lab_payments': pending_lab_payments,
         'pending_medicine_payments_count': pending_medicine_payments_count,
         'pending_prescriptions': pending_prescriptions,
+        'live_updates': settings.LIVE_UPDATES,
     }
\ No newline at end of file
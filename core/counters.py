@@ -0,0 +1,118 @@
+"""Cached sidebar badge counters.
+
+The counts shown in the sidebar and top bar are kept in the cache and
+adjusted in place as notifications and workflow rows change state, so a
+page render reads them from memory instead of running COUNT queries.
+A cache miss falls back to the database, so nothing has to be primed.
+The cache has to be shared by every worker process (see core.checks):
+an adjustment made in one process never reaches a per-process cache in
+another.
+"""
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+UNREAD_NOTIFICATIONS = 'unread_notifications'
+PENDING_LAB_PAYMENTS = 'pending_lab_payments'
+PENDING_MEDICINE_PAYMENTS = 'pending_medicine_payments'
+PENDING_PRESCRIPTIONS = 'pending_prescriptions'
+
+# Counters shared by every user of a role (as opposed to per-user counters)
+GLOBAL_COUNTERS = (PENDING_LAB_PAYMENTS, PENDING_MEDICINE_PAYMENTS, PENDING_PRESCRIPTIONS)
+
+# Global counters that track rows in one status: model label -> [(counter, status)].
+# Maintained from post_save by core.models.update_status_counters;
+# PENDING_MEDICINE_PAYMENTS spans two models and has its own handler,
+# core.models.update_medicine_payment_counter.
+STATUS_COUNTERS = {
+    'laboratory.labtestrequest': [(PENDING_LAB_PAYMENTS, 'PAYMENT_PENDING')],
+    'pharmacy.prescription': [(PENDING_PRESCRIPTIONS, 'PENDING')],
+}
+
+# Upper bound on how long a drifted count can survive without a rebuild
+COUNTER_TIMEOUT = getattr(settings, 'BADGE_COUNTER_TIMEOUT', 60 * 60)
+
+
+def cache_is_shared():
+    """Whether other processes see the counts this one caches"""
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def cache_key(counter, user_id=None):
+    if user_id is None:
+        return f'badge:{counter}'
+    return f'badge:{counter}:{user_id}'
+
+
+def counter_queryset(counter, user_id=None):
+    """The rows a counter stands in for"""
+    from .models import Notification
+    from laboratory.models import LabTestRequest
+    from pharmacy.models import Prescription
+
+    if counter == UNREAD_NOTIFICATIONS:
+        return Notification.objects.filter(recipient_id=user_id, is_read=False)
+    if counter == PENDING_LAB_PAYMENTS:
+        return LabTestRequest.objects.filter(status=LabTestRequest.Status.PAYMENT_PENDING)
+    if counter == PENDING_MEDICINE_PAYMENTS:
+        return Prescription.objects.filter(
+            status=Prescription.Status.DISPENSED
+        ).exclude(
+            visit__payment__payment_type='MEDICINE',
+            visit__payment__status='COMPLETED'
+        )
+    if counter == PENDING_PRESCRIPTIONS:
+        return Prescription.objects.filter(status=Prescription.Status.PENDING)
+    raise ValueError(f'Unknown counter: {counter}')
+
+
+def count_from_db(counter, user_id=None):
+    """Run the query a counter stands in for"""
+    return counter_queryset(counter, user_id).count()
+
+
+def get_count(counter, user_id=None):
+    key = cache_key(counter, user_id)
+    value = cache.get(key)
+    if value is None:
+        value = count_from_db(counter, user_id)
+        cache.set(key, value, COUNTER_TIMEOUT)
+    return value
+
+
+def set_count(counter, value, user_id=None):
+    cache.set(cache_key(counter, user_id), value, COUNTER_TIMEOUT)
+
+
+def adjust(counter, delta, user_id=None):
+    """Apply ``delta`` to a cached counter once the current transaction commits"""
+    if not delta:
+        return
+    key = cache_key(counter, user_id)
+
+    def apply():
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            # Not cached right now; the next read rebuilds it from the database
+            pass
+
+    transaction.on_commit(apply)
+
+
+def adjust_many(counter, user_ids, delta=1):
+    """Apply the same per-user ``delta`` to several users' counters"""
+    for user_id in user_ids:
+        adjust(counter, delta, user_id=user_id)
+
+
+def adjust_status(counter, counted_status, old_status, new_status):
+    """Move a global status counter when a row leaves or enters the counted status"""
+    if old_status == new_status:
+        return
+    if old_status == counted_status:
+        adjust(counter, -1)
+    elif new_status == counted_status:
+        adjust(counter, 1)
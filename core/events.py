@@ -0,0 +1,186 @@
+"""Live queue events pushed to browsers over Server-Sent Events.
+
+Workflow changes are published to named channels once their transaction
+commits: ``doctor:<user id>`` for a doctor's own worklist and
+``role:<ROLE>`` for the reception, lab, pharmacy and cashier queues.
+``core.views.event_stream`` subscribes a browser to its channels and
+relays each message, so open worklists refresh when something changes
+instead of polling.
+
+Delivery goes through a backend chosen by the ``EVENTS_BACKEND`` setting.
+The default ``InProcessBackend`` only reaches subscribers connected to the
+same process; a multi-process deployment needs a backend with the same
+``publish`` / ``subscribe`` interface over a shared broker.
+"""
+import asyncio
+import json
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+# Messages a slow subscriber may fall behind by before it is told to resync
+QUEUE_SIZE = 100
+
+# Which role's queue a visit or lab request belongs to in each status.
+# Reception follows every open visit, so it hears about all visit changes.
+VISIT_QUEUES = {
+    'LAB_REQUESTED': 'CASHIER',
+    'PRESCRIPTION_READY': 'PHARMACIST',
+    'MEDICINE_DISPENSED': 'CASHIER',
+}
+LAB_REQUEST_QUEUES = {
+    'PAYMENT_PENDING': 'CASHIER',
+    'PAYMENT_COMPLETED': 'LAB_TECH',
+    'IN_PROGRESS': 'LAB_TECH',
+}
+
+
+def doctor_channel(user_id):
+    return f'doctor:{user_id}'
+
+
+def role_channel(role):
+    return f'role:{role}'
+
+
+def channels_for(user):
+    """Channels a user's browser listens on"""
+    if user.role == 'DOCTOR':
+        return [doctor_channel(user.pk)]
+    if user.role == 'ADMIN' or user.is_superuser:
+        roles = {'RECEPTIONIST'} | set(VISIT_QUEUES.values()) | set(LAB_REQUEST_QUEUES.values())
+        return [role_channel(role) for role in roles]
+    return [role_channel(user.role)]
+
+
+class Subscription:
+    """One stream's queue of messages, bound to the event loop that reads it"""
+    def __init__(self, backend, channels):
+        self.backend = backend
+        self.channels = list(channels)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+
+    def deliver(self, message):
+        """Queue a message; runs on the subscriber's event loop"""
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # The client re-fetches its page on resync, so the backlog is moot
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({'event': 'resync', 'data': {}})
+
+    async def get(self, timeout=None):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        self.backend.unsubscribe(self)
+
+
+class InProcessBackend:
+    """Fan messages out to subscribers connected to this process"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, channels):
+        subscription = Subscription(self, channels)
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[channel]
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            # Publishers run in request threads; hand over to the subscriber's loop
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, message)
+            except RuntimeError:
+                # Loop already closed; the stream is going away
+                subscription.close()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                path = getattr(settings, 'EVENTS_BACKEND', 'core.events.InProcessBackend')
+                _backend = import_string(path)()
+    return _backend
+
+
+def publish(channels, event, data):
+    """Send ``event`` to ``channels`` once the current transaction commits"""
+    channels = set(channels)
+    if not channels:
+        return
+    message = {'event': event, 'data': data}
+
+    def send():
+        backend = get_backend()
+        for channel in channels:
+            backend.publish(channel, message)
+
+    transaction.on_commit(send)
+
+
+def format_sse(message):
+    return f"event: {message['event']}\ndata: {json.dumps(message['data'])}\n\n"
+
+
+def visit_changed(visit, old_status, old_doctor_id=None):
+    """Tell the doctors and role queues affected by a visit's change"""
+    channels = {doctor_channel(visit.assigned_doctor_id), role_channel('RECEPTIONIST')}
+    if old_doctor_id:
+        channels.add(doctor_channel(old_doctor_id))
+    for status in (old_status, visit.status):
+        if status in VISIT_QUEUES:
+            channels.add(role_channel(VISIT_QUEUES[status]))
+    publish(channels, 'visit', {
+        'visit_id': visit.visit_id,
+        'from': old_status,
+        'to': visit.status,
+    })
+
+
+def publish_visit_change(sender, instance, created, raw=False, **kwargs):
+    """post_save for Visit"""
+    changes = instance.changed_fields
+    if raw or not ({'status', 'assigned_doctor'} & changes.keys()):
+        return
+    visit_changed(instance, changes.get('status', instance.status), changes.get('assigned_doctor'))
+
+
+def publish_lab_request_change(sender, instance, created, raw=False, **kwargs):
+    """post_save for LabTestRequest: tell the requesting doctor and the lab/cashier queues"""
+    if raw or 'status' not in instance.changed_fields:
+        return
+    old_status = instance.changed_fields['status']
+    channels = {doctor_channel(instance.requested_by_id)}
+    for status in (old_status, instance.status):
+        if status in LAB_REQUEST_QUEUES:
+            channels.add(role_channel(LAB_REQUEST_QUEUES[status]))
+    publish(channels, 'lab_request', {
+        'request_id': instance.request_id,
+        'from': old_status,
+        'to': instance.status,
+    })
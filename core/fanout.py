@@ -0,0 +1,93 @@
+"""Bulk notification fan-out.
+
+Role-wide notifications ("new lab request" to every lab tech, ...) are
+written with a single ``bulk_create`` after the triggering transaction
+commits, using a cached roster of each role's active staff. That keeps
+one INSERT per event instead of one per recipient, and none of it runs
+while the request still holds the write lock.
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from . import counters
+
+ROSTER_TIMEOUT = getattr(settings, 'ROLE_ROSTER_TIMEOUT', 60 * 15)
+
+
+def _roster_key(role):
+    return f'role_roster:{role}'
+
+
+def role_roster(role):
+    """IDs of the active users holding ``role``"""
+    from users.models import User
+
+    key = _roster_key(role)
+    user_ids = cache.get(key)
+    if user_ids is None:
+        user_ids = list(
+            User.objects.filter(role=role, is_active=True).values_list('id', flat=True)
+        )
+        cache.set(key, user_ids, ROSTER_TIMEOUT)
+    return user_ids
+
+
+def invalidate_role_rosters(sender, instance, **kwargs):
+    """Drop every cached roster when a user is saved or deleted.
+
+    A save can change the role or the active flag, and the previous role is
+    not known here, so all rosters are dropped; there are only a handful.
+    """
+    from users.models import User
+
+    cache.delete_many([_roster_key(role) for role in User.Role.values])
+
+
+def _create_each(notifications):
+    from .models import Notification
+
+    if not notifications:
+        return
+    Notification.objects.bulk_create([
+        Notification(
+            recipient_id=user_id,
+            notification_type=notification_type,
+            title=title,
+            message=message,
+            related_object_id=related_object_id,
+        )
+        for user_id, notification_type, title, message, related_object_id in notifications
+    ])
+    # bulk_create does not send post_save, so keep the badges in step here
+    for user_id, count in Counter(notification[0] for notification in notifications).items():
+        counters.adjust(counters.UNREAD_NOTIFICATIONS, count, user_id=user_id)
+
+
+def _create(user_ids, notification_type, title, message, related_object_id):
+    _create_each([
+        (user_id, notification_type, title, message, related_object_id) for user_id in user_ids
+    ])
+
+
+def notify_users(user_ids, notification_type, title, message, related_object_id=''):
+    """Send the same notification to ``user_ids`` once the transaction commits"""
+    user_ids = list(user_ids)
+    transaction.on_commit(
+        lambda: _create(user_ids, notification_type, title, message, related_object_id)
+    )
+
+
+def notify_role(role, notification_type, title, message, related_object_id=''):
+    """Send the same notification to every active user of ``role`` once the transaction commits"""
+    transaction.on_commit(
+        lambda: _create(role_roster(role), notification_type, title, message, related_object_id)
+    )
+
+
+def notify_each(notifications):
+    """Send ``[(user id, type, title, message, related_object_id), ...]`` in one INSERT once the transaction commits"""
+    notifications = list(notifications)
+    transaction.on_commit(lambda: _create_each(notifications))
@@ -0,0 +1,78 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from core.middleware import QueryRecorder
+from users.models import User
+
+# (label, URL name, query string, role that normally uses the page)
+SCENARIOS = [
+    ('dashboard', 'dashboard', '', User.Role.ADMIN),
+    ('patient_list', 'patient_list', '', User.Role.RECEPTIONIST),
+    ('patient_search', 'patient_list', 'q=abe', User.Role.RECEPTIONIST),
+    ('payment_list', 'payment_list', '', User.Role.ADMIN),
+    ('financial_reports (monthly)', 'financial_reports', 'period=monthly', User.Role.ADMIN),
+    ('financial_reports (yearly)', 'financial_reports', 'period=yearly', User.Role.ADMIN),
+    ('lab_requests_list', 'lab_requests_list', '', User.Role.ADMIN),
+    ('pharmacy_dashboard', 'pharmacy_dashboard', '', User.Role.PHARMACIST),
+]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = 'Drive the main views through the test client and report p50/p95 latency and query counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20, help='Timed requests per view')
+        parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per view first')
+        parser.add_argument('--only', nargs='*', default=None, help='Only run scenarios whose label contains one of these')
+
+    def handle(self, *args, **options):
+        users = {}
+        for role in {scenario[3] for scenario in SCENARIOS}:
+            user = User.objects.filter(role=role, is_active=True).order_by('id').first()
+            if user is None:
+                raise CommandError(f'No active {role} user; run seed_clinic first')
+            users[role] = user
+
+        scenarios = SCENARIOS
+        if options['only']:
+            scenarios = [s for s in SCENARIOS if any(word in s[0] for word in options['only'])]
+
+        self.stdout.write(f"{'view':<30} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'queries':>8}")
+        with override_settings(ALLOWED_HOSTS=['*'], QUERY_BUDGET_ENFORCE=False):
+            for label, url_name, query, role in scenarios:
+                client = Client()
+                client.force_login(users[role])
+                url = reverse(url_name) + (f'?{query}' if query else '')
+
+                for _ in range(options['warmup']):
+                    client.get(url)
+
+                timings, query_counts = [], []
+                for _ in range(options['iterations']):
+                    # Not CaptureQueriesContext: request_started resets
+                    # connection.queries mid-request, so it would report 0
+                    recorder = QueryRecorder()
+                    with connection.execute_wrapper(recorder):
+                        start = time.perf_counter()
+                        response = client.get(url)
+                        timings.append((time.perf_counter() - start) * 1000)
+                    query_counts.append(recorder.count)
+                    if response.status_code != 200:
+                        raise CommandError(f'{label}: HTTP {response.status_code}')
+
+                self.stdout.write(
+                    f'{label:<30} {percentile(timings, 0.5):>9.1f} {percentile(timings, 0.95):>9.1f} '
+                    f'{max(timings):>9.1f} {statistics.median(query_counts):>8.0f}'
+                )
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from core import query_plans
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN every registered hot query and fail if any plan scans a whole table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'names',
+            nargs='*',
+            help='Only check these registered queries',
+        )
+        parser.add_argument(
+            '--show-plans',
+            action='store_true',
+            help='Print the full plan of every query',
+        )
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        if vendor not in query_plans.FULL_SCAN_PATTERNS:
+            raise CommandError(f'Plan checks are not supported on {vendor}')
+
+        names = options['names'] or sorted(query_plans.HOT_QUERIES)
+        unknown = set(names) - set(query_plans.HOT_QUERIES)
+        if unknown:
+            raise CommandError(f"Unknown queries: {', '.join(sorted(unknown))}")
+
+        failures = []
+        for name in names:
+            build, allow_scan = query_plans.HOT_QUERIES[name]
+            scans, plan = query_plans.full_scans(build(), vendor, allow_scan)
+            if scans:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(f"{name}: full scan of {', '.join(scans)}"))
+            else:
+                self.stdout.write(f'{name}: ok')
+            if scans or options['show_plans']:
+                for line in plan.splitlines():
+                    self.stdout.write(f'    {line}')
+
+        if failures:
+            raise CommandError(f'{len(failures)} hot quer{"y" if len(failures) == 1 else "ies"} fell back to a table scan')
+        self.stdout.write(self.style.SUCCESS(f'All {len(names)} hot queries use an index'))
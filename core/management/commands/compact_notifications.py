@@ -0,0 +1,89 @@
+import json
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from core.models import Notification
+
+ARCHIVE_FIELDS = (
+    'id', 'recipient_id', 'notification_type', 'title', 'message',
+    'related_object_id', 'created_at', 'read_at',
+)
+
+
+class Command(BaseCommand):
+    help = 'Delete (optionally archiving) read notifications older than the retention period, in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=getattr(settings, 'NOTIFICATION_RETENTION_DAYS', 90),
+            help='Keep read notifications younger than this many days',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Rows deleted per transaction (default 1000)',
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0.1,
+            help='Seconds to sleep between batches so other writers get the lock',
+        )
+        parser.add_argument(
+            '--archive',
+            metavar='FILE',
+            help='Append each deleted notification to FILE as a JSON line first',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only count what would be removed',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        expired = Notification.objects.filter(is_read=True, created_at__lt=cutoff)
+
+        if options['dry_run']:
+            self.stdout.write(f'{expired.count()} read notification(s) older than {cutoff:%Y-%m-%d} would be removed')
+            return
+
+        archive = open(options['archive'], 'a', encoding='utf-8') if options['archive'] else None
+        removed = 0
+        last_id = 0
+        try:
+            while True:
+                # Walk forward by id so each batch is a short primary-key range
+                batch = list(
+                    expired.filter(id__gt=last_id).order_by('id')
+                    .values(*ARCHIVE_FIELDS)[:options['batch_size']]
+                )
+                if not batch:
+                    break
+                last_id = batch[-1]['id']
+
+                if archive:
+                    for row in batch:
+                        archive.write(json.dumps(row, default=str) + '\n')
+                    archive.flush()
+
+                with transaction.atomic():
+                    removed += Notification.objects.filter(
+                        id__in=[row['id'] for row in batch], is_read=True
+                    ).delete()[0]
+
+                if options['pause']:
+                    time.sleep(options['pause'])
+        finally:
+            if archive:
+                archive.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Removed {removed} read notification(s) older than {cutoff:%Y-%m-%d}'
+        ))
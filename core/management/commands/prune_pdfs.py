@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from core import pdf
+
+
+class Command(BaseCommand):
+    help = 'Delete stored lab report and receipt PDFs that have not been served for the retention period'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.PDF_RETENTION_DAYS,
+            help='Keep PDFs served or rendered within this many days',
+        )
+
+    def handle(self, *args, **options):
+        removed = pdf.prune(options['days'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Removed {removed} PDF(s) unused for {options['days']} day(s); they re-render on demand"
+        ))
@@ -0,0 +1,59 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from core import counters
+from core.models import Notification
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the cached sidebar badge counters from the database and report drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report drift, do not overwrite the cached values',
+        )
+
+    def handle(self, *args, **options):
+        if not counters.cache_is_shared():
+            # This process's cache is not the one the web workers read
+            raise CommandError(
+                'The default cache is private to each process, so there are no shared counters to check '
+                'or rebuild. Configure a shared cache (CACHE_BACKEND) first.'
+            )
+        dry_run = options['dry_run']
+        drifted = 0
+
+        expected = {}
+        for counter in counters.GLOBAL_COUNTERS:
+            expected[counters.cache_key(counter)] = counters.count_from_db(counter)
+
+        # One grouped query for every user's unread count
+        unread = dict(
+            Notification.objects.filter(is_read=False)
+            .values_list('recipient_id')
+            .annotate(total=Count('id'))
+        )
+        for user_id in User.objects.values_list('id', flat=True):
+            key = counters.cache_key(counters.UNREAD_NOTIFICATIONS, user_id)
+            expected[key] = unread.get(user_id, 0)
+
+        cached = cache.get_many(list(expected))
+        for key, value in expected.items():
+            if key in cached and cached[key] != value:
+                drifted += 1
+                self.stdout.write(
+                    self.style.WARNING(f'{key}: cached {cached[key]}, actual {value}')
+                )
+
+        if not dry_run:
+            cache.set_many(expected, counters.COUNTER_TIMEOUT)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Checked {len(expected)} counters, {drifted} drifted'
+                + ('' if dry_run else ', all rebuilt')
+            )
+        )
@@ -0,0 +1,344 @@
+import random
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from billing.models import Payment
+from core import counters
+from core.models import Notification
+from laboratory.models import LabTestRequest, LabTestType
+from patients.models import Patient, Visit
+from pharmacy.models import Medicine, Prescription, PrescriptionItem
+from users.models import User
+
+FIRST_NAMES = ['Abebe', 'Almaz', 'Bekele', 'Chaltu', 'Dawit', 'Eleni', 'Fikadu', 'Genet', 'Hana',
+               'Kebede', 'Lemlem', 'Meron', 'Mulugeta', 'Selam', 'Tadesse', 'Tigist', 'Yonas', 'Zeritu']
+LAST_NAMES = ['Alemu', 'Bekele', 'Dadi', 'Gemechu', 'Girma', 'Haile', 'Kassa', 'Mekonnen',
+              'Negash', 'Tesfaye', 'Tolosa', 'Wolde', 'Worku', 'Yilma']
+LAB_TESTS = [('Complete Blood Count', 150, 2), ('Blood Glucose', 80, 1), ('Urinalysis', 100, 2),
+             ('Lipid Panel', 250, 6), ('Liver Function Test', 300, 12), ('Malaria Smear', 90, 1),
+             ('Stool Examination', 70, 3), ('HIV Rapid Test', 120, 1)]
+
+# Visit statuses in workflow order; a seeded visit stops at one of them
+STAGES = list(Visit.Status.values)
+STAGE = {status: index for index, status in enumerate(STAGES)}
+
+# Models whose auto_now/auto_now_add timestamps are back-dated while seeding
+TIMESTAMPED_MODELS = [Patient, Visit, LabTestRequest, Prescription, Payment, Notification]
+
+
+@contextmanager
+def explicit_timestamps(models):
+    """Let bulk_create keep the timestamps we generate instead of 'now'"""
+    changed = []
+    for model in models:
+        for field in model._meta.concrete_fields:
+            for attr in ('auto_now', 'auto_now_add'):
+                if getattr(field, attr, False):
+                    setattr(field, attr, False)
+                    changed.append((field, attr))
+    try:
+        yield
+    finally:
+        for field, attr in changed:
+            setattr(field, attr, True)
+
+
+class Command(BaseCommand):
+    help = 'Bulk-seed a synthetic clinic (patients, visits in every status, labs, prescriptions, payments, notifications)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=10000, help='Number of patients to create')
+        parser.add_argument('--max-visits', type=int, default=3, help='Maximum visits per patient')
+        parser.add_argument('--days', type=int, default=365, help='Spread activity over this many past days')
+        parser.add_argument('--staff', type=int, default=5, help='Staff members per role')
+        parser.add_argument('--medicines', type=int, default=300, help='Medicines in the catalogue')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Patients generated per batch')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for a reproducible dataset')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.days = options['days']
+        self.max_visits = options['max_visits']
+        self.now = timezone.now()
+        # Keeps business keys of repeated runs apart
+        self.tag = format(int(time.time()) % 16 ** 5, '05X')
+        self.sequence = {}
+        started = time.perf_counter()
+
+        with explicit_timestamps(TIMESTAMPED_MODELS):
+            self.staff = self.seed_staff(options['staff'])
+            self.test_types = self.seed_test_types()
+            self.medicines = self.seed_medicines(options['medicines'])
+
+            total, batch_size = options['patients'], options['batch_size']
+            created = 0
+            for offset in range(0, total, batch_size):
+                count = min(batch_size, total - offset)
+                with transaction.atomic():
+                    created += self.seed_batch(count)
+                self.stdout.write(f'  {offset + count}/{total} patients ({created} rows)')
+
+        self.stdout.write('Rebuilding derived tables...')
+        call_command('reconcile_daily_revenue', all=True, stdout=self.stdout)
+        if counters.cache_is_shared():
+            call_command('rebuild_badge_counters', stdout=self.stdout)
+        # bulk_create skips the ledger; book the seeded stock as opening balances
+        call_command('reconcile_stock', fix=True, stdout=self.stdout)
+        call_command('forecast_stock', stdout=self.stdout)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {created} rows in {time.perf_counter() - started:.1f}s (run tag {self.tag})'
+        ))
+
+    # Reference data
+
+    def seed_staff(self, per_role):
+        password = make_password('clinic-seed')
+        users = [
+            User(
+                username=f'seed_{role.lower()}_{n}',
+                email=f'seed_{role.lower()}_{n}@example.com',
+                first_name=role.title().replace('_', ' '),
+                last_name=str(n),
+                role=role,
+                password=password,
+            )
+            for role in User.Role.values
+            for n in range(1, per_role + 1)
+        ]
+        User.objects.bulk_create(users, ignore_conflicts=True)
+        staff = {}
+        for user in User.objects.filter(username__startswith='seed_').only('id', 'role'):
+            staff.setdefault(user.role, []).append(user.id)
+        return staff
+
+    def seed_test_types(self):
+        types = []
+        for name, price, hours in LAB_TESTS:
+            test_type, _ = LabTestType.objects.get_or_create(
+                name=name, defaults={'price': price, 'turnaround_time': hours}
+            )
+            types.append(test_type)
+        return types
+
+    def seed_medicines(self, count):
+        categories = Medicine.Category.values
+        medicines = Medicine.objects.bulk_create([
+            Medicine(
+                medicine_id=f'SM{self.tag}{n:05d}',
+                name=f'Medicine {self.tag}-{n}',
+                generic_name=f'Generic {n % 97}',
+                category=self.rng.choice(categories),
+                quantity_in_stock=self.rng.randint(0, 2000),
+                reorder_level=self.rng.choice([10, 20, 50]),
+                unit_price=Decimal(self.rng.randint(5, 500)),
+                strength=f'{self.rng.choice([50, 100, 250, 500])}mg',
+            )
+            for n in range(count)
+        ])
+        return [(medicine.id, medicine.unit_price) for medicine in medicines]
+
+    # Helpers
+
+    def next_key(self, prefix):
+        value = self.sequence.get(prefix, 0) + 1
+        self.sequence[prefix] = value
+        return f'{prefix}{self.tag}{value:08d}'
+
+    def pick(self, role):
+        return self.rng.choice(self.staff[role])
+
+    def moment(self):
+        return self.now - timedelta(seconds=self.rng.randint(0, self.days * 86400))
+
+    def later(self, when, max_minutes=120):
+        return min(when + timedelta(minutes=self.rng.randint(5, max_minutes)), self.now)
+
+    # Transactional data
+
+    def seed_batch(self, count):
+        rng = self.rng
+        patients = []
+        for _ in range(count):
+            created_at = self.moment()
+            patients.append(Patient(
+                patient_id=self.next_key('SP'),
+                first_name=rng.choice(FIRST_NAMES),
+                last_name=rng.choice(LAST_NAMES),
+                date_of_birth=date(rng.randint(1940, 2020), rng.randint(1, 12), rng.randint(1, 28)),
+                gender=rng.choice('MF'),
+                phone=f'+2519{rng.randint(10000000, 99999999)}',
+                address='Shashemene',
+                created_by_id=self.pick(User.Role.RECEPTIONIST),
+                created_at=created_at,
+                updated_at=created_at,
+            ))
+        Patient.objects.bulk_create(patients)
+
+        payments, visits = [], []
+        for patient in patients:
+            payments.append(self.payment(patient.id, None, Payment.PaymentType.REGISTRATION,
+                                         Decimal('50.00'), patient.created_at, completed=True))
+            when = patient.created_at
+            for _ in range(rng.randint(1, self.max_visits)):
+                when = self.later(when, 60 * 24 * 30)
+                visits.append(Visit(
+                    visit_id=self.next_key('SV'),
+                    patient_id=patient.id,
+                    assigned_doctor_id=self.pick(User.Role.DOCTOR),
+                    status=rng.choice(STAGES),
+                    symptoms='Seeded visit',
+                    registration_time=when,
+                    doctor_assigned_time=when,
+                    created_at=when,
+                ))
+        Visit.objects.bulk_create(visits)
+
+        lab_requests, prescriptions, notifications = [], [], []
+        for visit in visits:
+            stage = STAGE[visit.status]
+            notifications.append(self.notification(
+                visit.assigned_doctor_id, Notification.NotificationType.SYSTEM,
+                'New Patient Assigned', visit.visit_id, visit.created_at,
+            ))
+            if stage >= STAGE[Visit.Status.LAB_REQUESTED]:
+                lab_requests.append(self.lab_request(visit, stage))
+            if stage >= STAGE[Visit.Status.PRESCRIPTION_READY]:
+                prescriptions.append(self.prescription(visit, stage))
+            if stage == STAGE[Visit.Status.COMPLETED]:
+                visit.completion_time = self.later(visit.created_at, 600)
+        LabTestRequest.objects.bulk_create(lab_requests)
+        Prescription.objects.bulk_create(prescriptions)
+        Visit.objects.bulk_update(
+            [visit for visit in visits if visit.lab_request_time or visit.prescription_time],
+            ['lab_request_time', 'lab_completion_time', 'prescription_time', 'completion_time'],
+            batch_size=500,
+        )
+
+        visits_by_id = {visit.id: visit for visit in visits}
+        for lab_request in lab_requests:
+            visit = visits_by_id[lab_request.visit_id]
+            if lab_request.payment_completed_at:
+                payments.append(self.payment(
+                    visit.patient_id, visit.id, Payment.PaymentType.LAB_TEST,
+                    lab_request.test_type.price, lab_request.payment_completed_at,
+                    completed=True, lab_request_id=lab_request.id,
+                ))
+            notifications.append(self.notification(
+                self.pick(User.Role.LAB_TECH), Notification.NotificationType.LAB_REQUEST,
+                'New Lab Test Request', lab_request.request_id, lab_request.requested_at,
+            ))
+
+        items = []
+        for prescription in prescriptions:
+            visit = visits_by_id[prescription.visit_id]
+            medicines = rng.sample(self.medicines, rng.randint(1, min(4, len(self.medicines))))
+            total = Decimal('0')
+            for medicine_id, unit_price in medicines:
+                quantity = rng.randint(1, 30)
+                items.append(PrescriptionItem(
+                    prescription_id=prescription.id, medicine_id=medicine_id, quantity=quantity,
+                    dosage='1 tablet twice daily', duration='7 days',
+                    unit_price=unit_price, total_price=unit_price * quantity,
+                ))
+                total += unit_price * quantity
+            prescription.total_cost = total
+            if prescription.status != Prescription.Status.PENDING:
+                payments.append(self.payment(
+                    visit.patient_id, visit.id, Payment.PaymentType.MEDICINE, total,
+                    prescription.reviewed_at,
+                    completed=prescription.status == Prescription.Status.DISPENSED,
+                    prescription_id=prescription.id,
+                ))
+            notifications.append(self.notification(
+                self.pick(User.Role.PHARMACIST), Notification.NotificationType.PRESCRIPTION,
+                'New Prescription', prescription.prescription_id, prescription.created_at,
+            ))
+        PrescriptionItem.objects.bulk_create(items)
+        Prescription.objects.bulk_update(prescriptions, ['total_cost'], batch_size=500)
+        Payment.objects.bulk_create(payments)
+        Notification.objects.bulk_create(notifications)
+
+        return (len(patients) + len(visits) + len(lab_requests) + len(prescriptions)
+                + len(items) + len(payments) + len(notifications))
+
+    def lab_request(self, visit, stage):
+        rng = self.rng
+        test_type = rng.choice(self.test_types)
+        requested_at = self.later(visit.created_at)
+        lab_request = LabTestRequest(
+            request_id=self.next_key('SL'),
+            visit_id=visit.id,
+            test_type=test_type,
+            requested_by_id=visit.assigned_doctor_id,
+            status=LabTestRequest.Status.PAYMENT_PENDING,
+            requested_at=requested_at,
+        )
+        visit.lab_request_time = requested_at
+        if stage >= STAGE[Visit.Status.LAB_IN_PROGRESS]:
+            lab_request.payment_completed_at = self.later(requested_at, 60)
+            lab_request.started_at = self.later(lab_request.payment_completed_at, 60)
+            lab_request.assigned_to_id = self.pick(User.Role.LAB_TECH)
+            lab_request.status = LabTestRequest.Status.IN_PROGRESS
+        if stage >= STAGE[Visit.Status.LAB_COMPLETED]:
+            lab_request.completed_at = self.later(lab_request.started_at, test_type.turnaround_time * 60 + 30)
+            lab_request.status = LabTestRequest.Status.COMPLETED
+            lab_request.result_value = str(rng.randint(1, 200))
+            lab_request.is_abnormal = rng.random() < 0.15
+            visit.lab_completion_time = lab_request.completed_at
+        return lab_request
+
+    def prescription(self, visit, stage):
+        created_at = self.later(visit.lab_completion_time or visit.created_at)
+        prescription = Prescription(
+            prescription_id=self.next_key('SR'),
+            visit_id=visit.id,
+            prescribed_by_id=visit.assigned_doctor_id,
+            status=Prescription.Status.PENDING,
+            created_at=created_at,
+        )
+        visit.prescription_time = created_at
+        if stage >= STAGE[Visit.Status.MEDICINE_DISPENSED]:
+            prescription.status = Prescription.Status.READY
+            prescription.reviewed_at = self.later(created_at, 60)
+        if stage == STAGE[Visit.Status.COMPLETED]:
+            prescription.status = Prescription.Status.DISPENSED
+            prescription.dispensed_at = self.later(prescription.reviewed_at, 60)
+        return prescription
+
+    def payment(self, patient_id, visit_id, payment_type, amount, when, completed, **related):
+        return Payment(
+            payment_id=self.next_key('SY'),
+            receipt_number=self.next_key('SC'),
+            patient_id=patient_id,
+            visit_id=visit_id,
+            payment_type=payment_type,
+            payment_method=self.rng.choice(['CASH', 'CARD', 'MOBILE']) if completed else Payment.PaymentMethod.PENDING,
+            amount=amount,
+            status=Payment.Status.COMPLETED if completed else Payment.Status.PENDING,
+            processed_by_id=self.pick(User.Role.CASHIER),
+            created_at=when,
+            completed_at=when if completed else None,
+            **related,
+        )
+
+    def notification(self, recipient_id, notification_type, title, related_object_id, when):
+        is_read = self.rng.random() < 0.7
+        return Notification(
+            recipient_id=recipient_id,
+            notification_type=notification_type,
+            title=title,
+            message=f'{title} ({related_object_id})',
+            related_object_id=related_object_id,
+            is_read=is_read,
+            created_at=when,
+            read_at=self.later(when) if is_read else None,
+        )
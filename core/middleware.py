@@ -0,0 +1,144 @@
+"""Per-view query count and latency instrumentation.
+
+Every request runs under a ``connection.execute_wrapper`` that counts
+queries, times them and fingerprints the SQL so repeated statements (the
+usual sign of an N+1 loop) stand out. Totals are kept per URL name in
+process memory, served as JSON by ``core.views.query_stats`` and
+reported to the browser in a ``Server-Timing`` header.
+
+``QUERY_BUDGETS`` maps URL names to the most queries a request may run.
+Going over is logged, and raises ``QueryBudgetExceeded`` when
+``QUERY_BUDGET_ENFORCE`` is on (the default under ``manage.py test``),
+so a regression fails the test suite.
+"""
+import logging
+import re
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+_WHITESPACE = re.compile(r'\s+')
+
+# How many of the most repeated statements to keep per view
+TOP_DUPLICATES = 5
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def fingerprint(sql):
+    """Normalise SQL so the same statement with different parameters matches"""
+    return _WHITESPACE.sub(' ', _IN_LIST.sub('IN (...)', sql)).strip()
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    @property
+    def duplicates(self):
+        return {sql: n for sql, n in self.fingerprints.items() if n > 1}
+
+
+class ViewStats:
+    """Running per-URL-name totals for this process"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def record(self, url_name, recorder, elapsed):
+        with self._lock:
+            stats = self._views.setdefault(url_name, {
+                'requests': 0,
+                'queries': 0,
+                'max_queries': 0,
+                'sql_ms': 0.0,
+                'total_ms': 0.0,
+                'max_ms': 0.0,
+                'duplicates': Counter(),
+            })
+            stats['requests'] += 1
+            stats['queries'] += recorder.count
+            stats['max_queries'] = max(stats['max_queries'], recorder.count)
+            stats['sql_ms'] += recorder.duration * 1000
+            stats['total_ms'] += elapsed * 1000
+            stats['max_ms'] = max(stats['max_ms'], elapsed * 1000)
+            stats['duplicates'].update(recorder.duplicates)
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for url_name, stats in self._views.items():
+                requests = stats['requests']
+                result[url_name] = {
+                    'requests': requests,
+                    'avg_queries': round(stats['queries'] / requests, 2),
+                    'max_queries': stats['max_queries'],
+                    'avg_sql_ms': round(stats['sql_ms'] / requests, 2),
+                    'avg_ms': round(stats['total_ms'] / requests, 2),
+                    'max_ms': round(stats['max_ms'], 2),
+                    'budget': getattr(settings, 'QUERY_BUDGETS', {}).get(url_name),
+                    'duplicate_queries': [
+                        {'sql': sql, 'count': count}
+                        for sql, count in stats['duplicates'].most_common(TOP_DUPLICATES)
+                    ],
+                }
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+
+view_stats = ViewStats()
+
+
+class QueryInstrumentationMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        url_name = (match.url_name if match else None) or 'unresolved'
+        view_stats.record(url_name, recorder, elapsed)
+
+        response['Server-Timing'] = (
+            f'db;dur={recorder.duration * 1000:.1f};desc="{recorder.count} queries", '
+            f'total;dur={elapsed * 1000:.1f}'
+        )
+
+        budget = getattr(settings, 'QUERY_BUDGETS', {}).get(url_name)
+        if budget is not None and recorder.count > budget:
+            message = f'{url_name} ran {recorder.count} queries (budget {budget})'
+            if recorder.duplicates:
+                worst = max(recorder.duplicates, key=recorder.duplicates.get)
+                message += f'; most repeated ({recorder.duplicates[worst]}x): {worst}'
+            if getattr(settings, 'QUERY_BUDGET_ENFORCE', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+        return response
@@ -4,6 +4,60 @@ from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.utils import timezone
 from users.models import User
+from . import counters, fanout
+
+class TrackedFieldsMixin:
+    """Remember the values of ``tracked_fields`` as loaded from the database.
+
+    ``changed_fields`` then reports which of them were modified, with their
+    old values, without re-reading the row. It is accurate inside
+    ``save()`` and post_save handlers and is reset once the save finishes.
+    Fields deferred at load time are not tracked. On a new instance every
+    tracked field counts as changed, with an old value of ``None``.
+    """
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot_tracked_fields()
+        return instance
+
+    def _tracked_attnames(self):
+        return {name: self._meta.get_field(name).attname for name in self.tracked_fields}
+
+    def _snapshot_tracked_fields(self):
+        self._loaded_values = {
+            name: self.__dict__[attname]
+            for name, attname in self._tracked_attnames().items()
+            if attname in self.__dict__
+        }
+
+    @property
+    def changed_fields(self):
+        """``{field name: old value}`` for every tracked field that changed"""
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return {name: None for name in self.tracked_fields}
+        return {
+            name: loaded[name]
+            for name, attname in self._tracked_attnames().items()
+            if name in loaded and loaded[name] != self.__dict__.get(attname)
+        }
+
+    def has_changed(self, name):
+        return name in self.changed_fields
+
+    def old_value(self, name):
+        return getattr(self, '_loaded_values', {}).get(name)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._snapshot_tracked_fields()
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._snapshot_tracked_fields()
 
 class Notification(models.Model):
     class NotificationType(models.TextChoices):
@@ -28,6 +82,14 @@ class Notification(models.Model):
     def __str__(self):
         return f"{self.notification_type} - {self.recipient}"
 
+    class Meta:
+        indexes = [
+            # Unread badge count and the newest-first inbox per user
+            models.Index(fields=['recipient', 'is_read', 'created_at'], name='notification_inbox_idx'),
+            # Keyset pages of a user's whole inbox, see core.views.notifications
+            models.Index(fields=['recipient', '-created_at', '-id'], name='notification_recipient_idx'),
+        ]
+
 class SystemConfig(models.Model):
     key = models.CharField(max_length=100, unique=True)
     value = models.TextField()
@@ -40,44 +102,104 @@ class SystemConfig(models.Model):
     def __str__(self):
         return self.key
 
+class IdSequence(models.Model):
+    """Per-prefix, per-day counter behind the business keys (see core.sequences)"""
+    prefix = models.CharField(max_length=10)
+    day = models.DateField()
+    last_value = models.PositiveIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.prefix} {self.day}: {self.last_value}"
+    
+    class Meta:
+        unique_together = ['prefix', 'day']
+
 # Import here to avoid circular imports
+def update_unread_counter(sender, instance, created, **kwargs):
+    if created and not instance.is_read:
+        counters.adjust(counters.UNREAD_NOTIFICATIONS, 1, user_id=instance.recipient_id)
+
+def update_status_counters(sender, instance, created, raw=False, **kwargs):
+    """Keep the global badge counters in step with status transitions"""
+    if raw or 'status' not in instance.changed_fields:
+        return
+    for counter, counted_status in counters.STATUS_COUNTERS.get(sender._meta.label_lower, ()):
+        counters.adjust_status(
+            counter, counted_status, instance.changed_fields['status'], instance.status
+        )
+
+def update_medicine_payment_counter(sender, instance, created, raw=False, **kwargs):
+    """post_save for Prescription and Payment: dispensed prescriptions whose visit is unpaid.
+
+    A prescription entering DISPENSED adds one unless a completed MEDICINE
+    payment already covers its visit; a MEDICINE payment completing removes
+    one when its visit's prescription was already dispensed (and no other
+    payment covered it). Leaving either status undoes the same.
+    """
+    from billing.models import Payment
+    from pharmacy.models import Prescription
+
+    if raw or 'status' not in instance.changed_fields or instance.visit_id is None:
+        return
+    if sender is Prescription:
+        counted_status, delta = Prescription.Status.DISPENSED, 1
+    elif instance.payment_type == Payment.PaymentType.MEDICINE:
+        counted_status, delta = Payment.Status.COMPLETED, -1
+    else:
+        return
+    entering = instance.status == counted_status
+    if (instance.changed_fields['status'] == counted_status) == entering:
+        return
+
+    paid = Payment.objects.filter(
+        visit_id=instance.visit_id,
+        payment_type=Payment.PaymentType.MEDICINE,
+        status=Payment.Status.COMPLETED,
+    )
+    if sender is Prescription:
+        applies = not paid.exists()
+    else:
+        applies = (
+            Prescription.objects.filter(visit_id=instance.visit_id, status=Prescription.Status.DISPENSED).exists()
+            and not paid.exclude(pk=instance.pk).exists()
+        )
+    if applies:
+        counters.adjust(counters.PENDING_MEDICINE_PAYMENTS, delta if entering else -delta)
+
 def create_lab_notification(sender, instance, created, **kwargs):
     if created:
         from users.models import User
         # Notify lab technicians
-        lab_techs = User.objects.filter(role=User.Role.LAB_TECH, is_active=True)
-        for tech in lab_techs:
-            Notification.objects.create(
-                recipient=tech,
-                notification_type=Notification.NotificationType.LAB_REQUEST,
-                title='New Lab Test Request',
-                message=f'New {instance.test_type.name} requested for {instance.visit.patient}',
-                related_object_id=instance.request_id
-            )
+        fanout.notify_role(
+            User.Role.LAB_TECH,
+            Notification.NotificationType.LAB_REQUEST,
+            title='New Lab Test Request',
+            message=f'New {instance.test_type.name} requested for {instance.visit.patient}',
+            related_object_id=instance.request_id
+        )
 
 def create_lab_result_notification(sender, instance, created, **kwargs):
     if created:
         # Notify the requesting doctor
+        lab_request = instance.lab_request
         Notification.objects.create(
-            recipient=instance.lab_request.requested_by,
+            recipient_id=lab_request.requested_by_id,
             notification_type=Notification.NotificationType.LAB_RESULT,
             title='Lab Test Results Ready',
-            message=f'Results for {instance.lab_request.test_type.name} are ready',
-            related_object_id=instance.lab_request.request_id
+            message=f'Results for {lab_request.test_type.name} are ready for patient {lab_request.visit.patient}',
+            related_object_id=lab_request.request_id
         )
 
 def create_prescription_notification(sender, instance, created, **kwargs):
     if created:
         from users.models import User
         # Notify pharmacists
-        pharmacists = User.objects.filter(role=User.Role.PHARMACIST, is_active=True)
-        for pharmacist in pharmacists:
-            Notification.objects.create(
-                recipient=pharmacist,
-                notification_type=Notification.NotificationType.PRESCRIPTION,
-                title='New Prescription',
-                message=f'New prescription for {instance.visit.patient}',
-                related_object_id=instance.prescription_id
-            )
+        fanout.notify_role(
+            User.Role.PHARMACIST,
+            Notification.NotificationType.PRESCRIPTION,
+            title='New Prescription',
+            message=f'New prescription for {instance.visit.patient}',
+            related_object_id=instance.prescription_id
+        )
 
 # We'll connect these signals in apps.py to avoid circular imports
\ No newline at end of file
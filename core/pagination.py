@@ -0,0 +1,99 @@
+"""Keyset (cursor) pagination for large, newest-first listings.
+
+Offset pagination gets slower the deeper you page because the database
+still has to walk every skipped row. Keyset pagination remembers the
+ordering key of the last row shown and asks for the rows after it, which
+is a single index range scan no matter how far in the user is.
+"""
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def encode_cursor(value, pk):
+    raw = f"{value.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return ``(value, pk)`` or ``None`` for a missing or tampered cursor"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value, pk = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        value = parse_datetime(value)
+        if not isinstance(value, datetime):
+            return None
+        return value, int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def keyset_paginate(queryset, after=None, before=None, per_page=25, field='created_at'):
+    """Return one newest-first page of ``queryset`` ordered by ``(field, pk)``.
+
+    ``after`` continues towards older rows from a ``next_cursor``; ``before``
+    walks back towards newer rows from a ``previous_cursor``. The queryset
+    should be backed by a descending index on ``(field, id)``.
+    """
+    after = decode_cursor(after)
+    before = decode_cursor(before)
+
+    if before is not None:
+        value, pk = before
+        rows = list(
+            queryset.filter(Q(**{f'{field}__gt': value}) | Q(**{field: value, 'pk__gt': pk}))
+            .order_by(field, 'pk')[:per_page + 1]
+        )
+        has_more_newer = len(rows) > per_page
+        rows = rows[:per_page][::-1]
+        has_more_older = True
+    else:
+        if after is not None:
+            value, pk = after
+            queryset = queryset.filter(
+                Q(**{f'{field}__lt': value}) | Q(**{field: value, 'pk__lt': pk})
+            )
+        rows = list(queryset.order_by(f'-{field}', '-pk')[:per_page + 1])
+        has_more_older = len(rows) > per_page
+        rows = rows[:per_page]
+        has_more_newer = after is not None
+
+    next_cursor = previous_cursor = None
+    if rows:
+        if has_more_older:
+            last = rows[-1]
+            next_cursor = encode_cursor(getattr(last, field), last.pk)
+        if has_more_newer:
+            first = rows[0]
+            previous_cursor = encode_cursor(getattr(first, field), first.pk)
+
+    return KeysetPage(rows, next_cursor=next_cursor, previous_cursor=previous_cursor)
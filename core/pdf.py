@@ -0,0 +1,139 @@
+"""Printable PDFs of lab reports and receipts, rendered once and kept.
+
+A document is a template plus a context of plain values read from its
+source rows. The SHA-256 of that context and the template source is the
+document's key, and the PDF is stored under ``MEDIA_ROOT/pdf`` by key:
+editing a source row (or the template) changes the key, so a stale file
+is never served, and an unchanged document is never rendered twice.
+
+WeasyPrint runs on a small thread pool (``PDF_RENDER_WORKERS``), fed by
+the views and by hooks that queue a document as soon as it is final, so
+the first print usually finds the file already there. A view that has to
+wait gives up after ``PDF_RENDER_WAIT`` seconds and shows a page that
+retries, while the render carries on in the background.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from pathlib import Path
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponseNotModified
+from django.shortcuts import render
+from django.template.loader import get_template, render_to_string
+
+logger = logging.getLogger(__name__)
+
+# Served files get their mtime refreshed at most this often, see prune()
+TOUCH_INTERVAL = 24 * 60 * 60
+
+_executor = None
+_executor_lock = threading.Lock()
+# Key -> Future of renders queued or running in this process
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+def root():
+    return Path(settings.MEDIA_ROOT) / 'pdf'
+
+
+def document_key(template_name, context):
+    """Content address of ``template_name`` rendered with ``context``"""
+    digest = hashlib.sha256(get_template(template_name).template.source.encode())
+    digest.update(json.dumps(context, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def stored_path(key):
+    return root() / key[:2] / f'{key}.pdf'
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.PDF_RENDER_WORKERS, thread_name_prefix='pdf-render'
+            )
+        return _executor
+
+
+def _render(template_name, context, path):
+    from weasyprint import HTML
+
+    pdf = HTML(string=render_to_string(template_name, context)).write_pdf()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write beside the target and rename, so readers never see a partial file
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(pdf)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def submit(template_name, context, key=None):
+    """Queue a render unless the document is stored; returns its Future, or None when stored"""
+    key = key or document_key(template_name, context)
+    path = stored_path(key)
+    if path.exists():
+        return None
+    with _pending_lock:
+        future = _pending.get(key)
+        if future is None:
+            future = _pending[key] = _get_executor().submit(_render, template_name, context, path)
+            future.add_done_callback(lambda done: _finished(key, done))
+    return future
+
+
+def _finished(key, future):
+    with _pending_lock:
+        _pending.pop(key, None)
+    if future.exception() is not None:
+        logger.error('Rendering PDF %s failed', key, exc_info=future.exception())
+
+
+def serve(request, template_name, context, filename):
+    """Respond with the stored PDF, waiting briefly for it to render when missing"""
+    key = document_key(template_name, context)
+    path = stored_path(key)
+    future = submit(template_name, context, key)
+    if future is not None:
+        try:
+            # Raises the render's own error if it failed
+            future.result(timeout=settings.PDF_RENDER_WAIT)
+        except TimeoutError:
+            response = render(request, 'core/pdf_pending.html', {'filename': filename}, status=202)
+            response['Retry-After'] = '2'
+            return response
+
+    # The key names the content, so it is a strong validator
+    etag = f'"{key}"'
+    if request.headers.get('If-None-Match') == etag:
+        return HttpResponseNotModified()
+    if time.time() - path.stat().st_mtime > TOUCH_INTERVAL:
+        os.utime(path)
+    response = FileResponse(path.open('rb'), content_type='application/pdf', filename=filename)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, max-age=0, must-revalidate'
+    return response
+
+
+def prune(max_age_days):
+    """Delete stored PDFs not served or rendered for ``max_age_days``; returns how many"""
+    cutoff = time.time() - max_age_days * 24 * 60 * 60
+    removed = 0
+    for path in root().glob('*/*'):
+        # Leftover temp files of interrupted renders go too
+        if path.stat().st_mtime < cutoff:
+            path.unlink(missing_ok=True)
+            removed += 1
+    return removed
@@ -0,0 +1,170 @@
+"""Registry of hot queries whose plans must stay index-backed.
+
+Each entry builds the queryset a view, context processor or counter runs
+on every request, with placeholder filter values. The
+``check_query_plans`` command EXPLAINs every entry and fails when the
+plan reads a whole table, which is how a dropped index or a new filter
+shape without one shows up before it reaches production data.
+"""
+import re
+from datetime import timedelta
+
+from django.utils import timezone
+
+from . import counters
+
+HOT_QUERIES = {}
+
+# Plan lines that mean "read every row of this table", per database vendor
+FULL_SCAN_PATTERNS = {
+    # "SCAN t" is a table scan; "SCAN t USING [COVERING] INDEX i" walks an index
+    'sqlite': re.compile(r'\bSCAN (\w+)\b(?! USING)'),
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+}
+
+
+def register(name, allow_scan=()):
+    """Register a function returning a hot queryset under ``name``.
+
+    ``allow_scan`` lists tables that may be scanned in its plan, for small
+    lookup tables joined in.
+    """
+    def decorator(build):
+        HOT_QUERIES[name] = (build, set(allow_scan))
+        return build
+    return decorator
+
+
+def full_scans(queryset, vendor, allow_scan=()):
+    """Tables read in full by ``queryset``'s plan, and the plan itself"""
+    plan = queryset.explain()
+    pattern = FULL_SCAN_PATTERNS[vendor]
+    tables = {table for table in pattern.findall(plan) if table not in allow_scan}
+    return sorted(tables), plan
+
+
+@register('unread_notifications')
+def _unread_notifications():
+    return counters.counter_queryset(counters.UNREAD_NOTIFICATIONS, user_id=0)
+
+
+@register('notification_inbox')
+def _notification_inbox():
+    from .models import Notification
+    return Notification.objects.filter(recipient_id=0).order_by('-created_at')
+
+
+@register('pending_lab_payments')
+def _pending_lab_payments():
+    return counters.counter_queryset(counters.PENDING_LAB_PAYMENTS)
+
+
+@register('lab_tech_assigned')
+def _lab_tech_assigned():
+    from laboratory.models import LabTestRequest
+    return LabTestRequest.objects.filter(
+        assigned_to_id=0, status=LabTestRequest.Status.PAYMENT_COMPLETED
+    )
+
+
+@register('lab_requests_by_status', allow_scan=('laboratory_labtesttype',))
+def _lab_requests_by_status():
+    from laboratory.models import LabTestRequest
+    return LabTestRequest.objects.filter(
+        status=LabTestRequest.Status.IN_PROGRESS
+    ).select_related('test_type').order_by('-requested_at')
+
+
+@register('lab_dispatch_waiting')
+def _lab_dispatch_waiting():
+    from laboratory.models import LabTestRequest
+    return LabTestRequest.objects.filter(
+        status=LabTestRequest.Status.PAYMENT_COMPLETED, assigned_to__isnull=True
+    ).order_by('requested_at', 'id')[:200]
+
+
+@register('lab_tech_loads', allow_scan=('laboratory_labtesttype',))
+def _lab_tech_loads():
+    from django.db.models import Sum
+    from laboratory.models import LabTestRequest
+    return LabTestRequest.objects.filter(
+        status=LabTestRequest.Status.IN_PROGRESS, assigned_to__isnull=False
+    ).values('assigned_to').annotate(hours=Sum('test_type__turnaround_time')).order_by()
+
+
+@register('lab_sla_newly_overdue')
+def _lab_sla_newly_overdue():
+    from laboratory.models import LabTestRequest
+    return LabTestRequest.objects.filter(
+        status__in=LabTestRequest.SLA_STATUSES, sla_breached_at__isnull=True,
+        sla_deadline__lt=timezone.now(),
+    ).order_by('sla_deadline')[:1000]
+
+
+@register('patient_analyte_trend')
+def _patient_analyte_trend():
+    from laboratory.models import LabResultValue
+    return LabResultValue.objects.filter(
+        patient_id=0, analyte='Hemoglobin', observed_at__gte=timezone.now() - timedelta(days=365)
+    ).order_by('observed_at')
+
+
+@register('pending_prescriptions')
+def _pending_prescriptions():
+    from pharmacy.models import Prescription
+    return Prescription.objects.filter(status=Prescription.Status.PENDING).order_by('-created_at')
+
+
+@register('pending_medicine_payments')
+def _pending_medicine_payments():
+    return counters.counter_queryset(counters.PENDING_MEDICINE_PAYMENTS)
+
+
+@register('payment_list')
+def _payment_list():
+    from billing.views import filter_payments
+    from users.models import User
+    return filter_payments(User(role=User.Role.ADMIN))
+
+
+@register('payment_list_cashier')
+def _payment_list_cashier():
+    from billing.views import filter_payments
+    from users.models import User
+    return filter_payments(User(role=User.Role.CASHIER))
+
+
+@register('doctor_worklist')
+def _doctor_worklist():
+    from patients.models import Visit
+    return Visit.objects.filter(assigned_doctor_id=0, status__in=Visit.OPEN_STATUSES)
+
+
+@register('open_visits')
+def _open_visits():
+    from patients.models import Visit
+    return Visit.objects.filter(status__in=Visit.OPEN_STATUSES).order_by('created_at')
+
+
+@register('report_visit_range')
+def _report_visit_range():
+    from patients.models import Visit
+    now = timezone.now()
+    return Visit.objects.filter(created_at__gte=now - timedelta(days=30), created_at__lt=now)
+
+
+@register('report_lab_range')
+def _report_lab_range():
+    from laboratory.models import LabTestRequest
+    now = timezone.now()
+    return LabTestRequest.objects.filter(requested_at__gte=now - timedelta(days=30), requested_at__lt=now)
+
+
+@register('report_payment_range')
+def _report_payment_range():
+    from billing.models import Payment
+    now = timezone.now()
+    return Payment.objects.filter(
+        created_at__gte=now - timedelta(days=30), created_at__lt=now,
+        status=Payment.Status.COMPLETED,
+    )
@@ -0,0 +1,117 @@
+"""Block-allocated business keys (patient, visit, payment, receipt, ...).
+
+Each key is ``<prefix><yymmdd><n>`` where ``n`` comes from an
+``IdSequence`` row per prefix per day. A worker process reserves a block
+of numbers with one short UPDATE and hands them out from memory, so IDs
+never collide, need no retry loop, and cost no extra query per insert.
+Numbers left in a block when a process exits are simply skipped.
+
+On databases with row locks the reservation runs on its own connection
+in autocommit mode (a dedicated thread's), so the sequence row is locked
+for that single UPDATE only, not until the caller's transaction commits;
+registrations then never queue behind each other's business transactions.
+SQLite locks the whole database for a writing transaction, so a second
+connection could only wait on the caller; there the reservation joins
+the caller's transaction instead.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+BLOCK_SIZE = getattr(settings, 'ID_BLOCK_SIZE', 20)
+
+
+class _Block:
+    def __init__(self, day, start, end):
+        self.day = day
+        self.next_value = start
+        self.end = end
+        self.committed = True
+
+    def confirm(self):
+        self.committed = True
+
+    def is_usable(self, day):
+        if self.day != day or self.next_value > self.end:
+            return False
+        if self.committed:
+            return True
+        # Reserved inside a transaction that has not committed yet. It is only
+        # safe to keep using while that transaction is still open; once it has
+        # rolled back, the same numbers may be reserved again by another worker.
+        return connection.in_atomic_block and any(
+            entry[1] == self.confirm for entry in connection.run_on_commit
+        )
+
+
+_lock = threading.Lock()
+_blocks = {}
+_pid = os.getpid()
+# One thread, so one extra connection per process, for autocommit reservations
+_reserver = None
+
+
+def _advance(prefix, day, size):
+    """Move the sequence on by ``size``; returns the new last value"""
+    from .models import IdSequence
+
+    with transaction.atomic():
+        sequence = IdSequence.objects.filter(prefix=prefix, day=day)
+        if not sequence.update(last_value=F('last_value') + size):
+            _, created = IdSequence.objects.get_or_create(
+                prefix=prefix, day=day, defaults={'last_value': size}
+            )
+            if not created:
+                sequence.update(last_value=F('last_value') + size)
+        return sequence.values_list('last_value', flat=True).get()
+
+
+def _advance_on_own_connection(prefix, day, size):
+    # Runs on the reserver thread, whose connection is never inside a request's transaction
+    close_old_connections()
+    return _advance(prefix, day, size)
+
+
+def _reserve(prefix, day, size):
+    global _reserver
+    if connection.in_atomic_block and connection.vendor != 'sqlite':
+        if _reserver is None:
+            _reserver = ThreadPoolExecutor(max_workers=1, thread_name_prefix='id-sequence')
+        end = _reserver.submit(_advance_on_own_connection, prefix, day, size).result()
+        return _Block(day, end - size + 1, end)
+
+    end = _advance(prefix, day, size)
+    block = _Block(day, end - size + 1, end)
+    if connection.in_atomic_block:
+        block.committed = False
+        transaction.on_commit(block.confirm)
+    return block
+
+
+def next_value(prefix):
+    """Return ``(day, n)`` for the next number of ``prefix`` today"""
+    global _pid, _reserver
+    day = timezone.localdate()
+    with _lock:
+        if os.getpid() != _pid:
+            # Forked worker: blocks reserved by the parent belong to the parent,
+            # and its reserver thread did not survive the fork
+            _blocks.clear()
+            _reserver = None
+            _pid = os.getpid()
+        block = _blocks.get(prefix)
+        if block is None or not block.is_usable(day):
+            block = _blocks[prefix] = _reserve(prefix, day, BLOCK_SIZE)
+        value = block.next_value
+        block.next_value += 1
+    return day, value
+
+
+def next_id(prefix):
+    day, value = next_value(prefix)
+    return f"{prefix}{day.strftime('%y%m%d')}{value:04d}"
@@ -0,0 +1,117 @@
+"""Small factories for the apps' tests: the minimum rows a workflow needs"""
+from datetime import date
+from decimal import Decimal
+from itertools import count
+
+from users.models import User
+
+_serial = count(1)
+
+
+def _next(prefix):
+    return f'{prefix}{next(_serial):06d}'
+
+
+def make_user(role, **fields):
+    username = _next(role.lower())
+    return User.objects.create_user(
+        username=username, email=f'{username}@example.com', password='x',
+        role=role, first_name=fields.pop('first_name', role.title()), last_name=fields.pop('last_name', 'Test'),
+        **fields,
+    )
+
+
+def make_patient(created_by=None, **fields):
+    from patients.models import Patient
+
+    return Patient.objects.create(
+        patient_id=_next('PAT'),
+        first_name=fields.pop('first_name', 'Abebe'),
+        last_name=fields.pop('last_name', 'Kebede'),
+        date_of_birth=date(1990, 1, 1),
+        gender='M',
+        phone='0911000000',
+        address='Addis Ababa',
+        created_by=created_by or make_user(User.Role.RECEPTIONIST),
+        **fields,
+    )
+
+
+def make_visit(doctor=None, patient=None, **fields):
+    from patients.models import Visit
+
+    return Visit.objects.create(
+        visit_id=_next('VIS'),
+        patient=patient or make_patient(),
+        assigned_doctor=doctor or make_user(User.Role.DOCTOR),
+        **fields,
+    )
+
+
+def make_test_type(**fields):
+    from laboratory.models import LabTestType
+
+    fields.setdefault('name', _next('Test '))
+    fields.setdefault('price', Decimal('100.00'))
+    fields.setdefault('turnaround_time', 2)
+    return LabTestType.objects.create(**fields)
+
+
+def make_lab_request(visit=None, test_type=None, **fields):
+    from laboratory.models import LabTestRequest
+
+    visit = visit or make_visit()
+    return LabTestRequest.objects.create(
+        request_id=_next('LAB'),
+        visit=visit,
+        test_type=test_type or make_test_type(),
+        requested_by_id=visit.assigned_doctor_id,
+        **fields,
+    )
+
+
+def make_medicine(**fields):
+    from pharmacy.models import Medicine
+
+    fields.setdefault('name', _next('Medicine '))
+    fields.setdefault('category', Medicine.Category.TABLET)
+    fields.setdefault('unit_price', Decimal('5.00'))
+    return Medicine.objects.create(medicine_id=_next('MED'), **fields)
+
+
+def make_prescription(visit=None, items=(), **fields):
+    """A prescription with ``items`` of (medicine, quantity)"""
+    from pharmacy.models import Prescription, PrescriptionItem
+
+    visit = visit or make_visit()
+    prescription = Prescription.objects.create(
+        prescription_id=_next('PRES'), visit=visit, prescribed_by_id=visit.assigned_doctor_id, **fields
+    )
+    total = Decimal('0')
+    for medicine, quantity in items:
+        PrescriptionItem.objects.create(
+            prescription=prescription, medicine=medicine, quantity=quantity, dosage='1x1', duration='5 days',
+            unit_price=medicine.unit_price, total_price=medicine.unit_price * quantity,
+        )
+        total += medicine.unit_price * quantity
+    if total:
+        prescription.total_cost = total
+        prescription.save(update_fields=['total_cost'])
+    return prescription
+
+
+def make_payment(visit=None, processed_by=None, **fields):
+    from billing.models import Payment
+
+    visit = visit or make_visit()
+    fields.setdefault('payment_type', Payment.PaymentType.REGISTRATION)
+    fields.setdefault('payment_method', Payment.PaymentMethod.CASH)
+    fields.setdefault('amount', Decimal('50.00'))
+    return Payment.objects.create(
+        payment_id=_next('PAY'),
+        receipt_number=_next('RCP'),
+        patient_id=visit.patient_id,
+        visit=visit,
+        processed_by=processed_by or make_user(User.Role.CASHIER),
+        **fields,
+    )
@@ -1,3 +1,363 @@
-from django.test import TestCase
+import json
+import re
+import tempfile
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from billing.models import Payment
+from laboratory.models import LabTestRequest
+from pharmacy.models import DispenseCart, Prescription
+from reports import rollup
+from users.models import User
+
+from . import checks, counters, fanout, query_plans, sequences, views
+from .models import IdSequence, Notification
+from .testing import make_lab_request, make_medicine, make_payment, make_prescription, make_user, make_visit
+
+
+class MedicinePaymentCounterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.prescription = make_prescription(status=Prescription.Status.READY)
+        # Cached, so later changes have to adjust it in place
+        self.assertEqual(counters.get_count(counters.PENDING_MEDICINE_PAYMENTS), 0)
+
+    def dispense(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.prescription.status = Prescription.Status.DISPENSED
+            self.prescription.save()
+
+    def pay(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return make_payment(
+                visit=self.prescription.visit,
+                payment_type=Payment.PaymentType.MEDICINE,
+                status=Payment.Status.COMPLETED,
+                prescription=self.prescription,
+            )
+
+    def assertCounterMatchesDatabase(self, expected):
+        self.assertEqual(counters.get_count(counters.PENDING_MEDICINE_PAYMENTS), expected)
+        self.assertEqual(counters.count_from_db(counters.PENDING_MEDICINE_PAYMENTS), expected)
+
+    def test_dispensing_unpaid_prescription_counts_until_paid(self):
+        self.dispense()
+        self.assertCounterMatchesDatabase(1)
+        self.pay()
+        self.assertCounterMatchesDatabase(0)
+
+    def test_paying_before_dispensing_never_counts(self):
+        self.pay()
+        self.assertCounterMatchesDatabase(0)
+        self.dispense()
+        self.assertCounterMatchesDatabase(0)
+
+    def test_other_payment_types_are_ignored(self):
+        self.dispense()
+        with self.captureOnCommitCallbacks(execute=True):
+            make_payment(visit=self.prescription.visit, status=Payment.Status.COMPLETED)
+        self.assertCounterMatchesDatabase(1)
+
+
+class SharedCacheTests(TestCase):
+    def test_process_local_cache_fails_the_check_when_required(self):
+        with self.settings(REQUIRE_SHARED_CACHE=True):
+            self.assertEqual([error.id for error in checks.check_shared_cache(None)], ['core.E001'])
+        self.assertEqual(checks.check_shared_cache(None), [])
+
+    def test_rebuild_refuses_a_process_local_cache(self):
+        with self.assertRaises(CommandError):
+            call_command('rebuild_badge_counters', stdout=StringIO())
+
+    def test_rebuild_reports_drift_in_a_shared_cache(self):
+        location = tempfile.TemporaryDirectory()
+        self.addCleanup(location.cleanup)
+        backend = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location.name}
+        with self.settings(CACHES={'default': backend}, REQUIRE_SHARED_CACHE=True):
+            self.assertEqual(checks.check_shared_cache(None), [])
+            make_prescription()
+            counters.set_count(counters.PENDING_PRESCRIPTIONS, 5)
+            out = StringIO()
+            call_command('rebuild_badge_counters', stdout=out)
+            self.assertIn('cached 5, actual 1', out.getvalue())
+            self.assertEqual(counters.get_count(counters.PENDING_PRESCRIPTIONS), 1)
+
+
+class SequenceTests(TestCase):
+    def setUp(self):
+        sequences._blocks.clear()
+
+    def test_ids_are_unique_across_blocks(self):
+        with mock.patch.object(sequences, 'BLOCK_SIZE', 3):
+            ids = [sequences.next_id('TST') for _ in range(10)]
+        self.assertEqual(len(set(ids)), 10)
+        self.assertEqual([int(value[-4:]) for value in ids], list(range(1, 11)))
+
+    def test_block_from_rolled_back_transaction_is_not_reused(self):
+        with mock.patch.object(sequences, 'BLOCK_SIZE', 5):
+            try:
+                with transaction.atomic():
+                    first = sequences.next_id('TST')
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            second = sequences.next_id('TST')
+        # The reservation was undone with its transaction, so the process
+        # reserves again instead of handing out numbers from a dead block
+        self.assertEqual(first, second)
+
+
+@skipIf(connection.vendor == 'sqlite', 'SQLite reserves inside the caller\'s transaction')
+class SequenceReservationIsolationTests(TransactionTestCase):
+    def setUp(self):
+        sequences._blocks.clear()
+
+    def tearDown(self):
+        if sequences._reserver is not None:
+            # Let the test database be dropped
+            sequences._reserver.submit(lambda: connection.close()).result()
+
+    def test_reservation_commits_before_the_callers_transaction(self):
+        seen = []
+
+        def read_sequence():
+            seen.append(IdSequence.objects.filter(prefix='TST').values_list('last_value', flat=True).first())
+            connection.close()
+
+        with transaction.atomic():
+            sequences.next_id('TST')
+            reader = threading.Thread(target=read_sequence)
+            reader.start()
+            reader.join()
+        self.assertEqual(seen, [sequences.BLOCK_SIZE])
+
+
+def queries_run(response):
+    """The query count QueryInstrumentationMiddleware reported for ``response``"""
+    return int(re.search(r'"(\d+) queries"', response['Server-Timing']).group(1))
+
+
+@override_settings(QUERY_BUDGET_ENFORCE=True)
+class QueryBudgetTests(TestCase):
+    """Every budgeted view stays in budget, and its query count does not grow with the rows it shows"""
+
+    def setUp(self):
+        cache.clear()
+        self.admin = make_user(User.Role.ADMIN)
+        self.lab_tech = make_user(User.Role.LAB_TECH)
+        self.pharmacist = make_user(User.Role.PHARMACIST)
+        # As on a database whose revenue rollup has been filled
+        rollup.mark_reconciled(timezone.now())
+
+    def seed(self, rows=4):
+        for _ in range(rows):
+            visit = make_visit()
+            make_lab_request(visit=visit)
+            make_lab_request(visit=visit, status=LabTestRequest.Status.IN_PROGRESS, assigned_to=self.lab_tech)
+            make_payment(visit=visit, status=Payment.Status.COMPLETED)
+            prescription = make_prescription(visit=visit, items=[(make_medicine(), 2)])
+            # One prescription per visit
+            ready = make_prescription(status=Prescription.Status.READY)
+            make_payment(
+                visit=ready.visit, payment_type=Payment.PaymentType.MEDICINE, prescription=ready,
+                payment_method=Payment.PaymentMethod.PENDING,
+            )
+            DispenseCart.objects.create(pharmacist=self.admin, prescription=prescription)
+            Notification.objects.create(
+                recipient=self.admin, notification_type=Notification.NotificationType.SYSTEM,
+                title='Seeded', message='Seeded',
+            )
+
+    def assertFlat(self, user, url_name, request=None):
+        request = request or (lambda: self.client.get(reverse(url_name)))
+        self.client.force_login(user)
+        # Warm the badge counters and other per-process caches first
+        self.assertEqual(request().status_code, 200)
+        self.seed()
+        few = request()
+        self.seed()
+        more = request()
+        self.assertEqual(more.status_code, 200)
+        self.assertEqual(queries_run(few), queries_run(more), url_name)
+
+    def test_admin_views(self):
+        for url_name in [
+            'dashboard', 'patient_list', 'payment_list', 'lab_requests_list', 'prescription_list',
+            'pharmacy_dashboard', 'financial_reports', 'notifications', 'visit_queue',
+        ]:
+            with self.subTest(url_name):
+                self.assertFlat(self.admin, url_name)
+
+    def test_cashier_payment_list(self):
+        self.assertFlat(make_user(User.Role.CASHIER), 'payment_list')
+
+    def test_batch_lab_results(self):
+        self.assertFlat(self.lab_tech, 'batch_lab_results')
+
+    def test_cart_batch(self):
+        prescription = make_prescription()
+
+        def add_seeded_medicines():
+            operations = [{'op': 'add', 'medicine_id': make_medicine().pk, 'quantity': 1} for _ in range(4)]
+            return self.client.post(
+                reverse('cart_batch'), json.dumps({'prescription_id': prescription.prescription_id, 'operations': operations}),
+                content_type='application/json',
+            )
+
+        self.assertFlat(self.pharmacist, 'cart_batch', add_seeded_medicines)
+
+
+class BenchmarkViewsTests(TestCase):
+    def test_reports_the_queries_each_request_ran(self):
+        for role in [User.Role.ADMIN, User.Role.RECEPTIONIST, User.Role.PHARMACIST]:
+            make_user(role)
+        out = StringIO()
+        call_command('benchmark_views', iterations=1, warmup=0, only=['dashboard'], stdout=out)
+        rows = dict(line.split(None, 1) for line in out.getvalue().splitlines()[1:])
+        # Session and user lookups at the very least
+        self.assertGreater(int(rows['dashboard'].split()[-1]), 0)
+        self.assertGreater(int(rows['pharmacy_dashboard'].split()[-1]), 0)
+
+
+class EventStreamTests(TestCase):
+    def setUp(self):
+        self.user = make_user(User.Role.CASHIER)
+
+    def test_wsgi_requests_get_no_content(self):
+        self.client.force_login(self.user)
+        with self.settings(LIVE_UPDATES=True):
+            response = self.client.get(reverse('event_stream'))
+        self.assertEqual(response.status_code, 204)
+
+    def test_pages_subscribe_only_with_live_updates(self):
+        self.client.force_login(self.user)
+        self.assertNotContains(self.client.get(reverse('visit_queue')), 'new EventSource(')
+        with self.settings(LIVE_UPDATES=True):
+            self.assertContains(self.client.get(reverse('visit_queue')), 'new EventSource(')
+
+    async def test_asgi_requests_stream_when_enabled(self):
+        await self.async_client.aforce_login(self.user)
+        with self.settings(LIVE_UPDATES=True):
+            response = await self.async_client.get(reverse('event_stream'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+
+class QueryPlanTests(TestCase):
+    def test_registered_queries_are_the_ones_the_code_runs(self):
+        build, _ = query_plans.HOT_QUERIES['pending_medicine_payments']
+        self.assertEqual(
+            str(build().query), str(counters.counter_queryset(counters.PENDING_MEDICINE_PAYMENTS).query)
+        )
+        build, _ = query_plans.HOT_QUERIES['payment_list_cashier']
+        self.assertIn('"billing_payment"."status" = PENDING', str(build().query).replace("'", ''))
+
+    def test_payment_queries_use_an_index(self):
+        call_command(
+            'check_query_plans', 'pending_medicine_payments', 'payment_list', 'payment_list_cashier',
+            stdout=StringIO(),
+        )
+
+
+class FanoutTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.techs = [make_user(User.Role.LAB_TECH) for _ in range(3)]
+        make_user(User.Role.LAB_TECH, is_active=False)
+
+    def test_role_notification_is_written_after_commit_in_one_insert(self):
+        self.assertEqual(counters.get_count(counters.UNREAD_NOTIFICATIONS, user_id=self.techs[0].pk), 0)
+        with self.captureOnCommitCallbacks() as callbacks:
+            fanout.notify_role(User.Role.LAB_TECH, Notification.NotificationType.SYSTEM, 'Hello', 'Hi')
+        self.assertFalse(Notification.objects.exists())
+
+        fanout.role_roster(User.Role.LAB_TECH)  # cached, as in a warm process
+        # The badge adjustments run on their own commit
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(1):
+            for callback in callbacks:
+                callback()
+        self.assertEqual(
+            sorted(Notification.objects.values_list('recipient_id', flat=True)), [tech.pk for tech in self.techs]
+        )
+        self.assertEqual(counters.get_count(counters.UNREAD_NOTIFICATIONS, user_id=self.techs[0].pk), 1)
+
+    def test_roster_follows_user_changes(self):
+        self.assertEqual(len(fanout.role_roster(User.Role.LAB_TECH)), 3)
+        self.techs[0].is_active = False
+        self.techs[0].save()
+        self.assertEqual(sorted(fanout.role_roster(User.Role.LAB_TECH)), [tech.pk for tech in self.techs[1:]])
+
+
+class NotificationInboxTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user(User.Role.CASHIER)
+        self.other = make_user(User.Role.CASHIER)
+        self.client.force_login(self.user)
+
+    def notify(self, recipient=None, **fields):
+        return Notification.objects.create(
+            recipient=recipient or self.user, notification_type=Notification.NotificationType.SYSTEM,
+            title='Hello', message='Hi', **fields,
+        )
+
+    def test_inbox_pages_newest_first(self):
+        for _ in range(5):
+            self.notify()
+        newest_first = list(Notification.objects.filter(recipient=self.user).order_by('-created_at', '-pk'))
+
+        seen, cursor = [], None
+        with mock.patch.object(views, 'NOTIFICATIONS_PER_PAGE', 2):
+            while True:
+                response = self.client.get(reverse('notifications'), {'after': cursor} if cursor else {})
+                seen += response.context['notifications']
+                page_obj = response.context['page_obj']
+                if not page_obj.has_next:
+                    break
+                cursor = page_obj.next_cursor
+        self.assertEqual(seen, newest_first)
+
+    def test_bulk_mark_read_touches_only_the_users_own(self):
+        mine = [self.notify() for _ in range(3)]
+        theirs = self.notify(recipient=self.other)
+        self.assertEqual(counters.get_count(counters.UNREAD_NOTIFICATIONS, user_id=self.user.pk), 3)
+
+        url = reverse('mark_notifications_read')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {'ids': [mine[0].pk, mine[1].pk, theirs.pk]})
+        self.assertEqual(response.json(), {'status': 'success', 'updated': 2})
+        self.assertEqual(counters.get_count(counters.UNREAD_NOTIFICATIONS, user_id=self.user.pk), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(url, {'all': '1'}).json()['updated'], 1)
+        self.assertEqual(counters.get_count(counters.UNREAD_NOTIFICATIONS, user_id=self.user.pk), 0)
+        self.assertFalse(Notification.objects.get(pk=theirs.pk).is_read)
+        self.assertEqual(self.client.post(url, {'ids': ['x']}).status_code, 400)
+
+    def test_compaction_removes_only_old_read_notifications(self):
+        old_read = [self.notify(is_read=True) for _ in range(3)]
+        old_unread = self.notify()
+        recent_read = self.notify(is_read=True)
+        Notification.objects.filter(pk__in=[n.pk for n in old_read] + [old_unread.pk]).update(
+            created_at=timezone.now() - timedelta(days=120)
+        )
+
+        with tempfile.NamedTemporaryFile('r', suffix='.jsonl') as archive:
+            call_command(
+                'compact_notifications', days=90, batch_size=2, pause=0, archive=archive.name, stdout=StringIO()
+            )
+            archived = [json.loads(line)['id'] for line in archive]
+        self.assertEqual(archived, [n.pk for n in old_read])
+        self.assertEqual(
+            set(Notification.objects.filter(recipient=self.user).values_list('pk', flat=True)),
+            {old_unread.pk, recent_read.pk},
+        )
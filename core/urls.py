@@ -12,4 +12,7 @@ urlpatterns = [
     # Other URLs
     path('notifications/', views.notifications, name='notifications'),
     path('notifications/mark-read/<int:notification_id>/', views.mark_notification_read, name='mark_notification_read'),
+    path('notifications/mark-read/', views.mark_notifications_read, name='mark_notifications_read'),
+    path('metrics/queries/', views.query_stats, name='query_stats'),
+    path('events/', views.event_stream, name='event_stream'),
 ]
\ No newline at end of file
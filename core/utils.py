@@ -1,26 +1,27 @@
-import random
-import string
-from datetime import datetime
+from .sequences import next_id
 
 def generate_patient_id():
-    timestamp = datetime.now().strftime('%y%m%d')
-    random_str = ''.join(random.choices(string.digits, k=4))
-    return f"P{timestamp}{random_str}"
+    return next_id('PAT')
+
+def generate_visit_id():
+    return next_id('VIS')
 
 def generate_lab_test_id():
-    timestamp = datetime.now().strftime('%y%m%d')
-    random_str = ''.join(random.choices(string.digits, k=4))
-    return f"LT{timestamp}{random_str}"
+    return next_id('LAB')
+
+def generate_prescription_id():
+    return next_id('PRES')
+
+def generate_payment_id():
+    return next_id('PAY')
+
+def generate_receipt_number():
+    return next_id('RCP')
 
 def generate_bill_number():
-    timestamp = datetime.now().strftime('%y%m%d')
-    random_str = ''.join(random.choices(string.digits, k=4))
-    return f"B{timestamp}{random_str}"
+    return next_id('B')
 
 def calculate_age(born):
     from datetime import date
     today = date.today()
     return today.year - born.year - ((today.month, today.day) < (born.month, born.day))
-
-def generate_prescription_id():
-    return f"RX{random.randint(10000, 99999)}"
\ No newline at end of file
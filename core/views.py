@@ -1,7 +1,15 @@
+import asyncio
 from django.shortcuts import render,redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.views.decorators.http import require_POST
 from .models import Notification
+from . import counters, events
+from .pagination import keyset_paginate
+from .middleware import view_stats
 from patients.models import Visit,Patient
 from laboratory.models import LabTestRequest
 from pharmacy.models import Prescription
@@ -53,15 +61,11 @@ def dashboard(request):
     from laboratory.models import LabTestRequest
     from pharmacy.models import Prescription
     from patients.models import Visit,Patient
-    from core.models import Notification
     from datetime import date
 
     
     # Calculate unread notifications count
-    unread_count = Notification.objects.filter(
-        recipient=request.user, 
-        is_read=False
-    ).count()
+    unread_count = counters.get_count(counters.UNREAD_NOTIFICATIONS, user_id=request.user.pk)
 
     # get current date
     current_date = date.today()
@@ -78,22 +82,101 @@ def dashboard(request):
             status=Prescription.Status.PENDING
         ).count() if request.user.role == 'PHARMACIST' else 0,
         
-        'active_visits': Visit.objects.exclude(
-            status__in=[Visit.Status.COMPLETED, Visit.Status.COMPLETED]
+        'active_visits': Visit.objects.filter(
+            status__in=Visit.OPEN_STATUSES
         ).count() if request.user.role == 'RECEPTIONIST' else 0,
         
         'unread_notifications_count': unread_count,
     }
     return render(request, 'core/dashboard.html', context)
 
+NOTIFICATIONS_PER_PAGE = 25
+
 @login_required
 def notifications(request):
-    notifications = Notification.objects.filter(recipient=request.user).order_by('-created_at')
-    return render(request, 'core/notifications.html', {'notifications': notifications})
+    notifications = Notification.objects.filter(recipient=request.user)
+    if request.GET.get('filter') == 'unread':
+        notifications = notifications.filter(is_read=False)
+    page_obj = keyset_paginate(
+        notifications,
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        per_page=NOTIFICATIONS_PER_PAGE,
+    )
+    return render(request, 'core/notifications.html', {
+        'notifications': page_obj.object_list,
+        'page_obj': page_obj,
+    })
+
+def _mark_read(user, notifications):
+    """Mark the user's unread ``notifications`` read in one UPDATE; returns how many"""
+    updated = notifications.filter(recipient=user, is_read=False).update(
+        is_read=True, read_at=timezone.now()
+    )
+    counters.adjust(counters.UNREAD_NOTIFICATIONS, -updated, user_id=user.pk)
+    return updated
 
 @login_required
 def mark_notification_read(request, notification_id):
-    notification = get_object_or_404(Notification, id=notification_id, recipient=request.user)
-    notification.is_read = True
-    notification.save()
-    return JsonResponse({'status': 'success'})
\ No newline at end of file
+    notifications = Notification.objects.filter(id=notification_id)
+    if not _mark_read(request.user, notifications):
+        # Already read is fine; someone else's or missing is not
+        get_object_or_404(notifications, recipient=request.user)
+    return JsonResponse({'status': 'success'})
+
+@login_required
+@require_POST
+def mark_notifications_read(request):
+    """Mark the posted ``ids`` (or everything, with ``all``) read"""
+    notifications = Notification.objects.all()
+    if not request.POST.get('all'):
+        try:
+            ids = [int(pk) for pk in request.POST.getlist('ids')]
+        except ValueError:
+            return JsonResponse({'status': 'error', 'message': 'Invalid notification id'}, status=400)
+        notifications = notifications.filter(id__in=ids)
+    updated = _mark_read(request.user, notifications)
+    return JsonResponse({'status': 'success', 'updated': updated})
+
+@login_required
+def query_stats(request):
+    """Per-view query counts and timings collected by QueryInstrumentationMiddleware"""
+    if request.user.role != 'ADMIN' and not request.user.is_superuser:
+        return HttpResponse('Unauthorized', status=403)
+    
+    if request.method == 'POST' and request.POST.get('reset'):
+        view_stats.reset()
+    return JsonResponse({'views': view_stats.snapshot()})
+
+# Seconds between keep-alive comments on an idle event stream
+EVENT_STREAM_HEARTBEAT = 15
+
+@login_required
+async def event_stream(request):
+    """Server-Sent Events feed of the user's queue changes (see core.events)"""
+    if not settings.LIVE_UPDATES or not isinstance(request, ASGIRequest):
+        # A WSGI worker would be tied up for as long as the page stays open;
+        # 204 tells EventSource not to reconnect
+        return HttpResponse(status=204)
+    user = await request.auser()
+    channels = events.channels_for(user)
+
+    async def stream():
+        # Subscribe inside the generator so the queue belongs to the loop reading it
+        subscription = events.get_backend().subscribe(channels)
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    message = await subscription.get(timeout=EVENT_STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                yield events.format_sse(message)
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
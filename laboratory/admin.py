@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import LabTestType, LabTestRequest, TestResult
+from .models import LabTestType, LabTestRequest, LabSLABreach, TestResult, LabResultValue
 
 @admin.register(LabTestType)
 class LabTestTypeAdmin(admin.ModelAdmin):
@@ -7,12 +7,34 @@ class LabTestTypeAdmin(admin.ModelAdmin):
     list_filter = ('is_active',)
     search_fields = ('name',)
 
+class LabResultValueInline(admin.TabularInline):
+    model = LabResultValue
+    extra = 0
+    fields = ('analyte', 'value', 'unit', 'reference_low', 'reference_high', 'flag', 'observed_at')
+    readonly_fields = fields
+
+    # Entered with the result form, which flags and links them to the patient
+    def has_add_permission(self, request, obj=None):
+        return False
+
 @admin.register(LabTestRequest)
 class LabTestRequestAdmin(admin.ModelAdmin):
     list_display = ('request_id', 'visit', 'test_type', 'requested_by', 'status', 'requested_at')
     list_filter = ('status', 'test_type', 'requested_at')
     search_fields = ('request_id', 'visit__visit_id', 'patient__first_name')
-    readonly_fields = ('requested_at', 'payment_completed_at', 'started_at', 'completed_at', 'doctor_reviewed_at')
+    readonly_fields = (
+        'requested_at', 'payment_completed_at', 'started_at', 'completed_at', 'doctor_reviewed_at',
+        'sla_deadline', 'sla_breached_at',
+    )
+    inlines = [LabResultValueInline]
+
+@admin.register(LabSLABreach)
+class LabSLABreachAdmin(admin.ModelAdmin):
+    list_display = ('lab_request', 'test_type', 'assigned_to', 'status', 'deadline', 'detected_at', 'resolved_at')
+    list_filter = ('test_type', 'status', 'detected_at')
+    list_select_related = ('lab_request', 'test_type', 'assigned_to')
+    date_hierarchy = 'detected_at'
+    readonly_fields = ('lab_request', 'test_type', 'assigned_to', 'status', 'deadline', 'detected_at', 'resolved_at')
 
 @admin.register(TestResult)
 class TestResultAdmin(admin.ModelAdmin):
@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class LaboratoryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'laboratory'
+
+    def ready(self):
+        from django.db.models.signals import post_save
+        from .models import LabTestRequest, TestResult
+        from .dispatch import dispatch_paid
+        from .documents import prerender_result
+        from .sla import resolve_breach
+
+        post_save.connect(dispatch_paid, sender=LabTestRequest)
+        post_save.connect(resolve_breach, sender=LabTestRequest)
+        post_save.connect(prerender_result, sender=TestResult)
@@ -0,0 +1,157 @@
+"""Automatic assignment of paid lab requests to lab technicians.
+
+Once a request is paid for, ``dispatch`` hands it to the active lab tech
+with the least work in progress, counted in hours as the sum of
+``LabTestType.turnaround_time`` over their ``IN_PROGRESS`` requests. Each
+assignment adds its own test's hours, so a batch spreads across the techs
+instead of going to whoever was idlest at the start.
+
+Waiting requests are claimed with ``SELECT ... FOR UPDATE SKIP LOCKED``:
+concurrent dispatchers (and techs pulling work with ``pull_next``) each
+take different rows instead of queueing behind each other. The
+assignment itself is a conditional UPDATE that only matches rows still
+waiting, so a request can never be assigned twice even where row locks
+are a no-op (SQLite).
+
+With ``LAB_AUTO_DISPATCH`` off, paid requests wait until a tech pulls
+them or staff assign them by hand.
+"""
+import heapq
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Case, Q, Sum, Value, When
+from django.db.models.signals import post_save
+from django.utils import timezone
+
+from core import fanout
+from core.models import Notification
+from users.models import User
+
+from .models import LabTestRequest
+
+# Requests claimed per dispatch transaction
+DISPATCH_BATCH = 200
+# Attempts before giving up when another claimer keeps winning (SQLite only)
+CLAIM_ATTEMPTS = 3
+
+WAITING = Q(status=LabTestRequest.Status.PAYMENT_COMPLETED, assigned_to__isnull=True)
+_STARTED_FIELDS = frozenset({'assigned_to', 'status', 'started_at'})
+
+
+class _Contended(Exception):
+    pass
+
+
+def technician_loads():
+    """``{lab tech id: hours of work in progress}`` for every active lab tech"""
+    loads = dict.fromkeys(fanout.role_roster(User.Role.LAB_TECH), 0)
+    in_progress = (
+        LabTestRequest.objects.filter(status=LabTestRequest.Status.IN_PROGRESS, assigned_to__isnull=False)
+        .values_list('assigned_to')
+        .annotate(hours=Sum('test_type__turnaround_time'))
+        .order_by()
+    )
+    for tech_id, hours in in_progress:
+        if tech_id in loads:
+            loads[tech_id] = hours
+    return loads
+
+
+def _waiting(limit):
+    return (
+        LabTestRequest.objects.select_for_update(skip_locked=True, of=('self',))
+        .filter(WAITING)
+        .select_related('test_type', 'visit__patient')
+        .order_by('requested_at', 'id')[:limit]
+    )
+
+
+def _start(lab_requests, assignments, now):
+    """Move ``lab_requests`` to IN_PROGRESS under ``{request pk: tech id}``"""
+    updated = LabTestRequest.objects.filter(WAITING, pk__in=assignments).update(
+        assigned_to=Case(
+            *[When(pk=pk, then=Value(tech_id)) for pk, tech_id in assignments.items()],
+            output_field=models.BigIntegerField(),
+        ),
+        status=LabTestRequest.Status.IN_PROGRESS,
+        started_at=now,
+    )
+    if updated != len(assignments):
+        # Someone else claimed one of them first; roll back and try again
+        raise _Contended
+
+    # update() bypasses save() and post_save. save() would only have filled
+    # sla_deadline, which was set when the payment completed; the post_save
+    # handlers (badge counters, SLA breach resolution, queue events, ...)
+    # get the transition they would have seen from save()
+    for lab_request in lab_requests:
+        lab_request.assigned_to_id = assignments[lab_request.pk]
+        lab_request.status = LabTestRequest.Status.IN_PROGRESS
+        lab_request.started_at = now
+        post_save.send(
+            sender=LabTestRequest, instance=lab_request, created=False, raw=False,
+            using=lab_request._state.db, update_fields=_STARTED_FIELDS,
+        )
+        lab_request._snapshot_tracked_fields()
+
+
+def dispatch(limit=DISPATCH_BATCH):
+    """Assign waiting paid requests to the least-loaded lab techs; returns how many"""
+    for _ in range(CLAIM_ATTEMPTS):
+        loads = technician_loads()
+        if not loads:
+            return 0
+        try:
+            with transaction.atomic():
+                lab_requests = list(_waiting(limit))
+                if not lab_requests:
+                    return 0
+
+                queue = [(hours, tech_id) for tech_id, hours in loads.items()]
+                heapq.heapify(queue)
+                assignments = {}
+                for lab_request in lab_requests:
+                    hours, tech_id = heapq.heappop(queue)
+                    assignments[lab_request.pk] = tech_id
+                    heapq.heappush(queue, (hours + lab_request.test_type.turnaround_time, tech_id))
+
+                _start(lab_requests, assignments, timezone.now())
+                fanout.notify_each(
+                    (
+                        assignments[lab_request.pk],
+                        Notification.NotificationType.LAB_REQUEST,
+                        'New Lab Test Assigned',
+                        f'New {lab_request.test_type.name} test assigned for patient {lab_request.visit.patient}',
+                        lab_request.request_id,
+                    )
+                    for lab_request in lab_requests
+                )
+                return len(lab_requests)
+        except _Contended:
+            continue
+    return 0
+
+
+def pull_next(technician):
+    """Claim the oldest waiting paid request for ``technician``; None when nothing waits"""
+    for _ in range(CLAIM_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                lab_request = next(iter(_waiting(1)), None)
+                if lab_request is None:
+                    return None
+                _start([lab_request], {lab_request.pk: technician.pk}, timezone.now())
+                return lab_request
+        except _Contended:
+            continue
+    return None
+
+
+def dispatch_paid(sender, instance, created, raw=False, **kwargs):
+    """post_save for LabTestRequest: dispatch once a payment completes"""
+    if raw or not settings.LAB_AUTO_DISPATCH:
+        return
+    if instance.status == LabTestRequest.Status.PAYMENT_COMPLETED and 'status' in instance.changed_fields:
+        # robust: a dispatch failure must not turn the committed payment into an error page
+        transaction.on_commit(dispatch, robust=True)
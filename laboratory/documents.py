@@ -0,0 +1,68 @@
+"""PDF lab reports, see core.pdf"""
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Trim
+
+from core import pdf
+from core.context_processors import CLINIC
+
+from .models import LabResultValue, LabTestRequest
+
+TEMPLATE = 'laboratory/lab_result_pdf.html'
+
+
+def _full_name(prefix):
+    return Trim(Concat(F(f'{prefix}first_name'), Value(' '), F(f'{prefix}last_name')))
+
+
+def lab_report(request_ids):
+    """``{request ID: context}`` of the completed requests among ``request_ids``, in two queries"""
+    reports = {
+        row['request_id']: {**CLINIC, 'report': row, 'values': []}
+        for row in LabTestRequest.objects.filter(
+            request_id__in=request_ids, status=LabTestRequest.Status.COMPLETED, result__isnull=False
+        ).values(
+            'request_id', 'requested_at', 'completed_at', 'is_abnormal', 'doctor_notes',
+            'test_type__name', 'test_type__description',
+            'visit__visit_id', 'visit__patient__patient_id', 'visit__patient__first_name',
+            'visit__patient__last_name', 'visit__patient__date_of_birth', 'visit__patient__gender',
+            'result__result_data', 'result__findings', 'result__interpretation', 'result__created_at',
+            requested_by_name=_full_name('requested_by__'),
+            performed_by_name=_full_name('result__performed_by__'),
+            verified_by_name=_full_name('result__verified_by__'),
+        )
+    }
+    flags = dict(LabResultValue.Flag.choices)
+    values = LabResultValue.objects.filter(lab_request__request_id__in=reports).values(
+        'lab_request__request_id', 'analyte', 'value', 'unit', 'reference_low', 'reference_high', 'flag',
+    ).order_by('lab_request_id', 'analyte')
+    for value in values:
+        value['flag_display'] = str(flags[value['flag']])
+        reports[value.pop('lab_request__request_id')]['values'].append(value)
+    return reports
+
+
+def serve_lab_report(request, request_id):
+    """The stored PDF report of a completed request, or None when it has no results"""
+    context = lab_report([request_id]).get(request_id)
+    if context is None:
+        return None
+    return pdf.serve(request, TEMPLATE, context, f'lab-result-{request_id}.pdf')
+
+
+def prerender(request_ids):
+    """Queue the reports of ``request_ids`` for rendering once the transaction commits"""
+    request_ids = list(request_ids)
+
+    def queue():
+        for context in lab_report(request_ids).values():
+            pdf.submit(TEMPLATE, context)
+
+    transaction.on_commit(queue, robust=True)
+
+
+def prerender_result(sender, instance, created, raw=False, **kwargs):
+    """post_save for TestResult: have the report ready before anyone prints it"""
+    if raw:
+        return
+    prerender([instance.lab_request.request_id])
@@ -1,5 +1,5 @@
 from django import forms
-from .models import LabTestRequest, LabTestType, TestResult
+from .models import LabTestRequest, LabTestType, TestResult, LabResultValue
 
 class LabTestRequestForm(forms.ModelForm):
     class Meta:
@@ -53,6 +53,94 @@ class TestResultForm(forms.ModelForm):
             }),
         }
 
+class LabResultValueForm(forms.ModelForm):
+    class Meta:
+        model = LabResultValue
+        fields = ('analyte', 'value', 'unit', 'reference_low', 'reference_high')
+        widgets = {
+            'analyte': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'e.g. Hemoglobin'}),
+            'value': forms.NumberInput(attrs={'class': 'form-control', 'step': 'any'}),
+            'unit': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'g/dL'}),
+            'reference_low': forms.NumberInput(attrs={'class': 'form-control', 'step': 'any'}),
+            'reference_high': forms.NumberInput(attrs={'class': 'form-control', 'step': 'any'}),
+        }
+
+    def clean(self):
+        cleaned_data = super().clean()
+        low, high = cleaned_data.get('reference_low'), cleaned_data.get('reference_high')
+        if low is not None and high is not None and low > high:
+            raise forms.ValidationError('The reference low limit is above the high limit.')
+        return cleaned_data
+
+class BaseLabResultValueFormSet(forms.BaseFormSet):
+    def clean(self):
+        analytes = [
+            form.cleaned_data['analyte'].strip().lower()
+            for form in self.forms if form.cleaned_data.get('analyte')
+        ]
+        if len(analytes) != len(set(analytes)):
+            raise forms.ValidationError('Each analyte can only be entered once.')
+
+    def rows(self):
+        """Cleaned data of the filled-in forms"""
+        return [form.cleaned_data for form in self.forms if form.cleaned_data]
+
+# Blank extra rows are left out; each filled row is one measured analyte
+LabResultValueFormSet = forms.formset_factory(
+    LabResultValueForm, formset=BaseLabResultValueFormSet, extra=4
+)
+
+class LabResultEntryForm(forms.Form):
+    """One request's row on the batch entry page; rows left blank are skipped"""
+    request_id = forms.CharField(widget=forms.HiddenInput)
+    result_data = forms.CharField(required=False, widget=forms.Textarea(attrs={'class': 'form-control', 'rows': 2}))
+    findings = forms.CharField(required=False, widget=forms.Textarea(attrs={'class': 'form-control', 'rows': 2}))
+    interpretation = forms.CharField(
+        required=False, widget=forms.Textarea(attrs={'class': 'form-control', 'rows': 2})
+    )
+    is_abnormal = forms.BooleanField(required=False, widget=forms.CheckboxInput(attrs={'class': 'form-check-input'}))
+    # An optional single measured value; the analyte defaults to the test name
+    analyte = forms.CharField(required=False, max_length=50, widget=forms.TextInput(attrs={'class': 'form-control'}))
+    value = forms.FloatField(required=False, widget=forms.NumberInput(attrs={'class': 'form-control', 'step': 'any'}))
+    unit = forms.CharField(required=False, max_length=20, widget=forms.TextInput(attrs={'class': 'form-control'}))
+    reference_low = forms.FloatField(
+        required=False, widget=forms.NumberInput(attrs={'class': 'form-control', 'step': 'any'})
+    )
+    reference_high = forms.FloatField(
+        required=False, widget=forms.NumberInput(attrs={'class': 'form-control', 'step': 'any'})
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        low, high = cleaned_data.get('reference_low'), cleaned_data.get('reference_high')
+        if low is not None and high is not None and low > high:
+            raise forms.ValidationError('The reference low limit is above the high limit.')
+        return cleaned_data
+
+    def is_blank(self):
+        return not any(
+            self.cleaned_data.get(field) not in (None, '', False)
+            for field in ('result_data', 'findings', 'interpretation', 'is_abnormal', 'value')
+        )
+
+    def entry(self, test_name):
+        """This row's entry for ``laboratory.results.complete_batch``"""
+        data = self.cleaned_data
+        entry = {field: data[field] for field in ('result_data', 'findings', 'interpretation', 'is_abnormal')}
+        entry['values'] = []
+        if data.get('value') is not None:
+            entry['values'].append({
+                'analyte': data.get('analyte') or test_name[:50],
+                'value': data['value'],
+                'unit': data.get('unit', ''),
+                'reference_low': data.get('reference_low'),
+                'reference_high': data.get('reference_high'),
+            })
+        return entry
+
+# One form per in-progress request, seeded with their request IDs
+LabResultEntryFormSet = forms.formset_factory(LabResultEntryForm, extra=0)
+
 class LabTestAssignmentForm(forms.ModelForm):
     class Meta:
         model = LabTestRequest
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from laboratory import results
+from laboratory.models import LabResultValue, LabTestRequest
+
+
+class Command(BaseCommand):
+    help = 'Copy numeric free-text results of completed lab requests into LabResultValue rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Requests read and flagged per batch (default 1000)',
+        )
+
+    def handle(self, *args, **options):
+        legacy = (
+            LabTestRequest.objects.filter(status=LabTestRequest.Status.COMPLETED)
+            .exclude(result_value='')
+            .filter(values__isnull=True)
+            .select_related('visit', 'test_type')
+            .order_by('pk')
+        )
+        written = skipped = 0
+        last_pk = 0
+        while True:
+            batch = list(legacy.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            measured, rows = [], []
+            for lab_request in batch:
+                value = results.parse_value(lab_request.result_value)
+                if value is None:
+                    skipped += 1
+                    continue
+                low, high = results.parse_reference_range(lab_request.normal_range)
+                measured.append(lab_request)
+                rows.append((value, low, high))
+            if not rows:
+                continue
+
+            # One vectorised flagging pass for the whole batch
+            values, lows, highs = zip(*rows)
+            flags = results.flag_values(values, lows, highs)
+            with transaction.atomic():
+                LabResultValue.objects.bulk_create([
+                    LabResultValue(
+                        lab_request=lab_request,
+                        patient_id=lab_request.visit.patient_id,
+                        analyte=lab_request.test_type.name,
+                        value=value,
+                        unit=lab_request.unit,
+                        reference_low=low,
+                        reference_high=high,
+                        flag=flag,
+                        observed_at=lab_request.completed_at or lab_request.requested_at,
+                    )
+                    for lab_request, (value, low, high), flag in zip(measured, rows, flags)
+                ])
+            written += len(rows)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {written} value(s); {skipped} result(s) were not numeric'
+        ))
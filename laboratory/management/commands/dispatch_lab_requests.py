@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from laboratory import dispatch
+
+
+class Command(BaseCommand):
+    help = 'Assign paid lab requests still waiting (e.g. while no lab tech was active) to the least-loaded techs'
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            assigned = dispatch.dispatch()
+            total += assigned
+            if assigned < dispatch.DISPATCH_BATCH:
+                break
+        self.stdout.write(self.style.SUCCESS(f'Assigned {total} lab request(s)'))
@@ -0,0 +1,47 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from laboratory import sla
+from laboratory.models import LabTestRequest
+
+
+class Command(BaseCommand):
+    help = 'Record and escalate lab requests that have passed their turnaround deadline'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=sla.EVALUATE_BATCH,
+            help=f'Requests handled per transaction (default {sla.EVALUATE_BATCH})',
+        )
+        parser.add_argument(
+            '--backfill',
+            action='store_true',
+            help='First set sla_deadline on open requests saved before it existed',
+        )
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            self.stdout.write(f'Set deadlines on {self.backfill(options["batch_size"])} open request(s)')
+        breached = sla.evaluate(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{breached} request(s) newly overdue'))
+
+    def backfill(self, batch_size):
+        missing = (
+            LabTestRequest.objects.filter(Q(status__in=LabTestRequest.SLA_STATUSES), sla_deadline__isnull=True)
+            .select_related('test_type')
+            .only('payment_completed_at', 'requested_at', 'test_type__turnaround_time')
+            .order_by('pk')
+        )
+        total, last_pk = 0, 0
+        while True:
+            batch = list(missing.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                return total
+            last_pk = batch[-1].pk
+            for lab_request in batch:
+                started = lab_request.payment_completed_at or lab_request.requested_at
+                lab_request.sla_deadline = started + timedelta(hours=lab_request.test_type.turnaround_time)
+            LabTestRequest.objects.bulk_update(batch, ['sla_deadline'])
+            total += len(batch)
@@ -1,7 +1,10 @@
+from datetime import timedelta
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from patients.models import Patient, Visit
 from users.models import User
+from core.models import TrackedFieldsMixin
 
 class LabTestType(models.Model):
     name = models.CharField(max_length=100)
@@ -13,7 +16,7 @@ class LabTestType(models.Model):
     def __str__(self):
         return self.name
 
-class LabTestRequest(models.Model):
+class LabTestRequest(TrackedFieldsMixin, models.Model):
     class Status(models.TextChoices):
         REQUESTED = 'REQUESTED', _('Requested')
         PAYMENT_PENDING = 'PAYMENT_PENDING', _('Payment Pending')
@@ -60,9 +63,71 @@ class LabTestRequest(models.Model):
     completed_at = models.DateTimeField(null=True, blank=True)
     doctor_reviewed_at = models.DateTimeField(null=True, blank=True)
 
+    # Turnaround SLA, see laboratory.sla: payment time + the test type's
+    # turnaround_time, and when the evaluator first found it overdue
+    sla_deadline = models.DateTimeField(null=True, blank=True)
+    sla_breached_at = models.DateTimeField(null=True, blank=True)
+
+    tracked_fields = ('status', 'assigned_to')
+
+    # Statuses in which the turnaround clock is running
+    SLA_STATUSES = ('PAYMENT_COMPLETED', 'IN_PROGRESS')
+
     def __str__(self):
         return f"{self.request_id} - {self.test_type.name}"
 
+    def save(self, *args, **kwargs):
+        if self.sla_deadline is None and self.status in self.SLA_STATUSES:
+            started = self.payment_completed_at or timezone.now()
+            self.sla_deadline = started + timedelta(hours=self.test_type.turnaround_time)
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {'sla_deadline'}
+        super().save(*args, **kwargs)
+
+    @property
+    def is_overdue(self):
+        return (
+            self.status in self.SLA_STATUSES
+            and self.sla_deadline is not None
+            and self.sla_deadline < timezone.now()
+        )
+
+    class Meta:
+        indexes = [
+            # Status queues (pending payment badge, lab list filters), newest first
+            models.Index(fields=['status', 'requested_at'], name='lab_request_status_idx'),
+            # A lab tech's own work, see core.views.dashboard
+            models.Index(fields=['assigned_to', 'status'], name='lab_request_assignee_idx'),
+            # Date ranges in reports and exports
+            models.Index(fields=['requested_at'], name='lab_request_requested_idx'),
+            # Open requests by deadline, for the SLA evaluator and overdue board;
+            # partial, so it only ever holds the requests still on the clock
+            models.Index(
+                fields=['sla_breached_at', 'sla_deadline'],
+                name='lab_request_sla_idx',
+                condition=models.Q(status__in=['PAYMENT_COMPLETED', 'IN_PROGRESS']),
+            ),
+        ]
+
+class LabSLABreach(models.Model):
+    """A lab request found past its turnaround deadline"""
+    lab_request = models.OneToOneField(LabTestRequest, on_delete=models.CASCADE, related_name='sla_breach')
+    test_type = models.ForeignKey(LabTestType, on_delete=models.PROTECT)
+    # Who had it when the deadline passed (None: nobody had picked it up)
+    assigned_to = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=LabTestRequest.Status.choices)
+    deadline = models.DateTimeField()
+    detected_at = models.DateTimeField()
+    resolved_at = models.DateTimeField(null=True, blank=True)  # when the request completed
+
+    def __str__(self):
+        return f"{self.lab_request_id} overdue since {self.deadline:%Y-%m-%d %H:%M}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['detected_at'], name='lab_sla_breach_detected_idx'),
+        ]
+
 class TestResult(models.Model):
     lab_request = models.OneToOneField(LabTestRequest, on_delete=models.CASCADE, related_name='result')
     result_data = models.TextField(blank=True)  
@@ -88,4 +153,36 @@ class TestResult(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"Results for {self.lab_request.request_id}"
\ No newline at end of file
+        return f"Results for {self.lab_request.request_id}"
+
+class LabResultValue(models.Model):
+    """One numeric measurement of an analyte, see laboratory.results"""
+    class Flag(models.TextChoices):
+        NORMAL = 'N', _('Normal')
+        LOW = 'L', _('Low')
+        HIGH = 'H', _('High')
+
+    lab_request = models.ForeignKey(LabTestRequest, on_delete=models.CASCADE, related_name='values')
+    # Copied from lab_request.visit so a patient's trend is one index range
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='lab_values')
+    analyte = models.CharField(max_length=50)  # e.g. "Hemoglobin"
+    value = models.FloatField()
+    unit = models.CharField(max_length=20, blank=True)
+    reference_low = models.FloatField(null=True, blank=True)
+    reference_high = models.FloatField(null=True, blank=True)
+    flag = models.CharField(max_length=1, choices=Flag.choices, default=Flag.NORMAL)
+    observed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.analyte} {self.value:g} {self.unit}".strip()
+
+    @property
+    def is_abnormal(self):
+        return self.flag != self.Flag.NORMAL
+
+    class Meta:
+        unique_together = ['lab_request', 'analyte']
+        indexes = [
+            # Cumulative results: one patient's analyte over time
+            models.Index(fields=['patient', 'analyte', 'observed_at'], name='lab_value_trend_idx'),
+        ]
@@ -0,0 +1,247 @@
+"""Structured numeric lab results.
+
+Each measured analyte is a ``LabResultValue`` row next to the free-text
+``TestResult``. Rows carry the patient, so a patient's history of one
+analyte is a single range scan of ``lab_value_trend_idx``.
+
+Abnormal flags are worked out for a whole batch of incoming values at
+once with NumPy comparisons against their reference limits; a missing
+limit never flags.
+
+``complete_batch`` finishes many requests in one go for the batch entry
+page: results, values, request and visit statuses are each written with
+one statement whatever the batch size, and each doctor gets a single
+notification covering all of their results.
+"""
+import re
+from collections import defaultdict
+
+import numpy as np
+from django.db import models, transaction
+from django.db.models import Case, Value, When
+from django.utils import timezone
+
+from core import events, fanout
+from core.models import Notification
+from patients.models import Visit
+from users.models import User
+
+from . import documents
+from .models import LabResultValue, LabSLABreach, LabTestRequest, TestResult
+
+# "3.5-5.0", "3.5 - 5.0", "< 140", "<=20", "> 60"
+_RANGE = re.compile(r'^\s*(-?\d+(?:\.\d+)?)\s*[-–]\s*(-?\d+(?:\.\d+)?)\s*$')
+_BOUND = re.compile(r'^\s*([<>])=?\s*(-?\d+(?:\.\d+)?)\s*$')
+_NUMBER = re.compile(r'^\s*(-?\d+(?:\.\d+)?)')
+
+
+def flag_values(values, lows, highs):
+    """Flags for parallel sequences of values and limits (``None`` for no limit)"""
+    values = np.asarray(values, dtype=float)
+    lows = np.array(lows, dtype=float)  # None -> nan, and nan never compares true
+    highs = np.array(highs, dtype=float)
+    return np.select(
+        [values < lows, values > highs],
+        [LabResultValue.Flag.LOW, LabResultValue.Flag.HIGH],
+        default=LabResultValue.Flag.NORMAL,
+    ).tolist()
+
+
+def _build(pairs, observed_at):
+    """Unsaved ``LabResultValue`` rows for ``(lab_request, row)`` pairs, flagged in one pass"""
+    flags = flag_values(
+        [row['value'] for _, row in pairs],
+        [row.get('reference_low') for _, row in pairs],
+        [row.get('reference_high') for _, row in pairs],
+    )
+    return [
+        LabResultValue(
+            lab_request=lab_request,
+            patient_id=lab_request.visit.patient_id,
+            analyte=row['analyte'].strip(),
+            value=row['value'],
+            unit=row.get('unit', ''),
+            reference_low=row.get('reference_low'),
+            reference_high=row.get('reference_high'),
+            flag=flag,
+            observed_at=observed_at,
+        )
+        for (lab_request, row), flag in zip(pairs, flags)
+    ]
+
+
+def build_values(lab_request, rows, observed_at):
+    """Unsaved ``LabResultValue`` rows for ``rows`` of analyte/value/unit/reference_low/reference_high"""
+    return _build([(lab_request, row) for row in rows], observed_at)
+
+
+def record_values(lab_request, rows, observed_at=None):
+    """Store the measured values of one request; returns the rows written.
+
+    Sets ``lab_request.is_abnormal`` when any value falls outside its
+    range; saving the request is left to the caller.
+    """
+    if not rows:
+        return []
+    values = build_values(lab_request, rows, observed_at or timezone.now())
+    LabResultValue.objects.bulk_create(values)
+    if any(value.is_abnormal for value in values):
+        lab_request.is_abnormal = True
+    return values
+
+
+class BatchError(Exception):
+    """Some requests of a batch are not in progress with the technician entering it"""
+
+    def __init__(self, request_ids):
+        self.request_ids = sorted(request_ids)
+        super().__init__(f"Not in progress for this technician: {', '.join(self.request_ids)}")
+
+
+def _results_ready(lab_requests):
+    """One notification per requesting doctor for their completed requests"""
+    by_doctor = defaultdict(list)
+    for lab_request in lab_requests:
+        by_doctor[lab_request.requested_by_id].append(lab_request)
+    notifications = []
+    for doctor_id, ready in by_doctor.items():
+        if len(ready) == 1:
+            lab_request = ready[0]
+            message = (
+                f'Results for {lab_request.test_type.name} are ready for patient {lab_request.visit.patient}'
+            )
+            related_object_id = lab_request.request_id
+        else:
+            patients = len({lab_request.visit.patient_id for lab_request in ready})
+            message = f'{len(ready)} lab test results are ready for {patients} patient(s): ' + ', '.join(
+                f'{lab_request.test_type.name} ({lab_request.visit.patient})' for lab_request in ready
+            )
+            related_object_id = ''
+        notifications.append((
+            doctor_id, Notification.NotificationType.LAB_RESULT, 'Lab Test Results Ready',
+            message, related_object_id,
+        ))
+    return notifications
+
+
+def complete_batch(technician, entries, now=None):
+    """Complete ``technician``'s in-progress requests from ``entries``; returns the requests.
+
+    ``entries`` maps request IDs to dicts of result_data, findings,
+    interpretation, is_abnormal and ``values`` (rows as for
+    ``record_values``). Raises ``BatchError`` without writing anything
+    when any request is not in progress with ``technician``.
+    """
+    if not entries:
+        return []
+    now = now or timezone.now()
+    with transaction.atomic():
+        lab_requests = list(
+            LabTestRequest.objects.select_for_update(of=('self',))
+            .filter(
+                request_id__in=entries,
+                status=LabTestRequest.Status.IN_PROGRESS,
+                assigned_to=technician,
+            )
+            .select_related('test_type', 'visit__patient')
+            .order_by('requested_at', 'id')
+        )
+        missing = entries.keys() - {lab_request.request_id for lab_request in lab_requests}
+        if missing:
+            raise BatchError(missing)
+
+        TestResult.objects.bulk_create([
+            TestResult(
+                lab_request=lab_request,
+                result_data=entries[lab_request.request_id].get('result_data', ''),
+                findings=entries[lab_request.request_id].get('findings', ''),
+                interpretation=entries[lab_request.request_id].get('interpretation', ''),
+                performed_by=technician,
+            )
+            for lab_request in lab_requests
+        ])
+        values = _build(
+            [
+                (lab_request, row)
+                for lab_request in lab_requests
+                for row in entries[lab_request.request_id].get('values', ())
+            ],
+            now,
+        )
+        LabResultValue.objects.bulk_create(values)
+
+        abnormal = {value.lab_request_id for value in values if value.is_abnormal}
+        for lab_request in lab_requests:
+            lab_request.is_abnormal = (
+                bool(entries[lab_request.request_id].get('is_abnormal')) or lab_request.pk in abnormal
+            )
+        flagged = [lab_request.pk for lab_request in lab_requests if lab_request.is_abnormal]
+        updated = LabTestRequest.objects.filter(
+            pk__in=[lab_request.pk for lab_request in lab_requests],
+            status=LabTestRequest.Status.IN_PROGRESS,
+        ).update(
+            status=LabTestRequest.Status.COMPLETED,
+            completed_at=now,
+            is_abnormal=Case(
+                When(pk__in=flagged, then=Value(True)), default=Value(False),
+                output_field=models.BooleanField(),
+            ),
+        )
+        if updated != len(lab_requests):
+            # Unreachable while the rows are locked, but never report a partial batch as done
+            raise BatchError(entries.keys())
+
+        # update() sends no post_save: close breaches and publish the queue change here
+        breached = [lab_request.pk for lab_request in lab_requests if lab_request.sla_breached_at]
+        if breached:
+            LabSLABreach.objects.filter(lab_request__in=breached, resolved_at__isnull=True).update(
+                resolved_at=now
+            )
+        for lab_request in lab_requests:
+            lab_request.status = LabTestRequest.Status.COMPLETED
+            lab_request.completed_at = now
+            lab_request._snapshot_tracked_fields()
+            events.publish(
+                {events.doctor_channel(lab_request.requested_by_id), events.role_channel(User.Role.LAB_TECH)},
+                'lab_request',
+                {
+                    'request_id': lab_request.request_id,
+                    'from': LabTestRequest.Status.IN_PROGRESS,
+                    'to': LabTestRequest.Status.COMPLETED,
+                },
+            )
+
+        visits = {lab_request.visit_id: lab_request.visit for lab_request in lab_requests}
+        Visit.bulk_set_status(visits.values(), Visit.Status.LAB_COMPLETED)
+        fanout.notify_each(_results_ready(lab_requests))
+        # bulk_create skips documents.prerender_result
+        documents.prerender([lab_request.request_id for lab_request in lab_requests])
+    return lab_requests
+
+
+def trend(patient_id, analyte, since=None, until=None):
+    """A patient's values of one analyte, oldest first"""
+    values = LabResultValue.objects.filter(patient_id=patient_id, analyte=analyte)
+    if since is not None:
+        values = values.filter(observed_at__gte=since)
+    if until is not None:
+        values = values.filter(observed_at__lt=until)
+    return values.order_by('observed_at')
+
+
+def parse_reference_range(text):
+    """``(low, high)`` from a free-text range such as "3.5-5.0" or "< 140"; ``None`` where open"""
+    match = _RANGE.match(text or '')
+    if match:
+        return float(match[1]), float(match[2])
+    match = _BOUND.match(text or '')
+    if match:
+        bound = float(match[2])
+        return (None, bound) if match[1] == '<' else (bound, None)
+    return None, None
+
+
+def parse_value(text):
+    """Leading number of a free-text result, or ``None``"""
+    match = _NUMBER.match(text or '')
+    return float(match[1]) if match else None
@@ -0,0 +1,137 @@
+"""Lab turnaround SLA monitoring.
+
+Every paid request carries ``sla_deadline`` (payment time plus its test
+type's ``turnaround_time`` hours), set when it is saved as paid. Finding
+the overdue ones is then a range read of ``lab_request_sla_idx``, a
+partial index over open requests only, instead of computing a deadline
+per row.
+
+``evaluate`` runs periodically (``evaluate_lab_sla``). Each batch claims
+newly overdue requests with SKIP LOCKED, records a ``LabSLABreach``
+for each, stamps ``sla_breached_at`` so the next run skips them, and
+sends the escalations in one INSERT: the assigned tech (or every lab
+tech while nobody has it), and the requesting doctor.
+"""
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from core import events, fanout
+from core.models import Notification
+from users.models import User
+
+from .models import LabSLABreach, LabTestRequest
+
+# Requests claimed per evaluation transaction
+EVALUATE_BATCH = 1000
+# Days of completed requests the compliance figures cover by default
+COMPLIANCE_DAYS = 30
+
+ON_THE_CLOCK = Q(status__in=LabTestRequest.SLA_STATUSES)
+
+
+def overdue(now=None):
+    """Open requests past their deadline, breached or not, most overdue first"""
+    return LabTestRequest.objects.filter(
+        ON_THE_CLOCK, sla_deadline__lt=now or timezone.now()
+    ).order_by('sla_deadline')
+
+
+def _newly_overdue(now, limit):
+    return (
+        LabTestRequest.objects.select_for_update(skip_locked=True, of=('self',))
+        .filter(ON_THE_CLOCK, sla_breached_at__isnull=True, sla_deadline__lt=now)
+        .select_related('test_type', 'visit__patient')
+        .order_by('sla_deadline')[:limit]
+    )
+
+
+def _escalations(lab_requests, lab_techs):
+    notifications = []
+    for lab_request in lab_requests:
+        hours = lab_request.test_type.turnaround_time
+        message = (
+            f'{lab_request.test_type.name} for {lab_request.visit.patient} '
+            f'({lab_request.request_id}) has passed its {hours}h turnaround time'
+        )
+        recipients = {lab_request.requested_by_id}
+        recipients.update([lab_request.assigned_to_id] if lab_request.assigned_to_id else lab_techs)
+        notifications.extend(
+            (user_id, Notification.NotificationType.LAB_REQUEST, 'Lab Test Overdue', message, lab_request.request_id)
+            for user_id in recipients
+        )
+    return notifications
+
+
+def evaluate(now=None, batch_size=EVALUATE_BATCH):
+    """Record and escalate requests that have passed their deadline; returns how many"""
+    now = now or timezone.now()
+    lab_techs = fanout.role_roster(User.Role.LAB_TECH)
+    total = 0
+    while True:
+        with transaction.atomic():
+            lab_requests = list(_newly_overdue(now, batch_size))
+            if not lab_requests:
+                break
+            LabSLABreach.objects.bulk_create([
+                LabSLABreach(
+                    lab_request=lab_request,
+                    test_type_id=lab_request.test_type_id,
+                    assigned_to_id=lab_request.assigned_to_id,
+                    status=lab_request.status,
+                    deadline=lab_request.sla_deadline,
+                    detected_at=now,
+                )
+                for lab_request in lab_requests
+            ], ignore_conflicts=True)
+            LabTestRequest.objects.filter(
+                pk__in=[lab_request.pk for lab_request in lab_requests], sla_breached_at__isnull=True
+            ).update(sla_breached_at=now)
+            fanout.notify_each(_escalations(lab_requests, lab_techs))
+            events.publish(
+                {events.role_channel(User.Role.LAB_TECH)}
+                | {events.doctor_channel(lab_request.requested_by_id) for lab_request in lab_requests},
+                'lab_sla',
+                {'overdue': [lab_request.request_id for lab_request in lab_requests]},
+            )
+        total += len(lab_requests)
+        if len(lab_requests) < batch_size:
+            break
+    return total
+
+
+def compliance(since):
+    """Per test type: requests paid since ``since`` that finished (or are still open) within their SLA"""
+    now = timezone.now()
+    rows = (
+        LabTestRequest.objects.filter(requested_at__gte=since, sla_deadline__isnull=False)
+        .exclude(status=LabTestRequest.Status.CANCELLED)
+        .values('test_type__name', 'test_type__turnaround_time')
+        .annotate(
+            total=Count('id'),
+            met=Count('id', filter=Q(
+                status=LabTestRequest.Status.COMPLETED, completed_at__lte=F('sla_deadline')
+            )),
+            missed=Count('id', filter=(
+                Q(status=LabTestRequest.Status.COMPLETED, completed_at__gt=F('sla_deadline'))
+                | Q(ON_THE_CLOCK, sla_deadline__lt=now)
+            )),
+        )
+        .order_by('test_type__name')
+    )
+    rows = list(rows)
+    for row in rows:
+        decided = row['met'] + row['missed']
+        # Open requests still inside their deadline are not counted either way
+        row['compliance'] = round(100 * row['met'] / decided, 1) if decided else None
+    return rows
+
+
+def resolve_breach(sender, instance, created, raw=False, **kwargs):
+    """post_save for LabTestRequest: close the breach of an overdue request once it completes"""
+    if raw or instance.sla_breached_at is None or 'status' not in instance.changed_fields:
+        return
+    if instance.status not in LabTestRequest.SLA_STATUSES:
+        LabSLABreach.objects.filter(lab_request=instance, resolved_at__isnull=True).update(
+            resolved_at=instance.completed_at or timezone.now()
+        )
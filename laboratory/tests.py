@@ -1,3 +1,178 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import transaction
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import Notification
+from core.testing import make_lab_request, make_patient, make_user
+from users.models import User
+
+from . import dispatch, results, sla
+from .models import LabResultValue, LabSLABreach, LabTestRequest, TestResult
+
+
+class DispatchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.techs = [make_user(User.Role.LAB_TECH) for _ in range(2)]
+        self.requests = [make_lab_request(status=LabTestRequest.Status.PAYMENT_COMPLETED) for _ in range(4)]
+
+    def test_each_request_goes_to_exactly_one_tech(self):
+        self.assertEqual(dispatch.dispatch(), 4)
+        assigned = LabTestRequest.objects.filter(pk__in=[r.pk for r in self.requests])
+        self.assertEqual({r.status for r in assigned}, {LabTestRequest.Status.IN_PROGRESS})
+        # Spread by load, not all to whoever was idle first
+        self.assertEqual({r.assigned_to_id for r in assigned}, {tech.pk for tech in self.techs})
+
+        self.assertEqual(dispatch.dispatch(), 0)
+        self.assertIsNone(dispatch.pull_next(self.techs[0]))
+
+    def test_claimed_request_is_not_started_again(self):
+        claimed = dispatch.pull_next(self.techs[0])
+        self.assertEqual(claimed.pk, self.requests[0].pk)
+        with self.assertRaises(dispatch._Contended), transaction.atomic():
+            dispatch._start([self.requests[0]], {self.requests[0].pk: self.techs[1].pk}, timezone.now())
+        self.requests[0].refresh_from_db()
+        self.assertEqual(self.requests[0].assigned_to_id, self.techs[0].pk)
+
+    def test_start_publishes_the_queue_change(self):
+        with mock.patch('core.events.publish') as publish:
+            claimed = dispatch.pull_next(self.techs[0])
+        channels, event, payload = publish.call_args.args
+        self.assertEqual(event, 'lab_request')
+        self.assertEqual(payload, {
+            'request_id': claimed.request_id,
+            'from': LabTestRequest.Status.PAYMENT_COMPLETED,
+            'to': LabTestRequest.Status.IN_PROGRESS,
+        })
+        self.assertEqual(claimed.changed_fields, {})
+
+
+class PatientLabTrendTests(TestCase):
+    def setUp(self):
+        self.client.force_login(make_user(User.Role.DOCTOR))
+        self.url = reverse('patient_lab_trend', args=[make_patient().patient_id])
+
+    def test_impossible_date_is_a_bad_request(self):
+        response = self.client.get(self.url, {'analyte': 'Hemoglobin', 'since': '2024-02-30'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['status'], 'error')
+
+    def test_valid_date_returns_the_trend(self):
+        response = self.client.get(self.url, {'analyte': 'Hemoglobin', 'since': '2024-02-29'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['points'], [])
+
+
+class LabSLATests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tech = make_user(User.Role.LAB_TECH)
+        self.lab_request = make_lab_request(
+            status=LabTestRequest.Status.IN_PROGRESS, assigned_to=self.tech,
+            payment_completed_at=timezone.now() - timedelta(hours=5),
+        )
+        self.on_time = make_lab_request(status=LabTestRequest.Status.PAYMENT_COMPLETED)
+
+    def test_evaluate_records_and_escalates_each_breach_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(sla.evaluate(), 1)
+            self.assertEqual(sla.evaluate(), 0)
+
+        breach = LabSLABreach.objects.get()
+        self.assertEqual(breach.lab_request, self.lab_request)
+        self.assertIsNone(breach.resolved_at)
+        recipients = set(
+            Notification.objects.filter(title='Lab Test Overdue').values_list('recipient_id', flat=True)
+        )
+        self.assertEqual(recipients, {self.tech.pk, self.lab_request.requested_by_id})
+
+    def test_completing_the_request_resolves_its_breach(self):
+        sla.evaluate()
+        self.lab_request.refresh_from_db()
+        self.lab_request.status = LabTestRequest.Status.COMPLETED
+        self.lab_request.completed_at = timezone.now()
+        self.lab_request.save()
+        self.assertEqual(LabSLABreach.objects.get().resolved_at, self.lab_request.completed_at)
+
+    def test_board_clamps_the_compliance_window(self):
+        self.client.force_login(make_user(User.Role.ADMIN))
+        response = self.client.get(reverse('lab_sla_board'), {'days': '99999999999'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['days'], 3650)
+
+
+class BatchResultsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tech = make_user(User.Role.LAB_TECH)
+        self.requests = [
+            make_lab_request(status=LabTestRequest.Status.IN_PROGRESS, assigned_to=self.tech) for _ in range(2)
+        ]
+
+    def post(self, rows):
+        data = {'form-TOTAL_FORMS': len(rows), 'form-INITIAL_FORMS': len(rows)}
+        for i, (request_id, fields) in enumerate(rows):
+            data[f'form-{i}-request_id'] = request_id
+            data.update({f'form-{i}-{name}': value for name, value in fields.items()})
+        self.client.force_login(self.tech)
+        return self.client.post(reverse('batch_lab_results'), data)
+
+    def test_batch_completes_every_request(self):
+        response = self.post([
+            (self.requests[0].request_id, {'findings': 'Normal'}),
+            (self.requests[1].request_id, {'value': '20', 'reference_low': '1', 'reference_high': '10'}),
+        ])
+        self.assertRedirects(response, reverse('lab_requests_list'), fetch_redirect_response=False)
+        for lab_request in self.requests:
+            lab_request.refresh_from_db()
+            self.assertEqual(lab_request.status, LabTestRequest.Status.COMPLETED)
+        self.assertEqual(TestResult.objects.count(), 2)
+        self.assertFalse(self.requests[0].is_abnormal)
+        self.assertTrue(self.requests[1].is_abnormal)
+
+    def test_request_taken_elsewhere_rejects_the_whole_batch(self):
+        LabTestRequest.objects.filter(pk=self.requests[1].pk).update(status=LabTestRequest.Status.CANCELLED)
+        response = self.post([
+            (self.requests[0].request_id, {'findings': 'Normal'}),
+            (self.requests[1].request_id, {'findings': 'Normal'}),
+        ])
+        self.assertContains(response, f'No results were saved. Not in progress for this technician: {self.requests[1].request_id}')
+        self.assertEqual(
+            [(form['request_id'].value(), rejected) for form, _, rejected in response.context['rows']],
+            [(self.requests[0].request_id, False), (self.requests[1].request_id, True)],
+        )
+        self.assertFalse(TestResult.objects.exists())
+        self.requests[0].refresh_from_db()
+        self.assertEqual(self.requests[0].status, LabTestRequest.Status.IN_PROGRESS)
+
+    def test_complete_batch_writes_nothing_on_error(self):
+        other = make_lab_request(status=LabTestRequest.Status.IN_PROGRESS, assigned_to=make_user(User.Role.LAB_TECH))
+        entries = {
+            self.requests[0].request_id: {'findings': 'Normal', 'values': [{'analyte': 'Hb', 'value': 12}]},
+            other.request_id: {'findings': 'Normal'},
+        }
+        with self.assertRaises(results.BatchError) as raised:
+            results.complete_batch(self.tech, entries)
+        self.assertEqual(raised.exception.request_ids, [other.request_id])
+        self.assertFalse(TestResult.objects.exists())
+        self.assertFalse(LabResultValue.objects.exists())
+
 
-# Create your tests here.
+class ProcessLabTestTests(TestCase):
+    def test_result_notifies_the_doctor_naming_the_patient(self):
+        tech = make_user(User.Role.LAB_TECH)
+        lab_request = make_lab_request(status=LabTestRequest.Status.IN_PROGRESS, assigned_to=tech)
+        self.client.force_login(tech)
+        response = self.client.post(
+            reverse('process_lab_test', args=[lab_request.request_id]),
+            {'findings': 'Normal', 'values-TOTAL_FORMS': 0, 'values-INITIAL_FORMS': 0},
+        )
+        self.assertRedirects(response, reverse('lab_requests_list'), fetch_redirect_response=False)
+        notification = Notification.objects.get(title='Lab Test Results Ready')
+        self.assertEqual(notification.recipient_id, lab_request.requested_by_id)
+        self.assertIn(str(lab_request.visit.patient), notification.message)
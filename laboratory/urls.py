@@ -4,8 +4,13 @@ from . import views
 urlpatterns = [
     path('', views.lab_requests_list, name='lab_requests_list'),
     path('request/<str:visit_id>/', views.request_lab_test, name='request_lab_test'),
+    path('process/batch/', views.batch_lab_results, name='batch_lab_results'),
     path('process/<str:request_id>/', views.process_lab_test, name='process_lab_test'),
     path('payment/<str:request_id>/', views.process_lab_payment, name='process_lab_payment'),  
+    path('sla/', views.lab_sla_board, name='lab_sla_board'),
+    path('pull-next/', views.pull_next_lab_request, name='pull_next_lab_request'),
     path('assign/<str:request_id>/', views.assign_lab_request, name='assign_lab_request'),
-    path('result/<str:request_id>/', views.lab_result_detail, name='lab_result_detail'),  
+    path('trend/<str:patient_id>/', views.patient_lab_trend, name='patient_lab_trend'),
+    path('result/<str:request_id>/', views.lab_result_detail, name='lab_result_detail'),
+    path('result/<str:request_id>/pdf/', views.lab_result_pdf, name='lab_result_pdf'),  
 ]
\ No newline at end of file
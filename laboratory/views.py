@@ -1,18 +1,33 @@
+from datetime import timedelta
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.conf import settings
 from django.http import JsonResponse
 from django.utils import timezone
-from .models import LabTestRequest, LabTestType, TestResult
-from .forms import LabTestRequestForm, TestResultForm, LabTestAssignmentForm
-from patients.models import Visit
+from django.utils.dateparse import parse_date
+from django.db import transaction
+from django.db.models import Count, Q
+from django.views.decorators.http import require_POST
+from .models import LabTestRequest, LabTestType, TestResult, LabResultValue
+from . import dispatch, documents, results, sla
+from .forms import (
+    LabTestRequestForm, TestResultForm, LabTestAssignmentForm, LabResultValueFormSet, LabResultEntryFormSet,
+)
+from patients.models import Patient, Visit
 from billing.models import Payment
 from core.models import Notification
 from users.models import User
 from pharmacy.models import Prescription, PrescriptionItem, Medicine
 from pharmacy.forms import PrescriptionForm, PrescriptionItemForm
-import random
+from core.utils import generate_lab_test_id, generate_prescription_id, generate_payment_id, generate_receipt_number
 
+# Earlier results shown next to each value on the result page
+TREND_HISTORY = 5
+# Overdue requests listed on the SLA board
+SLA_BOARD_LIMIT = 200
+# Longest compliance window the SLA board accepts, in days
+SLA_BOARD_MAX_DAYS = 3650
 
 @login_required
 def process_lab_payment(request, request_id):
@@ -34,7 +49,7 @@ def process_lab_payment(request, request_id):
             with transaction.atomic():
                 # Create payment record
                 payment = Payment(
-                    payment_id=f"PAY{timezone.now().strftime('%y%m%d')}{random.randint(1000, 9999)}",
+                    payment_id=generate_payment_id(),
                     patient=lab_request.visit.patient,
                     visit=lab_request.visit,
                     payment_type=Payment.PaymentType.LAB_TEST,
@@ -44,7 +59,7 @@ def process_lab_payment(request, request_id):
                     processed_by=request.user,
                     status=Payment.Status.COMPLETED,
                     completed_at=timezone.now(),
-                    receipt_number=f"RCP{timezone.now().strftime('%y%m%d')}{random.randint(1000, 9999)}"
+                    receipt_number=generate_receipt_number()
                 )
                 payment.save()
                 
@@ -53,6 +68,10 @@ def process_lab_payment(request, request_id):
                 lab_request.payment_completed_at = timezone.now()
                 lab_request.save()
                 
+                if settings.LAB_AUTO_DISPATCH:
+                    # laboratory.dispatch assigns a technician once this commits
+                    messages.success(request, f'Payment of {lab_request.test_type.price} ETB processed successfully. Lab test has been sent to the lab queue.')
+                    return redirect('lab_requests_list')
                 messages.success(request, f'Payment of {lab_request.test_type.price} ETB processed successfully. Lab test is ready for assignment.')
                 return redirect('assign_lab_request', request_id=request_id)
                 
@@ -77,8 +96,14 @@ def assign_lab_request(request, request_id):
         messages.warning(request, "This lab request is not ready for assignment.")
         return redirect('lab_requests_list')
     
-    # Get available lab technicians
-    lab_techs = User.objects.filter(role=User.Role.LAB_TECH, is_active=True)
+    # Get available lab technicians, least work in progress first
+    loads = dispatch.technician_loads()
+    lab_techs = sorted(
+        User.objects.filter(role=User.Role.LAB_TECH, is_active=True),
+        key=lambda tech: loads.get(tech.pk, 0)
+    )
+    for tech in lab_techs:
+        tech.load_hours = loads.get(tech.pk, 0)
     
     if request.method == 'POST':
         technician_id = request.POST.get('technician')
@@ -114,9 +139,25 @@ def assign_lab_request(request, request_id):
 
 
 
+@login_required
+@require_POST
+def pull_next_lab_request(request):
+    """Lab tech claims the oldest paid test nobody has started"""
+    if request.user.role != 'LAB_TECH':
+        messages.error(request, "Only lab technicians can pull lab tests.")
+        return redirect('lab_requests_list')
+    
+    lab_request = dispatch.pull_next(request.user)
+    if lab_request is None:
+        messages.info(request, 'No paid lab tests are waiting.')
+        return redirect('lab_requests_list')
+    
+    messages.success(request, f'{lab_request.test_type.name} for {lab_request.visit.patient} assigned to you.')
+    return redirect('process_lab_test', request_id=lab_request.request_id)
+
 @login_required
 def request_lab_test(request, visit_id):
-    visit = get_object_or_404(Visit, visit_id=visit_id)
+    visit = get_object_or_404(Visit.objects.select_related('patient'), visit_id=visit_id)
     
     if request.user.role != 'DOCTOR':
         messages.error(request, "Only doctors can request lab tests.")
@@ -128,7 +169,7 @@ def request_lab_test(request, visit_id):
             lab_request = form.save(commit=False)
             lab_request.visit = visit
             lab_request.requested_by = request.user
-            lab_request.request_id = f"LAB{timezone.now().strftime('%y%m%d')}{random.randint(1000, 9999)}"
+            lab_request.request_id = generate_lab_test_id()
             lab_request.status = LabTestRequest.Status.PAYMENT_PENDING
             lab_request.save()
             
@@ -157,15 +198,22 @@ def lab_requests_list(request):
     else:
         lab_requests = LabTestRequest.objects.all()
     
-    lab_requests = lab_requests.order_by('-requested_at')
-    payment_pending = LabTestRequest.objects.filter(status = 'PAYMENT_PENDING').count()
-    payment_inprogress = LabTestRequest.objects.filter(status = 'IN_PROGRESS').count()
-    payment_complete = LabTestRequest.objects.filter(status = 'COMPLETED').count()
-    return render(request, 'laboratory/lab_requests_list.html', {'lab_requests': lab_requests,'payment_pending': payment_pending, 'payment_complete': payment_complete })
+    lab_requests = lab_requests.select_related(
+        'visit__patient', 'test_type', 'requested_by'
+    ).order_by('-requested_at')
+    status_counts = LabTestRequest.objects.aggregate(
+        payment_pending=Count('id', filter=Q(status=LabTestRequest.Status.PAYMENT_PENDING)),
+        payment_inprogress=Count('id', filter=Q(status=LabTestRequest.Status.IN_PROGRESS)),
+        payment_complete=Count('id', filter=Q(status=LabTestRequest.Status.COMPLETED)),
+    )
+    return render(request, 'laboratory/lab_requests_list.html', {'lab_requests': lab_requests, **status_counts})
 
 @login_required
 def process_lab_test(request, request_id):
-    lab_request = get_object_or_404(LabTestRequest, request_id=request_id)
+    # The page and the result notification both read the test type and patient
+    lab_request = get_object_or_404(
+        LabTestRequest.objects.select_related('test_type', 'visit__patient'), request_id=request_id
+    )
     
     if request.user.role != 'LAB_TECH':
         messages.error(request, "Only lab technicians can process lab tests.")
@@ -173,45 +221,108 @@ def process_lab_test(request, request_id):
     
     if request.method == 'POST':
         form = TestResultForm(request.POST)
-        if form.is_valid():
-            test_result = form.save(commit=False)
-            test_result.lab_request = lab_request
-            test_result.performed_by = request.user
-            test_result.save()
-            
-            # Update lab request status
-            lab_request.status = LabTestRequest.Status.COMPLETED
-            lab_request.completed_at = timezone.now()
-            lab_request.save()
-            
-            # Update visit status
-            lab_request.visit.status = Visit.Status.LAB_COMPLETED
-            lab_request.visit.save()
-            
-            # Notify the doctor
-            Notification.objects.create(
-                recipient=lab_request.requested_by,
-                notification_type=Notification.NotificationType.LAB_RESULT,
-                title='Lab Test Results Ready',
-                message=f'Results for {lab_request.test_type.name} are ready for patient {lab_request.visit.patient}',
-                related_object_id=lab_request.request_id
-            )
+        value_formset = LabResultValueFormSet(request.POST, prefix='values')
+        if form.is_valid() and value_formset.is_valid():
+            with transaction.atomic():
+                test_result = form.save(commit=False)
+                test_result.lab_request = lab_request
+                test_result.performed_by = request.user
+                test_result.save()
+                
+                # Numeric values, flagged against their reference ranges
+                lab_request.is_abnormal = 'is_abnormal' in request.POST
+                results.record_values(lab_request, value_formset.rows())
+                
+                # Update lab request status
+                lab_request.status = LabTestRequest.Status.COMPLETED
+                lab_request.completed_at = timezone.now()
+                lab_request.save()
+                
+                # Update visit status
+                lab_request.visit.status = Visit.Status.LAB_COMPLETED
+                lab_request.visit.save()
+                # The doctor is notified from post_save of the TestResult
             
             messages.success(request, 'Lab test results submitted successfully. Doctor has been notified.')
             return redirect('lab_requests_list')
     else:
         form = TestResultForm()
+        value_formset = LabResultValueFormSet(prefix='values')
     
     context = {
         'form': form,
+        'value_formset': value_formset,
         'lab_request': lab_request,
     }
     return render(request, 'laboratory/process_lab_test.html', context)
 
+@login_required
+def batch_lab_results(request):
+    """Lab tech enters the results of several in-progress tests in one submission"""
+    if request.user.role != 'LAB_TECH':
+        messages.error(request, "Only lab technicians can process lab tests.")
+        return redirect('lab_requests_list')
+    
+    lab_requests = LabTestRequest.objects.filter(
+        status=LabTestRequest.Status.IN_PROGRESS, assigned_to=request.user
+    ).select_related('visit__patient', 'test_type').order_by('requested_at', 'id')
+    test_type = request.GET.get('test_type')
+    if test_type:
+        lab_requests = lab_requests.filter(test_type_id=test_type)
+    lab_requests = {lab_request.request_id: lab_request for lab_request in lab_requests}
+    
+    # Shown on the page itself: the form comes back, not a redirect
+    error, rejected = None, set()
+    if request.method == 'POST':
+        formset = LabResultEntryFormSet(request.POST)
+        if formset.is_valid():
+            entries = {}
+            for form in formset:
+                if form.is_blank():
+                    continue
+                # Rows whose request has since left this tech's queue go in
+                # too, so complete_batch rejects the batch and names them
+                lab_request = lab_requests.get(form.cleaned_data['request_id'])
+                entries[form.cleaned_data['request_id']] = form.entry(
+                    lab_request.test_type.name if lab_request else ''
+                )
+            if not entries:
+                error = 'Enter the results of at least one test.'
+            else:
+                try:
+                    completed = results.complete_batch(request.user, entries)
+                except results.BatchError as batch_error:
+                    error = f'No results were saved. {batch_error}'
+                    rejected = set(batch_error.request_ids)
+                else:
+                    messages.success(
+                        request, f'Results for {len(completed)} lab test(s) submitted. The doctors have been notified.'
+                    )
+                    return redirect('lab_requests_list')
+    else:
+        formset = LabResultEntryFormSet(initial=[{'request_id': request_id} for request_id in lab_requests])
+    
+    rows = []
+    for form in formset:
+        request_id = form['request_id'].value()
+        lab_request = lab_requests.get(request_id)
+        # Kept, marked, so the tech sees which entries were turned away
+        rows.append((form, lab_request, lab_request is None or request_id in rejected))
+    context = {
+        'formset': formset,
+        'rows': rows,
+        'error': error,
+        'test_types': LabTestType.objects.filter(is_active=True).order_by('name'),
+        'selected_test_type': test_type,
+    }
+    return render(request, 'laboratory/batch_results.html', context)
+
 @login_required
 def lab_result_detail(request, request_id):
     """View lab test results and allow prescription creation"""
-    lab_request = get_object_or_404(LabTestRequest, request_id=request_id)
+    lab_request = get_object_or_404(
+        LabTestRequest.objects.select_related('visit__patient', 'test_type'), request_id=request_id
+    )
     
     # Check if user has permission to view this result
     if request.user.role not in ['DOCTOR', 'ADMIN'] and request.user != lab_request.requested_by:
@@ -225,6 +336,20 @@ def lab_result_detail(request, request_id):
         messages.warning(request, "Lab test results are not yet available.")
         return redirect('visit_detail', visit_id=lab_request.visit.visit_id)
     
+    # Measured values, each with the patient's earlier results for that analyte
+    result_values = list(lab_request.values.order_by('analyte'))
+    if result_values:
+        earlier = LabResultValue.objects.filter(
+            patient_id=lab_request.visit.patient_id,
+            analyte__in=[value.analyte for value in result_values],
+            observed_at__lt=result_values[0].observed_at,
+        ).order_by('-observed_at')
+        history = {}
+        for value in earlier:
+            history.setdefault(value.analyte, []).append(value)
+        for value in result_values:
+            value.history = history.get(value.analyte, [])[:TREND_HISTORY]
+    
     # Check if prescription already exists
     try:
         prescription = Prescription.objects.get(visit=lab_request.visit)
@@ -238,7 +363,7 @@ def lab_result_detail(request, request_id):
             prescription = prescription_form.save(commit=False)
             prescription.visit = lab_request.visit
             prescription.prescribed_by = request.user
-            prescription.prescription_id = f"PRES{timezone.now().strftime('%y%m%d')}{random.randint(1000, 9999)}"
+            prescription.prescription_id = generate_prescription_id()
             prescription.save()
             
             # Update visit status
@@ -246,16 +371,7 @@ def lab_result_detail(request, request_id):
             lab_request.visit.prescription_time = timezone.now()
             lab_request.visit.save()
             
-            # Notify pharmacists
-            pharmacists = User.objects.filter(role=User.Role.PHARMACIST, is_active=True)
-            for pharmacist in pharmacists:
-                Notification.objects.create(
-                    recipient=pharmacist,
-                    notification_type=Notification.NotificationType.PRESCRIPTION,
-                    title='New Prescription',
-                    message=f'New prescription for {lab_request.visit.patient}',
-                    related_object_id=prescription.prescription_id
-                )
+            # Pharmacists are notified by core.models.create_prescription_notification
             
             messages.success(request, 'Prescription created successfully and sent to pharmacy.')
             return redirect('lab_result_detail', request_id=request_id)
@@ -265,7 +381,87 @@ def lab_result_detail(request, request_id):
     context = {
         'lab_request': lab_request,
         'test_result': test_result,
+        'result_values': result_values,
         'prescription': prescription,
         'prescription_form': prescription_form,
     }
-    return render(request, 'laboratory/lab_result_detail.html', context)
\ No newline at end of file
+    return render(request, 'laboratory/lab_result_detail.html', context)
+
+
+@login_required
+def lab_result_pdf(request, request_id):
+    """Download the printable lab report, rendered once and stored"""
+    lab_request = get_object_or_404(LabTestRequest.objects.select_related('visit'), request_id=request_id)
+    
+    if request.user.role not in ['DOCTOR', 'ADMIN'] and request.user != lab_request.requested_by:
+        messages.error(request, "You don't have permission to view this lab result.")
+        return redirect('dashboard')
+    
+    response = documents.serve_lab_report(request, request_id)
+    if response is None:
+        messages.warning(request, "Lab test results are not yet available.")
+        return redirect('visit_detail', visit_id=lab_request.visit.visit_id)
+    return response
+
+@login_required
+def patient_lab_trend(request, patient_id):
+    """JSON history of one analyte for a patient, or the analytes on record"""
+    if request.user.role not in ['DOCTOR', 'LAB_TECH', 'ADMIN']:
+        return JsonResponse({'status': 'error', 'message': 'Permission denied'}, status=403)
+    
+    patient = get_object_or_404(Patient, patient_id=patient_id)
+    analyte = request.GET.get('analyte', '').strip()
+    if not analyte:
+        analytes = (
+            LabResultValue.objects.filter(patient=patient)
+            .order_by('analyte').values_list('analyte', flat=True).distinct()
+        )
+        return JsonResponse({'patient_id': patient.patient_id, 'analytes': list(analytes)})
+    
+    try:
+        since = parse_date(request.GET.get('since', '') or '')
+    except ValueError:
+        # Well formed but impossible, e.g. 2024-02-30
+        return JsonResponse({'status': 'error', 'message': 'Invalid date'}, status=400)
+    values = results.trend(patient.pk, analyte, since=since).values_list(
+        'observed_at', 'value', 'unit', 'reference_low', 'reference_high', 'flag'
+    )
+    return JsonResponse({
+        'patient_id': patient.patient_id,
+        'analyte': analyte,
+        'points': [
+            {
+                'observed_at': observed_at.isoformat(),
+                'value': value,
+                'unit': unit,
+                'reference_low': low,
+                'reference_high': high,
+                'flag': flag,
+            }
+            for observed_at, value, unit, low, high, flag in values
+        ],
+    })
+
+
+@login_required
+def lab_sla_board(request):
+    """Overdue lab requests and turnaround compliance per test type"""
+    if request.user.role not in ['LAB_TECH', 'DOCTOR', 'ADMIN']:
+        messages.error(request, "You don't have permission to view the SLA board.")
+        return redirect('dashboard')
+    
+    overdue = sla.overdue().select_related('visit__patient', 'test_type', 'assigned_to', 'requested_by')
+    if request.user.role == 'DOCTOR':
+        overdue = overdue.filter(requested_by=request.user)
+    try:
+        days = min(max(int(request.GET.get('days', sla.COMPLIANCE_DAYS)), 1), SLA_BOARD_MAX_DAYS)
+    except ValueError:
+        days = sla.COMPLIANCE_DAYS
+    
+    context = {
+        'overdue': overdue[:SLA_BOARD_LIMIT],
+        'compliance': sla.compliance(timezone.now() - timedelta(days=days)),
+        'days': days,
+        'now': timezone.now(),
+    }
+    return render(request, 'laboratory/sla_board.html', context)
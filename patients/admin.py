@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Patient, Visit, MedicalExamination
+from .models import Patient, Visit, VisitStatusEvent, MedicalExamination
 
 @admin.register(Patient)
 class PatientAdmin(admin.ModelAdmin):
@@ -8,12 +8,23 @@ class PatientAdmin(admin.ModelAdmin):
     search_fields = ('patient_id', 'first_name', 'last_name', 'phone')
     readonly_fields = ('created_at', 'updated_at')
 
+class VisitStatusEventInline(admin.TabularInline):
+    model = VisitStatusEvent
+    fields = ('from_status', 'to_status', 'changed_at', 'stage_seconds')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
 @admin.register(Visit)
 class VisitAdmin(admin.ModelAdmin):
     list_display = ('visit_id', 'patient', 'assigned_doctor', 'status', 'registration_time')
     list_filter = ('status', 'assigned_doctor', 'registration_time')
     search_fields = ('visit_id', 'patient__patient_id', 'patient__first_name')
-    readonly_fields = ('registration_time', 'doctor_assigned_time', 'lab_request_time', 'lab_completion_time', 'prescription_time', 'completion_time')
+    readonly_fields = ('registration_time', 'doctor_assigned_time', 'lab_request_time', 'lab_completion_time', 'prescription_time', 'completion_time', 'status_changed_at')
+    inlines = [VisitStatusEventInline]
 
 @admin.register(MedicalExamination)
 class MedicalExaminationAdmin(admin.ModelAdmin):
@@ -1,8 +1,10 @@
 from django.db import models
+from django.db.models.functions import Coalesce, Lower
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.db.models.signals import post_save
-from django.dispatch import receiver
-from core.models import Notification
+from django.dispatch import Signal, receiver
+from core.models import Notification, TrackedFieldsMixin
 from users.models import User
 
 class Patient(models.Model):
@@ -35,8 +37,18 @@ class Patient(models.Model):
     def __str__(self):
         return f"{self.patient_id} - {self.first_name} {self.last_name}"
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of the registry (newest first)
+            models.Index(fields=['-created_at', '-id'], name='patient_created_idx'),
+            # Prefix search, see patients.views.search_patients
+            models.Index(Lower('first_name'), name='patient_first_name_lower_idx'),
+            models.Index(Lower('last_name'), name='patient_last_name_lower_idx'),
+            models.Index(fields=['phone'], name='patient_phone_idx'),
+        ]
 
-class Visit(models.Model):
+
+class Visit(TrackedFieldsMixin, models.Model):
     class Status(models.TextChoices):
         REGISTERED = 'REGISTERED', _('Registered')
         WITH_DOCTOR = 'WITH_DOCTOR', _('With Doctor')
@@ -63,25 +75,54 @@ class Visit(models.Model):
     lab_completion_time = models.DateTimeField(null=True, blank=True)
     prescription_time = models.DateTimeField(null=True, blank=True)
     completion_time = models.DateTimeField(null=True, blank=True)
+    # When the current status was entered; start of the next VisitStatusEvent's stage
+    status_changed_at = models.DateTimeField(null=True, blank=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
 
+    tracked_fields = ('assigned_doctor', 'status')
+
+    # Workflow timestamp column filled in the first time a visit enters a status
+    STATUS_TIMESTAMPS = {
+        Status.WITH_DOCTOR: 'doctor_assigned_time',
+        Status.LAB_REQUESTED: 'lab_request_time',
+        Status.LAB_COMPLETED: 'lab_completion_time',
+        Status.PRESCRIPTION_READY: 'prescription_time',
+        Status.COMPLETED: 'completion_time',
+    }
+
+    # Every status but COMPLETED, as an IN list so status indexes can be used
+    OPEN_STATUSES = (
+        Status.REGISTERED, Status.WITH_DOCTOR, Status.LAB_REQUESTED, Status.LAB_IN_PROGRESS,
+        Status.LAB_COMPLETED, Status.WITH_DOCTOR_REVIEW, Status.PRESCRIPTION_READY,
+        Status.MEDICINE_DISPENSED,
+    )
+
+    class Meta:
+        indexes = [
+            # A doctor's worklist
+            models.Index(fields=['assigned_doctor', 'status'], name='visit_doctor_status_idx'),
+            # Role queues and open-visit counts, oldest first
+            models.Index(fields=['status', 'created_at'], name='visit_status_idx'),
+            # Date ranges in reports and exports
+            models.Index(fields=['created_at'], name='visit_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.visit_id} - {self.patient}"
 
     def save(self, *args, **kwargs):
         # Check if this is a new visit or if doctor is being changed
         is_new = self._state.adding
-        if not is_new:
-            old_visit = Visit.objects.get(pk=self.pk)
-            doctor_changed = old_visit.assigned_doctor != self.assigned_doctor
-            status_changed = old_visit.status != self.status
-        else:
-            doctor_changed = False
-            status_changed = False
+        doctor_changed = not is_new and self.has_changed('assigned_doctor')
+        status_changed = not is_new and self.has_changed('status')
+        event = self._stamp_status_change(kwargs) if is_new or status_changed else None
         
         # Call the original save method
         super().save(*args, **kwargs)
+
+        if event:
+            VisitStatusEvent.objects.create(visit=self, **event)
         
         # Create notifications after saving
         if is_new:
@@ -91,13 +132,78 @@ class Visit(models.Model):
         elif status_changed and self.status == self.Status.WITH_DOCTOR:
             self._notify_ready_for_doctor()
 
+    @classmethod
+    def bulk_set_status(cls, visits, status):
+        """Move loaded ``visits`` to ``status`` in one UPDATE, logging their events in one INSERT.
+
+        The bulk counterpart of changing ``status`` and calling save(); the
+        per-visit assignment notifications of save() do not apply. Returns
+        the visits that changed.
+        """
+        from core import events
+
+        now = timezone.now()
+        moving = {visit.pk: visit for visit in visits if visit.status != status}
+        if not moving:
+            return []
+        updates = {'status': status, 'status_changed_at': now}
+        timestamp_field = cls.STATUS_TIMESTAMPS.get(status)
+        if timestamp_field:
+            updates[timestamp_field] = Coalesce(timestamp_field, models.Value(now))
+        cls.objects.filter(pk__in=moving).update(**updates)
+
+        status_events = []
+        for visit in moving.values():
+            entered_at = visit.status_changed_at or visit.created_at
+            status_events.append(VisitStatusEvent(
+                visit=visit, from_status=visit.status, to_status=status, changed_at=now,
+                stage_seconds=(now - entered_at).total_seconds() if entered_at else None,
+            ))
+            old_status = visit.status
+            visit.status = status
+            visit.status_changed_at = now
+            if timestamp_field and getattr(visit, timestamp_field) is None:
+                setattr(visit, timestamp_field, now)
+            visit._snapshot_tracked_fields()
+            events.visit_changed(visit, old_status)
+        VisitStatusEvent.objects.bulk_create(status_events)
+        # bulk_create sends no post_save
+        status_events_created.send(sender=VisitStatusEvent, events=status_events)
+        return list(moving.values())
+
+    def _stamp_status_change(self, save_kwargs):
+        """Set the status timestamps and return the fields of the event to log"""
+        now = timezone.now()
+        entered_at = self.status_changed_at or (None if self._state.adding else self.created_at)
+        event = {
+            'from_status': self.old_value('status') or '',
+            'to_status': self.status,
+            'changed_at': now,
+            'stage_seconds': (now - entered_at).total_seconds() if entered_at else None,
+        }
+        stamped = ['status_changed_at']
+        self.status_changed_at = now
+        timestamp_field = self.STATUS_TIMESTAMPS.get(self.status)
+        if timestamp_field and getattr(self, timestamp_field) is None:
+            setattr(self, timestamp_field, now)
+            stamped.append(timestamp_field)
+        if save_kwargs.get('update_fields') is not None:
+            save_kwargs['update_fields'] = set(save_kwargs['update_fields']).union(stamped)
+        return event
+
+    def _patient_label(self):
+        """How notifications name the patient, without loading the row just for that"""
+        if type(self).patient.is_cached(self):
+            return f'Patient {self.patient}'
+        return 'A patient'
+
     def _notify_new_assignment(self):
         """Notify doctor when a new patient is assigned to them"""
         Notification.objects.create(
-            recipient=self.assigned_doctor,
+            recipient_id=self.assigned_doctor_id,
             notification_type=Notification.NotificationType.SYSTEM,
             title='New Patient Assigned',
-            message=f'Patient {self.patient} has been assigned to you for consultation. Visit ID: {self.visit_id}',
+            message=f'{self._patient_label()} has been assigned to you for consultation. Visit ID: {self.visit_id}',
             related_object_id=self.visit_id
         )
 
@@ -105,23 +211,46 @@ class Visit(models.Model):
         """Notify both old and new doctors when assignment changes"""
         # Notify new doctor
         Notification.objects.create(
-            recipient=self.assigned_doctor,
+            recipient_id=self.assigned_doctor_id,
             notification_type=Notification.NotificationType.SYSTEM,
             title='Patient Transferred to You',
-            message=f'Patient {self.patient} has been transferred to your care. Visit ID: {self.visit_id}',
+            message=f'{self._patient_label()} has been transferred to your care. Visit ID: {self.visit_id}',
             related_object_id=self.visit_id
         )
 
     def _notify_ready_for_doctor(self):
         """Notify doctor when patient is ready for consultation"""
         Notification.objects.create(
-            recipient=self.assigned_doctor,
+            recipient_id=self.assigned_doctor_id,
             notification_type=Notification.NotificationType.SYSTEM,
             title='Patient Ready for Consultation',
-            message=f'Patient {self.patient} is ready for your consultation. Visit ID: {self.visit_id}',
+            message=f'{self._patient_label()} is ready for your consultation. Visit ID: {self.visit_id}',
             related_object_id=self.visit_id
         )
 
+class VisitStatusEvent(models.Model):
+    """Append-only log of visit status changes, written by Visit.save"""
+    visit = models.ForeignKey(Visit, on_delete=models.CASCADE, related_name='status_events')
+    from_status = models.CharField(max_length=20, choices=Visit.Status.choices, blank=True)
+    to_status = models.CharField(max_length=20, choices=Visit.Status.choices)
+    changed_at = models.DateTimeField(default=timezone.now)
+    # Time spent in from_status; empty for a visit's first event
+    stage_seconds = models.FloatField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.visit_id}: {self.from_status or '-'} -> {self.to_status}"
+
+    class Meta:
+        ordering = ['changed_at', 'id']
+        indexes = [
+            models.Index(fields=['visit', 'changed_at'], name='visit_event_visit_idx'),
+            models.Index(fields=['changed_at'], name='visit_event_changed_idx'),
+        ]
+
+# Sent with ``events`` (a list of VisitStatusEvent) after Visit.bulk_set_status
+# writes them with bulk_create, which sends no post_save
+status_events_created = Signal()
+
 class MedicalExamination(models.Model):
     visit = models.OneToOneField(Visit, on_delete=models.CASCADE, related_name='examination')
     blood_pressure = models.CharField(max_length=20, blank=True)
@@ -1,3 +1,61 @@
+from unittest import mock
+
 from django.test import TestCase
+from django.urls import reverse
+
+from core.models import Notification
+from core.testing import make_patient, make_user, make_visit
+from users.models import User
+
+from .models import Patient, Visit
+
+
+class VisitNotificationTests(TestCase):
+    def test_new_visit_names_the_patient_it_was_created_with(self):
+        patient = make_patient(first_name='Almaz', last_name='Tesfaye')
+        visit = make_visit(patient=patient)
+        notification = Notification.objects.get(related_object_id=visit.visit_id)
+        self.assertIn('Almaz Tesfaye', notification.message)
+
+    def test_status_change_does_not_load_the_patient(self):
+        visit = Visit.objects.get(pk=make_visit().pk)
+        visit.status = Visit.Status.WITH_DOCTOR
+        visit.save()
+        self.assertFalse(Visit.patient.is_cached(visit))
+        notification = Notification.objects.filter(related_object_id=visit.visit_id).latest('id')
+        self.assertEqual(notification.title, 'Patient Ready for Consultation')
+        self.assertTrue(notification.message.startswith('A patient is ready'))
+
+
+@mock.patch('patients.views.PATIENTS_PER_PAGE', 2)
+class PatientListTests(TestCase):
+    def setUp(self):
+        self.client.force_login(make_user(User.Role.RECEPTIONIST))
+
+    def page(self, **params):
+        response = self.client.get(reverse('patient_list'), params)
+        return [patient.patient_id for patient in response.context['patients']], response.context['page_obj']
+
+    def test_pages_walk_the_registry_newest_first(self):
+        for _ in range(5):
+            make_patient()
+        newest_first = list(Patient.objects.order_by('-created_at', '-pk').values_list('patient_id', flat=True))
+
+        seen, first_page, page_obj = [], None, None
+        while True:
+            ids, page_obj = self.page(**({'after': page_obj.next_cursor} if page_obj else {}))
+            first_page = first_page or ids
+            seen += ids
+            if not page_obj.has_next:
+                break
+        self.assertEqual(seen, newest_first)
+
+        ids, page_obj = self.page(after=self.page()[1].next_cursor)
+        self.assertEqual(self.page(before=page_obj.previous_cursor)[0], first_page)
 
-# Create your tests here.
+    def test_search_prefix_matches_every_term(self):
+        almaz = make_patient(first_name='Almaz', last_name='Tesfaye')
+        make_patient(first_name='Almaz', last_name='Bekele')
+        make_patient(first_name='Dawit', last_name='Tesfaye')
+        self.assertEqual(self.page(q='alm tes')[0], [almaz.patient_id])
+        self.assertEqual(self.page(q=almaz.patient_id.lower())[0], [almaz.patient_id])
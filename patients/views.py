@@ -3,20 +3,40 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import JsonResponse
 from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
 from django.utils import timezone
 from .models import Patient, Visit, MedicalExamination
 from .forms import PatientRegistrationForm, VisitForm, MedicalExaminationForm
 from billing.models import Payment
 from billing.forms import RegistrationPaymentForm
 from users.models import User
-import random
-import string
+from core import events
+from core.pagination import keyset_paginate
+from core.utils import generate_patient_id, generate_visit_id, generate_payment_id, generate_receipt_number
 
-def generate_patient_id():
-    return f"PAT{timezone.now().strftime('%y%m%d')}{random.randint(1000, 9999)}"
+PATIENTS_PER_PAGE = 25
+VISIT_QUEUE_LIMIT = 100
 
-def generate_visit_id():
-    return f"VIS{timezone.now().strftime('%y%m%d')}{random.randint(1000, 9999)}"
+def _prefix(field, value):
+    # A range instead of LIKE so the database can use a plain b-tree index
+    return Q(**{f'{field}__gte': value, f'{field}__lt': value + '\uffff'})
+
+def search_patients(queryset, query):
+    """Prefix-match every search term against the indexed patient columns
+    (the same fields PatientAdmin.search_fields exposes)."""
+    queryset = queryset.annotate(
+        first_name_lower=Lower('first_name'),
+        last_name_lower=Lower('last_name'),
+    )
+    for term in query.split():
+        queryset = queryset.filter(
+            _prefix('patient_id', term.upper())
+            | _prefix('first_name_lower', term.lower())
+            | _prefix('last_name_lower', term.lower())
+            | _prefix('phone', term)
+        )
+    return queryset
 
 @login_required
 def register_patient(request):
@@ -39,7 +59,7 @@ def register_patient(request):
                     
                     # Create registration payment (50 ETB)
                     payment = Payment(
-                        payment_id=f"PAY{timezone.now().strftime('%y%m%d')}{random.randint(1000, 9999)}",
+                        payment_id=generate_payment_id(),
                         patient=patient,
                         payment_type=Payment.PaymentType.REGISTRATION,
                         payment_method=payment_form.cleaned_data['payment_method'],
@@ -48,7 +68,7 @@ def register_patient(request):
                         notes=payment_form.cleaned_data['notes'],
                         status=Payment.Status.COMPLETED,
                         completed_at=timezone.now(),
-                        receipt_number=f"RCP{timezone.now().strftime('%y%m%d')}{random.randint(1000, 9999)}"
+                        receipt_number=generate_receipt_number()
                     )
                     payment.save()
                     
@@ -70,8 +90,37 @@ def register_patient(request):
 
 @login_required
 def patient_list(request):
-    patients = Patient.objects.all().order_by('-created_at')
-    return render(request, 'patients/patient_list.html', {'patients': patients})
+    query = request.GET.get('q', '').strip()
+    patients = Patient.objects.all()
+    if query:
+        patients = search_patients(patients, query)
+    
+    page_obj = keyset_paginate(
+        patients,
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        per_page=PATIENTS_PER_PAGE,
+    )
+    return render(request, 'patients/patient_list.html', {
+        'patients': page_obj.object_list,
+        'page_obj': page_obj,
+        'is_paginated': page_obj.has_other_pages,
+    })
+
+@login_required
+def visit_queue(request):
+    """Open visits the user works on; refreshed live through core.events"""
+    visits = Visit.objects.filter(status__in=Visit.OPEN_STATUSES).select_related('patient', 'assigned_doctor')
+    role = request.user.role
+    if role == User.Role.DOCTOR:
+        visits = visits.filter(assigned_doctor=request.user)
+    elif role in events.VISIT_QUEUES.values():
+        visits = visits.filter(status__in=[
+            status for status, queue_role in events.VISIT_QUEUES.items() if queue_role == role
+        ])
+    return render(request, 'patients/visit_queue.html', {
+        'visits': visits.order_by('created_at')[:VISIT_QUEUE_LIMIT],
+    })
 
 @login_required
 def patient_detail(request, patient_id):
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Medicine, Prescription, PrescriptionItem, DispenseCart, CartItem
+from .models import Medicine, StockMovement, StockSnapshot, StockForecast, Prescription, PrescriptionItem, DispenseCart, CartItem
 
 @admin.register(Medicine)
 class MedicineAdmin(admin.ModelAdmin):
@@ -8,6 +8,35 @@ class MedicineAdmin(admin.ModelAdmin):
     search_fields = ('medicine_id', 'name', 'generic_name')
     readonly_fields = ('created_at',)
 
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'medicine', 'kind', 'quantity', 'reference', 'created_by')
+    list_filter = ('kind', 'created_at')
+    search_fields = ('medicine__name', 'medicine__medicine_id', 'reference')
+    list_select_related = ('medicine', 'created_by')
+    date_hierarchy = 'created_at'
+
+    # The ledger is append-only
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(StockSnapshot)
+class StockSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('taken_at', 'medicine', 'quantity', 'last_movement_id')
+    list_select_related = ('medicine',)
+    date_hierarchy = 'taken_at'
+    readonly_fields = ('medicine', 'quantity', 'taken_at', 'last_movement_id')
+
+@admin.register(StockForecast)
+class StockForecastAdmin(admin.ModelAdmin):
+    list_display = ('medicine', 'daily_demand', 'reorder_point', 'order_up_to', 'days_of_cover', 'suggested_order', 'computed_at')
+    list_select_related = ('medicine',)
+    search_fields = ('medicine__name', 'medicine__medicine_id')
+    readonly_fields = ('computed_at',)
+
 class PrescriptionItemInline(admin.TabularInline):
     model = PrescriptionItem
     extra = 1
@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class PharmacyConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'pharmacy'
+
+    def ready(self):
+        from django.db.models.signals import post_save, post_delete
+        from .models import Medicine
+        from .search import catalogue_changed
+        from .stock import record_direct_change
+
+        post_save.connect(record_direct_change, sender=Medicine)
+        post_save.connect(catalogue_changed, sender=Medicine)
+        post_delete.connect(catalogue_changed, sender=Medicine)
@@ -0,0 +1,185 @@
+"""Dispensing cart changes.
+
+A list of add / update / remove operations is applied to a cart in one
+transaction. The rows the operations touch are read up front in three
+queries, changed in memory, and written back with one bulk statement per
+kind of change. ``DispenseCart.total_amount`` is moved by the sum of the
+subtotal changes with an ``F()`` update instead of being re-summed from
+every item, so a batch costs the same handful of queries however many
+lines the cart holds or the batch contains.
+
+Operations are dicts::
+
+    {'op': 'add', 'medicine_id': 3, 'quantity': 2, 'dosage': '', 'duration': '', 'instructions': ''}
+    {'op': 'update', 'cart_item_id': 7, 'quantity': 5}   # 0 or less removes the item
+    {'op': 'remove', 'cart_item_id': 7}
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Q
+
+from .models import CartItem, DispenseCart, Medicine, PrescriptionItem
+
+OPERATIONS = ('add', 'update', 'remove')
+
+
+class CartError(Exception):
+    pass
+
+
+def active_cart(pharmacist, prescription):
+    cart, created = DispenseCart.objects.get_or_create(
+        pharmacist=pharmacist,
+        prescription=prescription,
+        is_active=True
+    )
+    return cart
+
+
+def _parse(operation):
+    kind = operation.get('op')
+    if kind not in OPERATIONS:
+        raise CartError(f'Unknown cart operation: {kind!r}')
+    try:
+        parsed = {'op': kind, 'quantity': int(operation.get('quantity', 1))}
+        if kind == 'add':
+            parsed['medicine_id'] = int(operation['medicine_id'])
+        else:
+            parsed['cart_item_id'] = int(operation['cart_item_id'])
+    except (KeyError, TypeError, ValueError):
+        raise CartError(f'Invalid {kind} operation: {operation}') from None
+    if kind == 'add':
+        if parsed['quantity'] <= 0:
+            raise CartError('Quantity to add must be at least 1')
+        for field in ('dosage', 'duration', 'instructions'):
+            parsed[field] = operation.get(field, '')
+    elif kind == 'update' and parsed['quantity'] <= 0:
+        parsed['op'] = 'remove'
+    return parsed
+
+
+def apply_operations(cart, operations):
+    """Apply ``operations`` to ``cart``, all or nothing; returns the cart.
+
+    Raises ``CartError`` for a malformed operation or one naming a medicine
+    or cart item that does not exist, leaving the cart untouched.
+    """
+    operations = [_parse(operation) for operation in operations]
+    medicine_ids = {op['medicine_id'] for op in operations if op['op'] == 'add'}
+    cart_item_ids = {op['cart_item_id'] for op in operations if op['op'] != 'add'}
+
+    with transaction.atomic():
+        # Serialises batches on the same cart, so the in-memory changes
+        # below are made against rows nobody else is changing
+        total = DispenseCart.objects.select_for_update().values_list(
+            'total_amount', flat=True
+        ).get(pk=cart.pk)
+
+        medicines = Medicine.objects.only('unit_price').in_bulk(medicine_ids)
+        missing = medicine_ids - set(medicines)
+        if missing:
+            raise CartError(f'Medicine not found: {", ".join(map(str, sorted(missing)))}')
+
+        prescription_items = {
+            item.medicine_id: item
+            for item in PrescriptionItem.objects.filter(
+                prescription_id=cart.prescription_id, medicine_id__in=medicine_ids
+            )
+        }
+        cart_items = {
+            item.pk: item
+            for item in CartItem.objects.filter(cart=cart).filter(
+                Q(pk__in=cart_item_ids) | Q(prescription_item__medicine_id__in=medicine_ids)
+            ).select_related('prescription_item')
+        }
+        missing = cart_item_ids - set(cart_items)
+        if missing:
+            raise CartError(f'Cart item not found: {", ".join(map(str, sorted(missing)))}')
+        by_medicine = {item.prescription_item.medicine_id: item for item in cart_items.values()}
+
+        new_prescription_items, changed_prescription_items = [], {}
+        new_cart_items, changed_cart_items, removed = [], {}, set()
+        delta = Decimal('0')
+
+        for op in operations:
+            if op['op'] == 'add':
+                quantity = op['quantity']
+                medicine_id = op['medicine_id']
+                prescription_item = prescription_items.get(medicine_id)
+                if prescription_item is None:
+                    unit_price = medicines[medicine_id].unit_price
+                    prescription_item = PrescriptionItem(
+                        prescription_id=cart.prescription_id,
+                        medicine_id=medicine_id,
+                        quantity=quantity,
+                        dosage=op['dosage'],
+                        duration=op['duration'],
+                        instructions=op['instructions'],
+                        unit_price=unit_price,
+                        total_price=unit_price * quantity,
+                    )
+                    prescription_items[medicine_id] = prescription_item
+                    new_prescription_items.append(prescription_item)
+                else:
+                    prescription_item.quantity += quantity
+                    prescription_item.total_price = prescription_item.unit_price * prescription_item.quantity
+                    if prescription_item.pk is not None:
+                        changed_prescription_items[prescription_item.pk] = prescription_item
+
+                cart_item = by_medicine.get(medicine_id)
+                if cart_item is None:
+                    cart_item = CartItem(
+                        cart=cart,
+                        prescription_item=prescription_item,
+                        quantity_to_dispense=quantity,
+                        subtotal=prescription_item.unit_price * quantity,
+                    )
+                    by_medicine[medicine_id] = cart_item
+                    new_cart_items.append(cart_item)
+                    delta += cart_item.subtotal
+                else:
+                    old_subtotal = cart_item.subtotal
+                    cart_item.quantity_to_dispense += quantity
+                    cart_item.subtotal = prescription_item.unit_price * cart_item.quantity_to_dispense
+                    delta += cart_item.subtotal - old_subtotal
+                    if cart_item.pk is not None:
+                        changed_cart_items[cart_item.pk] = cart_item
+                continue
+
+            cart_item = cart_items.get(op['cart_item_id'])
+            if cart_item is None or op['cart_item_id'] in removed:
+                raise CartError(f'Cart item {op["cart_item_id"]} was already removed')
+            if op['op'] == 'remove':
+                removed.add(cart_item.pk)
+                changed_cart_items.pop(cart_item.pk, None)
+                by_medicine.pop(cart_item.prescription_item.medicine_id, None)
+                delta -= cart_item.subtotal
+            else:
+                old_subtotal = cart_item.subtotal
+                cart_item.quantity_to_dispense = op['quantity']
+                cart_item.subtotal = cart_item.prescription_item.unit_price * op['quantity']
+                delta += cart_item.subtotal - old_subtotal
+                changed_cart_items[cart_item.pk] = cart_item
+
+        # Removals first: a medicine removed and added back in the same
+        # batch gets a new row under the same (cart, prescription_item)
+        if removed:
+            CartItem.objects.filter(pk__in=removed).delete()
+        if changed_prescription_items:
+            PrescriptionItem.objects.bulk_update(
+                changed_prescription_items.values(), ['quantity', 'total_price']
+            )
+        if new_prescription_items:
+            PrescriptionItem.objects.bulk_create(new_prescription_items)
+        if changed_cart_items:
+            CartItem.objects.bulk_update(
+                changed_cart_items.values(), ['quantity_to_dispense', 'subtotal']
+            )
+        if new_cart_items:
+            CartItem.objects.bulk_create(new_cart_items)
+        if delta:
+            DispenseCart.objects.filter(pk=cart.pk).update(total_amount=F('total_amount') + delta)
+
+    cart.total_amount = total + delta
+    return cart
@@ -0,0 +1,136 @@
+"""Reorder forecasting from dispensing history.
+
+Dispensed ``PrescriptionItem`` quantities are summed per medicine per day
+by the database and laid out as one NumPy matrix (medicines x days), so
+the statistics for every medicine come out of a few whole-array
+operations instead of a Python loop per medicine and day.
+
+Demand is an exponentially weighted daily mean (recent days count most,
+see ``HALF_LIFE_DAYS``) over the days since the medicine was added. With
+``PHARMACY_LEAD_TIME_DAYS`` until a delivery arrives and orders placed
+every ``PHARMACY_REVIEW_DAYS``:
+
+* reorder point = demand x lead time + safety stock
+* order up to   = demand x (lead time + review period) + safety stock
+* safety stock  = ``SERVICE_Z`` x daily std x sqrt(lead time)
+
+A medicine's ``reorder_level`` stays as a floor under the reorder point.
+"""
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Medicine, Prescription, PrescriptionItem, StockForecast
+
+HISTORY_DAYS = 365
+HALF_LIFE_DAYS = 28
+# Safety stock covering about 95% of lead times
+SERVICE_Z = 1.65
+
+
+def _daily_dispensed(medicine_ids, start, days, now):
+    """``medicines x days`` matrix of units dispensed, column 0 being ``start``"""
+    matrix = np.zeros((len(medicine_ids), days))
+    rows = (
+        PrescriptionItem.objects.filter(
+            prescription__status=Prescription.Status.DISPENSED,
+            # A day of slack for the timezone; columns are cut to local days below
+            prescription__dispensed_at__gte=now - timedelta(days=days + 1),
+        )
+        .annotate(day=TruncDate('prescription__dispensed_at'))
+        .values_list('medicine_id', 'day')
+        .annotate(total=Sum('quantity'))
+        .order_by()
+    )
+    rows = list(rows)
+    if not rows:
+        return matrix
+
+    ids, dates, totals = zip(*rows)
+    ids = np.fromiter(ids, dtype=np.int64, count=len(rows))
+    cols = (np.array(dates, dtype='datetime64[D]') - np.datetime64(start, 'D')).astype(np.int64)
+    positions = np.searchsorted(medicine_ids, ids).clip(max=len(medicine_ids) - 1)
+    # Inactive medicines are not in ``medicine_ids``; days outside the window
+    # (including today's partial one) are dropped
+    keep = (medicine_ids[positions] == ids) & (cols >= 0) & (cols < days)
+    # One row per (medicine, day) from the GROUP BY, so plain assignment is enough
+    matrix[positions[keep], cols[keep]] = np.fromiter(totals, dtype=float, count=len(rows))[keep]
+    return matrix
+
+
+def forecast(days=HISTORY_DAYS, now=None):
+    """Recompute ``StockForecast`` for every active medicine; returns the rows written"""
+    now = now or timezone.now()
+    today = timezone.localdate(now)
+    start = today - timedelta(days=days)
+    lead_time = settings.PHARMACY_LEAD_TIME_DAYS
+    review = settings.PHARMACY_REVIEW_DAYS
+
+    medicines = list(
+        Medicine.objects.filter(is_active=True).order_by('pk')
+        .values_list('pk', 'quantity_in_stock', 'reorder_level', 'created_at')
+    )
+    if not medicines:
+        StockForecast.objects.all().delete()
+        return 0
+    pks, quantities, reorder_levels, created = zip(*medicines)
+    medicine_ids = np.array(pks, dtype=np.int64)
+    stock = np.array(quantities, dtype=float)
+
+    matrix = _daily_dispensed(medicine_ids, start, days, now)
+
+    # Weight halves every HALF_LIFE_DAYS going back; days before a medicine
+    # was added to the catalogue carry no weight at all
+    age = np.arange(days - 1, -1, -1)
+    weights = 0.5 ** (age / HALF_LIFE_DAYS)
+    added = np.array(
+        [timezone.localdate(moment) for moment in created], dtype='datetime64[D]'
+    )
+    first_day = (added - np.datetime64(start, 'D')).astype(np.int64).clip(0, days - 1)
+    weights = np.where(np.arange(days) >= first_day[:, None], weights, 0.0)
+    total_weight = weights.sum(axis=1)
+
+    demand = (matrix * weights).sum(axis=1) / total_weight
+    std = np.sqrt(((matrix - demand[:, None]) ** 2 * weights).sum(axis=1) / total_weight)
+
+    safety = SERVICE_Z * std * np.sqrt(lead_time)
+    reorder_point = np.maximum(np.ceil(demand * lead_time + safety), reorder_levels)
+    order_up_to = np.maximum(np.ceil(demand * (lead_time + review) + safety), reorder_point)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cover = np.where(demand > 0, stock / demand, np.nan)
+    suggested = np.where(stock <= reorder_point, np.maximum(order_up_to - stock, 0), 0)
+
+    forecasts = [
+        StockForecast(
+            medicine_id=pk,
+            daily_demand=daily,
+            demand_std=deviation,
+            reorder_point=int(point),
+            order_up_to=int(level),
+            days_of_cover=None if np.isnan(days_left) else days_left,
+            suggested_order=int(order),
+            computed_at=now,
+        )
+        for pk, daily, deviation, point, level, days_left, order in zip(
+            pks, demand.tolist(), std.tolist(), reorder_point.tolist(),
+            order_up_to.tolist(), cover.tolist(), suggested.tolist(),
+        )
+    ]
+    with transaction.atomic():
+        StockForecast.objects.filter(medicine__is_active=False).delete()
+        StockForecast.objects.bulk_create(
+            forecasts,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=['medicine'],
+            update_fields=[
+                'daily_demand', 'demand_std', 'reorder_point', 'order_up_to',
+                'days_of_cover', 'suggested_order', 'computed_at',
+            ],
+        )
+    return len(forecasts)
@@ -0,0 +1,22 @@
+import time
+from django.core.management.base import BaseCommand
+from pharmacy import forecast
+
+
+class Command(BaseCommand):
+    help = 'Recompute reorder points and days of cover from dispensing history'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=forecast.HISTORY_DAYS,
+            help=f'Days of dispensing history to use (default {forecast.HISTORY_DAYS})',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        written = forecast.forecast(days=options['days'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Forecast {written} medicine(s) in {time.monotonic() - started:.1f}s'
+        ))
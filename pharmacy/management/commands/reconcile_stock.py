@@ -0,0 +1,86 @@
+from itertools import groupby
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from pharmacy import stock
+from pharmacy.models import Medicine, StockMovement, StockSnapshot
+
+
+class Command(BaseCommand):
+    help = 'Stream the stock ledger and verify it against snapshots and quantity_in_stock'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Record an adjustment movement for every medicine whose ledger disagrees with quantity_in_stock',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help='Ledger rows fetched per round trip (default 5000)',
+        )
+
+    def handle(self, *args, **options):
+        # Snapshot checkpoints per medicine, in ledger order: [(last movement id, quantity, taken_at)]
+        checkpoints = {}
+        for medicine_id, last_id, quantity, taken_at in StockSnapshot.objects.order_by(
+            'medicine_id', 'last_movement_id'
+        ).values_list('medicine_id', 'last_movement_id', 'quantity', 'taken_at'):
+            checkpoints.setdefault(medicine_id, []).append((last_id, quantity, taken_at))
+
+        movements = (
+            StockMovement.objects.order_by('medicine_id', 'id')
+            .values_list('medicine_id', 'id', 'quantity')
+            .iterator(chunk_size=options['chunk_size'])
+        )
+        balances = {}
+        bad_snapshots = 0
+        for medicine_id, rows in groupby(movements, key=lambda row: row[0]):
+            pending = iter(checkpoints.pop(medicine_id, ()))
+            checkpoint = next(pending, None)
+            running = 0
+            for _, movement_id, quantity in rows:
+                while checkpoint and checkpoint[0] < movement_id:
+                    bad_snapshots += self._check_snapshot(medicine_id, running, checkpoint)
+                    checkpoint = next(pending, None)
+                running += quantity
+            while checkpoint:
+                bad_snapshots += self._check_snapshot(medicine_id, running, checkpoint)
+                checkpoint = next(pending, None)
+            balances[medicine_id] = running
+        # Snapshots of medicines without any movement must all be zero
+        for medicine_id, remaining in checkpoints.items():
+            for checkpoint in remaining:
+                bad_snapshots += self._check_snapshot(medicine_id, 0, checkpoint)
+
+        drift = {}
+        for medicine_id, name, quantity in Medicine.objects.values_list('id', 'name', 'quantity_in_stock'):
+            ledger = balances.get(medicine_id, 0)
+            if ledger != quantity:
+                drift[medicine_id] = quantity - ledger
+                self.stdout.write(self.style.WARNING(
+                    f'{name}: quantity_in_stock {quantity}, ledger {ledger} ({quantity - ledger:+d})'
+                ))
+
+        if drift and options['fix']:
+            with transaction.atomic():
+                stock.record_movements(drift, StockMovement.Kind.ADJUSTMENT, note='Reconciliation')
+            self.stdout.write(self.style.SUCCESS(f'Recorded adjustments for {len(drift)} medicine(s)'))
+        elif drift:
+            raise CommandError(
+                f'{len(drift)} medicine(s) disagree with the ledger; run with --fix to record adjustments'
+            )
+        elif bad_snapshots:
+            raise CommandError(f'{bad_snapshots} snapshot(s) disagree with the ledger')
+        else:
+            self.stdout.write(self.style.SUCCESS('Stock ledger matches quantity_in_stock'))
+
+    def _check_snapshot(self, medicine_id, running, checkpoint):
+        last_id, quantity, taken_at = checkpoint
+        if running == quantity:
+            return 0
+        self.stdout.write(self.style.WARNING(
+            f'Medicine #{medicine_id}: snapshot at {taken_at:%Y-%m-%d %H:%M} says {quantity}, ledger says {running}'
+        ))
+        return 1
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from pharmacy import stock
+
+
+class Command(BaseCommand):
+    help = 'Record every medicine\'s stock ledger balance as a snapshot'
+
+    def handle(self, *args, **options):
+        written = stock.take_snapshot()
+        if written:
+            self.stdout.write(self.style.SUCCESS(f'Snapshot written for {written} medicine(s)'))
+        else:
+            self.stdout.write('A snapshot for this point already exists; nothing written')
@@ -1,9 +1,11 @@
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from patients.models import Patient, Visit
 from users.models import User
+from core.models import TrackedFieldsMixin
 
-class Medicine(models.Model):
+class Medicine(TrackedFieldsMixin, models.Model):
     class Category(models.TextChoices):
         TABLET = 'TABLET', _('Tablet')
         CAPSULE = 'CAPSULE', _('Capsule')
@@ -34,7 +36,80 @@ class Medicine(models.Model):
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
-class Prescription(models.Model):
+    # Direct edits to the stock level are written to the ledger, see pharmacy.stock
+    tracked_fields = ('quantity_in_stock',)
+
+class StockMovement(models.Model):
+    """Append-only ledger of every change to a medicine's stock"""
+    class Kind(models.TextChoices):
+        RECEIPT = 'RECEIPT', _('Receipt')
+        DISPENSE = 'DISPENSE', _('Dispense')
+        ADJUSTMENT = 'ADJUSTMENT', _('Adjustment')
+        EXPIRY = 'EXPIRY', _('Expiry')
+
+    # Deleted with its medicine, like the snapshots summing it
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='movements')
+    kind = models.CharField(max_length=20, choices=Kind.choices)
+    # Signed: positive adds to stock, negative takes from it
+    quantity = models.IntegerField()
+    reference = models.CharField(max_length=50, blank=True)  # prescription ID, delivery note, ...
+    note = models.CharField(max_length=200, blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.quantity:+d} of medicine #{self.medicine_id}"
+
+    class Meta:
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['medicine', 'id'], name='stock_movement_medicine_idx'),
+            models.Index(fields=['created_at'], name='stock_movement_created_idx'),
+        ]
+
+class StockSnapshot(models.Model):
+    """Ledger balance of one medicine as of a snapshot run, see pharmacy.stock"""
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='snapshots')
+    quantity = models.IntegerField()
+    taken_at = models.DateTimeField()
+    # Highest StockMovement id included in ``quantity``
+    last_movement_id = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Medicine #{self.medicine_id}: {self.quantity} at {self.taken_at:%Y-%m-%d %H:%M}"
+
+    class Meta:
+        unique_together = ['medicine', 'taken_at']
+        ordering = ['-taken_at']
+        indexes = [
+            models.Index(fields=['taken_at'], name='stock_snapshot_taken_idx'),
+        ]
+
+class StockForecast(models.Model):
+    """Consumption forecast for one medicine, written by the forecast_stock command"""
+    medicine = models.OneToOneField(Medicine, on_delete=models.CASCADE, related_name='forecast')
+    daily_demand = models.FloatField()  # units per day, recent days weighted highest
+    demand_std = models.FloatField()
+    # Reorder when stock falls to ``reorder_point``; order up to ``order_up_to``
+    reorder_point = models.IntegerField()
+    order_up_to = models.IntegerField()
+    # As of ``computed_at``; the low-stock view recomputes both from live stock
+    days_of_cover = models.FloatField(null=True, blank=True)  # null: no recent demand
+    suggested_order = models.IntegerField(default=0)
+    computed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Forecast for medicine #{self.medicine_id}: {self.daily_demand:.2f}/day"
+
+    def cover_for(self, quantity):
+        """Days ``quantity`` units last at the forecast demand"""
+        return quantity / self.daily_demand if self.daily_demand > 0 else None
+
+    def order_for(self, quantity):
+        """Units to order when ``quantity`` is in stock"""
+        return max(self.order_up_to - quantity, 0) if quantity <= self.reorder_point else 0
+
+class Prescription(TrackedFieldsMixin, models.Model):
     class Status(models.TextChoices):
         PENDING = 'PENDING', _('Pending')
         UNDER_REVIEW = 'UNDER_REVIEW', _('Under Review')
@@ -53,6 +128,18 @@ class Prescription(models.Model):
     reviewed_at = models.DateTimeField(null=True, blank=True)
     dispensed_at = models.DateTimeField(null=True, blank=True)
 
+    tracked_fields = ('status',)
+
+    class Meta:
+        indexes = [
+            # Pharmacy queues by status, newest first
+            models.Index(fields=['status', 'created_at'], name='prescription_status_idx'),
+            # Date ranges in reports
+            models.Index(fields=['created_at'], name='prescription_created_idx'),
+            # Dispensing history read by pharmacy.forecast
+            models.Index(fields=['status', 'dispensed_at'], name='prescription_dispensed_idx'),
+        ]
+
 class PrescriptionItem(models.Model):
     prescription = models.ForeignKey(Prescription, on_delete=models.CASCADE, related_name='items')
     medicine = models.ForeignKey(Medicine, on_delete=models.PROTECT)
@@ -0,0 +1,251 @@
+"""In-memory autocomplete index over the active medicine catalogue.
+
+Each process keeps a small index of the catalogue: every field's 2- and
+3-character grams map to the medicines containing them, so a keystroke
+resolves to a set intersection and a ranking pass in memory instead of
+three ``icontains`` scans.
+
+Freshness is tracked by two version stamps in the cache. ``catalogue``
+changes when a Medicine is saved or deleted and triggers a rebuild.
+``stock`` is a counter bumped when pharmacy.stock moves quantities, with
+the medicine ids of each change logged under the new version, so a
+process that falls behind reloads the quantities of just those medicines.
+A process further behind than the log reaches reloads them all. With
+several worker processes the cache must be shared (``CACHE_BACKEND``)
+for the stamps to reach every process.
+
+Until a process has built its index, queries are answered from the
+database while the index is built in the background.
+"""
+import heapq
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import Medicine
+
+CATALOGUE_VERSION_KEY = 'medicine_index:catalogue'
+STOCK_VERSION_KEY = 'medicine_index:stock'
+
+RESULT_LIMIT = 10
+
+# Stock changes kept in the cache for lagging processes to catch up from;
+# a process further behind reloads every quantity instead
+STOCK_LOG_LENGTH = 100
+STOCK_LOG_TIMEOUT = 60 * 60
+
+_FIELDS = ('id', 'medicine_id', 'name', 'generic_name', 'strength', 'dosage_form', 'unit_price')
+
+
+def _grams(text):
+    grams = set()
+    for size in (2, 3):
+        grams.update(text[i:i + size] for i in range(len(text) - size + 1))
+    return grams
+
+
+def _query_grams(term):
+    size = 2 if len(term) < 3 else 3
+    return {term[i:i + size] for i in range(len(term) - size + 1)}
+
+
+class MedicineIndex:
+    def __init__(self, rows, catalogue_version):
+        self.catalogue_version = catalogue_version
+        self.stock_version = None
+        self.stock = {}
+        self.entries = {}
+        self.grams = {}
+        for row in rows:
+            entry = dict(zip(_FIELDS, row))
+            entry['unit_price'] = str(entry['unit_price'])
+            entry['_name'] = entry['name'].lower()
+            entry['_generic'] = entry['generic_name'].lower()
+            entry['_code'] = entry['medicine_id'].lower()
+            entry['_text'] = '\x00'.join((entry['_name'], entry['_generic'], entry['_code']))
+            self.entries[entry['id']] = entry
+            for gram in _grams(entry['_text']):
+                self.grams.setdefault(gram, set()).add(entry['id'])
+
+    def load_stock(self, stock_version):
+        self.stock = dict(
+            Medicine.objects.filter(is_active=True).values_list('id', 'quantity_in_stock')
+        )
+        self.stock_version = stock_version
+
+    def refresh_stock(self, stock_version):
+        """Catch up to ``stock_version``, reloading only the medicines changed since"""
+        behind = stock_version - self.stock_version if self.stock_version is not None else 0
+        changes = {}
+        if 0 < behind <= STOCK_LOG_LENGTH:
+            changes = cache.get_many([
+                _stock_log_key(version) for version in range(self.stock_version + 1, stock_version + 1)
+            ])
+        if not behind or len(changes) != behind:
+            # A new epoch, or part of the log is gone
+            self.load_stock(stock_version)
+            return
+        changed = set().union(*changes.values())
+        stock = dict(self.stock)
+        for pk in changed:
+            stock.pop(pk, None)
+        stock.update(
+            Medicine.objects.filter(pk__in=changed, is_active=True).values_list('id', 'quantity_in_stock')
+        )
+        # Swapped in whole: other threads may be searching this index
+        self.stock = stock
+        self.stock_version = stock_version
+
+    def _candidates(self, term):
+        grams = _query_grams(term)
+        if not grams:
+            # A single character: too short for the gram index
+            return {pk for pk, entry in self.entries.items() if term in entry['_text']}
+        ids = None
+        for gram in grams:
+            matches = self.grams.get(gram)
+            if not matches:
+                return set()
+            ids = set(matches) if ids is None else ids & matches
+        return {pk for pk in ids if term in self.entries[pk]['_text']}
+
+    @staticmethod
+    def _tier(entry, term):
+        if term == entry['_code']:
+            return 0
+        if entry['_name'].startswith(term):
+            return 1
+        if any(word.startswith(term) for word in entry['_name'].split()):
+            return 2
+        if any(word.startswith(term) for word in entry['_generic'].split()):
+            return 3
+        if entry['_code'].startswith(term):
+            return 4
+        return 5
+
+    def search(self, query, limit=RESULT_LIMIT):
+        terms = query.lower().split()
+        if not terms:
+            return []
+        ids = None
+        for term in terms:
+            matches = self._candidates(term)
+            ids = matches if ids is None else ids & matches
+            if not ids:
+                return []
+
+        ranked = heapq.nsmallest(
+            limit,
+            (pk for pk in ids if self.stock.get(pk, 0) > 0),
+            key=lambda pk: (
+                sum(self._tier(self.entries[pk], term) for term in terms),
+                len(self.entries[pk]['name']),
+                self.entries[pk]['_name'],
+            ),
+        )
+        results = []
+        for pk in ranked:
+            entry = self.entries[pk]
+            result = {field: entry[field] for field in _FIELDS}
+            result['quantity_in_stock'] = self.stock[pk]
+            results.append(result)
+        return results
+
+
+_index = None
+_build_lock = threading.Lock()
+
+
+def _versions():
+    stamps = cache.get_many([CATALOGUE_VERSION_KEY, STOCK_VERSION_KEY])
+    for key in (CATALOGUE_VERSION_KEY, STOCK_VERSION_KEY):
+        if key not in stamps:
+            # Evicted or never set: start a new epoch every process will notice
+            cache.add(key, time.time_ns(), None)
+            stamps[key] = cache.get(key)
+    return stamps[CATALOGUE_VERSION_KEY], stamps[STOCK_VERSION_KEY]
+
+
+def _build(catalogue_version, stock_version):
+    global _index
+    if not _build_lock.acquire(blocking=False):
+        return  # another thread is already building
+    try:
+        rows = Medicine.objects.filter(is_active=True).values_list(*_FIELDS)
+        index = MedicineIndex(rows, catalogue_version)
+        index.load_stock(stock_version)
+        _index = index
+    finally:
+        _build_lock.release()
+
+
+def _build_in_background(catalogue_version, stock_version):
+    if _build_lock.locked():
+        return
+
+    def run():
+        try:
+            _build(catalogue_version, stock_version)
+        finally:
+            connection.close()
+
+    threading.Thread(target=run, name='medicine-index', daemon=True).start()
+
+
+def _search_database(query, limit):
+    medicines = Medicine.objects.filter(
+        Q(name__icontains=query) |
+        Q(generic_name__icontains=query) |
+        Q(medicine_id__icontains=query)
+    ).filter(
+        quantity_in_stock__gt=0,
+        is_active=True
+    ).values(*_FIELDS, 'quantity_in_stock')[:limit]
+    return [dict(medicine, unit_price=str(medicine['unit_price'])) for medicine in medicines]
+
+
+def search_medicines(query, limit=RESULT_LIMIT):
+    """Ranked in-stock active medicines matching every word of ``query``"""
+    catalogue_version, stock_version = _versions()
+    index = _index
+    if index is None:
+        _build_in_background(catalogue_version, stock_version)
+        return _search_database(query, limit)
+    if index.catalogue_version != catalogue_version:
+        # Serve the previous catalogue while the new one is built
+        _build_in_background(catalogue_version, stock_version)
+    if index.stock_version != stock_version:
+        index.refresh_stock(stock_version)
+    return index.search(query, limit)
+
+
+def _bump(key):
+    transaction.on_commit(lambda: cache.set(key, time.time_ns(), None))
+
+
+def catalogue_changed(sender, instance=None, **kwargs):
+    """post_save / post_delete for Medicine"""
+    _bump(CATALOGUE_VERSION_KEY)
+
+
+def _stock_log_key(version):
+    return f'{STOCK_VERSION_KEY}:{version}'
+
+
+def stock_changed(medicine_ids):
+    """Called by pharmacy.stock after the quantities of ``medicine_ids`` move through UPDATE statements"""
+    medicine_ids = sorted(medicine_ids)
+
+    def publish():
+        try:
+            version = cache.incr(STOCK_VERSION_KEY)
+        except ValueError:
+            # Evicted: the new epoch has every process reload in full
+            cache.add(STOCK_VERSION_KEY, time.time_ns(), None)
+            return
+        cache.set(_stock_log_key(version), medicine_ids, STOCK_LOG_TIMEOUT)
+
+    transaction.on_commit(publish)
@@ -0,0 +1,253 @@
+"""Medicine stock changes.
+
+Stock is taken out for a whole prescription at once. The medicine rows
+are locked in primary-key order (so two cashiers never deadlock on the
+same medicines) and then decremented by one conditional UPDATE that only
+touches rows still holding enough stock. Either every item is taken or
+nothing is, and a shortfall reports every short medicine, not just the
+first one found.
+
+Every change is also written to the ``StockMovement`` ledger in the same
+transaction, in bulk. ``take_snapshot`` periodically stores each
+medicine's ledger balance in ``StockSnapshot``. Stock at any moment is
+then the latest snapshot before it plus the few movements after it, so
+nothing has to sum the whole ledger.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Max, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from . import search
+from .models import Medicine, StockMovement, StockSnapshot
+
+# Movements younger than this are left for the next snapshot, so a
+# transaction that was still open when the snapshot ran is not skipped
+SNAPSHOT_SETTLE = timedelta(minutes=5)
+
+
+class InsufficientStock(Exception):
+    def __init__(self, shortfalls):
+        # [(medicine name, quantity needed, quantity in stock), ...]
+        self.shortfalls = shortfalls
+        super().__init__('; '.join(
+            f'{name}: need {needed}, {available} in stock' for name, needed, available in shortfalls
+        ))
+
+
+class _StockChanged(Exception):
+    pass
+
+
+def prescription_quantities(prescription):
+    """``{medicine id: total quantity}`` for a prescription's items"""
+    return dict(
+        prescription.items.values_list('medicine_id')
+        .annotate(total=Sum('quantity'))
+        .order_by()
+    )
+
+
+def _shortfalls(quantities, stock):
+    """Compare wanted ``quantities`` with ``stock`` rows ``{id: (name, in stock)}``"""
+    shortfalls = []
+    for medicine_id, needed in sorted(quantities.items()):
+        name, available = stock.get(medicine_id, (f'Medicine #{medicine_id}', 0))
+        if available < needed:
+            shortfalls.append((name, needed, available))
+    return shortfalls
+
+
+def _locked_stock(medicine_ids):
+    rows = (
+        Medicine.objects.select_for_update()
+        .filter(pk__in=medicine_ids)
+        .order_by('pk')
+        .values_list('pk', 'name', 'quantity_in_stock')
+    )
+    return {pk: (name, quantity) for pk, name, quantity in rows}
+
+
+def check_stock(quantities):
+    """Shortfalls for ``quantities`` right now, without changing anything"""
+    stock = {
+        pk: (name, quantity)
+        for pk, name, quantity in Medicine.objects.filter(pk__in=quantities)
+        .values_list('pk', 'name', 'quantity_in_stock')
+    }
+    return _shortfalls(quantities, stock)
+
+
+def low_stock():
+    """Active medicines at or below their reorder point.
+
+    The point is the forecast's (see pharmacy.forecast) where one exists,
+    and never lower than the medicine's own ``reorder_level``.
+    """
+    return Medicine.objects.filter(is_active=True).annotate(
+        reorder_at=Greatest('reorder_level', Coalesce('forecast__reorder_point', 'reorder_level'))
+    ).filter(quantity_in_stock__lte=F('reorder_at'))
+
+
+def record_movements(changes, kind, reference='', note='', user=None):
+    """Append ``{medicine id: signed change}`` to the ledger in one INSERT"""
+    StockMovement.objects.bulk_create([
+        StockMovement(
+            medicine_id=medicine_id, kind=kind, quantity=change,
+            reference=reference, note=note, created_by=user,
+        )
+        for medicine_id, change in changes.items() if change
+    ])
+
+
+def take_stock(quantities, kind=StockMovement.Kind.DISPENSE, reference='', note='', user=None):
+    """Remove ``{medicine id: quantity}`` from stock, all or nothing.
+
+    Raises ``InsufficientStock`` listing every short medicine; the stock is
+    left untouched in that case. Runs in (and rolls back only) its own
+    savepoint, so callers can wrap it together with their other writes.
+    """
+    quantities = {pk: n for pk, n in quantities.items() if n > 0}
+    if not quantities:
+        return
+
+    try:
+        with transaction.atomic():
+            shortfalls = _shortfalls(quantities, _locked_stock(list(quantities)))
+            if shortfalls:
+                raise InsufficientStock(shortfalls)
+
+            enough = Q()
+            for pk, n in quantities.items():
+                enough |= Q(pk=pk, quantity_in_stock__gte=n)
+            delta = Case(
+                *[When(pk=pk, then=Value(n)) for pk, n in quantities.items()],
+                output_field=IntegerField(),
+            )
+            updated = Medicine.objects.filter(enough).update(
+                quantity_in_stock=F('quantity_in_stock') - delta
+            )
+            if updated != len(quantities):
+                # Another transaction got in between; only possible where
+                # SELECT ... FOR UPDATE is a no-op (SQLite). Roll back first.
+                raise _StockChanged
+            record_movements({pk: -n for pk, n in quantities.items()}, kind, reference, note, user)
+            search.stock_changed(quantities)
+    except _StockChanged:
+        raise InsufficientStock(check_stock(quantities)) from None
+
+
+def take_prescription_stock(prescription, user=None):
+    """Remove every item of ``prescription`` from stock, all or nothing"""
+    take_stock(
+        prescription_quantities(prescription),
+        reference=prescription.prescription_id,
+        user=user,
+    )
+
+
+def add_stock(quantities, kind=StockMovement.Kind.RECEIPT, reference='', note='', user=None):
+    """Add ``{medicine id: quantity}`` to stock (deliveries, returns)"""
+    quantities = {pk: n for pk, n in quantities.items() if n > 0}
+    if not quantities:
+        return
+    delta = Case(
+        *[When(pk=pk, then=Value(n)) for pk, n in quantities.items()],
+        output_field=IntegerField(),
+    )
+    with transaction.atomic():
+        Medicine.objects.filter(pk__in=quantities).update(
+            quantity_in_stock=F('quantity_in_stock') + delta
+        )
+        record_movements(quantities, kind, reference, note, user)
+        search.stock_changed(quantities)
+
+
+def record_direct_change(sender, instance, created, raw=False, **kwargs):
+    """post_save for Medicine: ledger an edit of quantity_in_stock made through save()"""
+    if raw or 'quantity_in_stock' not in instance.changed_fields:
+        return
+    change = instance.quantity_in_stock - (instance.changed_fields['quantity_in_stock'] or 0)
+    kind = StockMovement.Kind.RECEIPT if created else StockMovement.Kind.ADJUSTMENT
+    record_movements(
+        {instance.pk: change}, kind,
+        note='Opening stock' if created else 'Stock level edited',
+    )
+
+
+def _latest_run(at=None):
+    """``taken_at`` of the newest snapshot run at or before ``at``"""
+    runs = StockSnapshot.objects.all()
+    if at is not None:
+        runs = runs.filter(taken_at__lte=at)
+    return runs.aggregate(latest=Max('taken_at'))['latest']
+
+
+def ledger_quantities(at=None, medicine_ids=None):
+    """``{medicine id: quantity}`` per the ledger, now or as of ``at``.
+
+    Starts from the latest snapshot run at or before ``at`` and adds only
+    the movements recorded after it.
+    """
+    balances, last_movement_id = {}, 0
+    taken_at = _latest_run(at)
+    if taken_at is not None:
+        snapshots = StockSnapshot.objects.filter(taken_at=taken_at)
+        if medicine_ids is not None:
+            snapshots = snapshots.filter(medicine_id__in=medicine_ids)
+        for medicine_id, quantity, boundary in snapshots.values_list(
+            'medicine_id', 'quantity', 'last_movement_id'
+        ):
+            balances[medicine_id] = quantity
+            last_movement_id = boundary
+
+    movements = StockMovement.objects.filter(id__gt=last_movement_id)
+    if at is not None:
+        movements = movements.filter(created_at__lte=at)
+    if medicine_ids is not None:
+        movements = movements.filter(medicine_id__in=medicine_ids)
+    for medicine_id, change in (
+        movements.values_list('medicine_id').annotate(change=Sum('quantity')).order_by()
+    ):
+        balances[medicine_id] = balances.get(medicine_id, 0) + change
+    return balances
+
+
+def take_snapshot(now=None):
+    """Store every medicine's ledger balance; returns the rows written.
+
+    Movements newer than ``SNAPSHOT_SETTLE`` are left out (and picked up by
+    the next run) so that every movement lands in exactly one snapshot.
+    """
+    taken_at = (now or timezone.now()) - SNAPSHOT_SETTLE
+    boundary = StockMovement.objects.filter(created_at__lte=taken_at).aggregate(
+        last=Max('id')
+    )['last'] or 0
+    previous = _latest_run()
+    if previous is not None and previous >= taken_at:
+        return 0
+
+    balances, previous_boundary = {}, 0
+    if previous is not None:
+        for medicine_id, quantity, last_id in StockSnapshot.objects.filter(
+            taken_at=previous
+        ).values_list('medicine_id', 'quantity', 'last_movement_id'):
+            balances[medicine_id] = quantity
+            previous_boundary = last_id
+    for medicine_id, change in (
+        StockMovement.objects.filter(id__gt=previous_boundary, id__lte=boundary)
+        .values_list('medicine_id').annotate(change=Sum('quantity')).order_by()
+    ):
+        balances[medicine_id] = balances.get(medicine_id, 0) + change
+
+    rows = [
+        StockSnapshot(
+            medicine_id=medicine_id, quantity=balances.get(medicine_id, 0),
+            taken_at=taken_at, last_movement_id=boundary,
+        )
+        for medicine_id in Medicine.objects.values_list('id', flat=True)
+    ]
+    StockSnapshot.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
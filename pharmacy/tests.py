@@ -1,3 +1,154 @@
+import json
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from core.testing import make_medicine, make_prescription, make_user
+from users.models import User
+
+from . import cart as cart_service, forecast, search, stock
+from .models import CartItem, Medicine, Prescription, PrescriptionItem, StockForecast, StockMovement
+
+
+class StockLedgerTests(TestCase):
+    def test_medicine_with_movements_can_be_deleted(self):
+        medicine = make_medicine(quantity_in_stock=5)
+        stock.add_stock({medicine.pk: 10})
+        self.assertEqual(medicine.movements.count(), 2)
+
+        medicine.delete()
+        self.assertFalse(Medicine.objects.filter(pk=medicine.pk).exists())
+        self.assertFalse(StockMovement.objects.filter(medicine_id=medicine.pk).exists())
+
+
+class MedicineSearchStockTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.medicine = make_medicine(name='Amoxicillin', quantity_in_stock=10)
+        self.other = make_medicine(name='Amlodipine', quantity_in_stock=3)
+        search._build(*search._versions())
+
+    def tearDown(self):
+        search._index = None
+
+    def quantities(self, query):
+        return {row['id']: row['quantity_in_stock'] for row in search.search_medicines(query)}
+
+    def test_stock_change_reloads_only_the_changed_medicines(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            stock.add_stock({self.medicine.pk: 5})
+        with mock.patch.object(search.MedicineIndex, 'load_stock', side_effect=AssertionError('full reload')):
+            self.assertEqual(self.quantities('am'), {self.medicine.pk: 15, self.other.pk: 3})
+
+    def test_lost_change_log_falls_back_to_a_full_reload(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            stock.take_stock({self.other.pk: 3})
+        cache.delete(search._stock_log_key(cache.get(search.STOCK_VERSION_KEY)))
+        self.assertEqual(self.quantities('am'), {self.medicine.pk: 10})
+
+
+class ForecastTests(TestCase):
+    def test_recent_demand_raises_the_reorder_point(self):
+        now = timezone.now()
+        busy = make_medicine(quantity_in_stock=20, reorder_level=5)
+        idle = make_medicine(quantity_in_stock=20, reorder_level=5)
+        Medicine.objects.update(created_at=now - timedelta(days=60))
+        for days_ago in range(1, 15):
+            make_prescription(
+                items=[(busy, 10)], status=Prescription.Status.DISPENSED,
+                dispensed_at=now - timedelta(days=days_ago),
+            )
+
+        self.assertEqual(forecast.forecast(now=now), 2)
+
+        busy_forecast = StockForecast.objects.get(medicine=busy)
+        self.assertGreater(busy_forecast.daily_demand, 0)
+        self.assertGreater(busy_forecast.reorder_point, 20)
+        self.assertGreater(busy_forecast.suggested_order, 0)
+        idle_forecast = StockForecast.objects.get(medicine=idle)
+        self.assertEqual(idle_forecast.reorder_point, 5)
+        self.assertIsNone(idle_forecast.days_of_cover)
+        self.assertEqual(list(stock.low_stock()), [busy])
+
+
+class CartBatchTests(TestCase):
+    def setUp(self):
+        self.pharmacist = make_user(User.Role.PHARMACIST)
+        self.tablets = make_medicine(unit_price=Decimal('5.00'))
+        self.syrup = make_medicine(unit_price=Decimal('12.50'))
+        self.prescription = make_prescription(items=[(self.tablets, 2)])
+        self.cart = cart_service.active_cart(self.pharmacist, self.prescription)
+
+    def assertTotalMatchesItems(self, expected):
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.total_amount, Decimal(expected))
+        self.assertEqual(sum(item.subtotal for item in CartItem.objects.filter(cart=self.cart)), Decimal(expected))
+
+    def test_total_follows_adds_updates_and_removes(self):
+        cart_service.apply_operations(self.cart, [
+            {'op': 'add', 'medicine_id': self.tablets.pk, 'quantity': 2},
+            {'op': 'add', 'medicine_id': self.syrup.pk, 'quantity': 1},
+            {'op': 'add', 'medicine_id': self.tablets.pk, 'quantity': 1},
+        ])
+        self.assertTotalMatchesItems('27.50')
+        # Medicine the doctor did not prescribe is added to the prescription
+        self.assertEqual(PrescriptionItem.objects.get(prescription=self.prescription, medicine=self.syrup).quantity, 1)
+
+        tablets = CartItem.objects.get(cart=self.cart, prescription_item__medicine=self.tablets)
+        syrup = CartItem.objects.get(cart=self.cart, prescription_item__medicine=self.syrup)
+        cart = cart_service.apply_operations(self.cart, [
+            {'op': 'update', 'cart_item_id': tablets.pk, 'quantity': 4},
+            {'op': 'remove', 'cart_item_id': syrup.pk},
+        ])
+        self.assertEqual(cart.total_amount, Decimal('20.00'))
+        self.assertTotalMatchesItems('20.00')
+
+    def test_bad_operation_leaves_the_cart_untouched(self):
+        cart_service.apply_operations(self.cart, [{'op': 'add', 'medicine_id': self.tablets.pk, 'quantity': 2}])
+        with self.assertRaises(cart_service.CartError):
+            cart_service.apply_operations(self.cart, [
+                {'op': 'add', 'medicine_id': self.syrup.pk, 'quantity': 1},
+                {'op': 'remove', 'cart_item_id': 999999},
+            ])
+        self.assertTotalMatchesItems('10.00')
+        self.assertFalse(PrescriptionItem.objects.filter(medicine=self.syrup).exists())
+
+    def test_view_reports_the_new_total(self):
+        self.client.force_login(self.pharmacist)
+        response = self.client.post(
+            reverse('cart_batch'),
+            json.dumps({
+                'prescription_id': self.prescription.prescription_id,
+                'operations': [{'op': 'add', 'medicine_id': self.syrup.pk, 'quantity': 2}],
+            }),
+            content_type='application/json',
+        )
+        self.assertEqual(response.json()['status'], 'success')
+        self.assertEqual(Decimal(response.json()['cart_total']), Decimal('25.00'))
+
+
+@mock.patch('pharmacy.views.DASHBOARD_LIST_LIMIT', 2)
+class PharmacyDashboardTests(TestCase):
+    def test_lists_are_capped_but_totals_are_not(self):
+        ready = [make_prescription(status=Prescription.Status.READY) for _ in range(3)]
+        make_prescription()
+        self.client.force_login(make_user(User.Role.ADMIN))
+        response = self.client.get(reverse('pharmacy_dashboard'))
+        self.assertEqual(response.context['ready_count'], 3)
+        self.assertEqual(response.context['pending_count'], 1)
+        self.assertEqual(
+            [prescription.pk for prescription in response.context['ready_prescriptions']],
+            [prescription.pk for prescription in reversed(ready[1:])],
+        )
 
-# Create your tests here.
+    def test_cashier_sees_no_pending_total(self):
+        make_prescription()
+        self.client.force_login(make_user(User.Role.CASHIER))
+        response = self.client.get(reverse('pharmacy_dashboard'))
+        self.assertEqual(response.context['pending_count'], 0)
+        self.assertEqual(list(response.context['pending_prescriptions']), [])
@@ -6,9 +6,11 @@ urlpatterns = [
     path('prescriptions/', views.prescription_list, name='prescription_list'),
     path('prescriptions/<str:prescription_id>/', views.prescription_detail, name='prescription_detail'),
     path('prescription/<str:prescription_id>/', views.prescription_details, name='prescription_details'),
+    path('medicines/low-stock/', views.low_stock, name='low_stock'),
     path('medicines/search/', views.medicine_search, name='medicine_search'),
     path('cart/add/', views.add_to_cart, name='add_to_cart'),
     path('cart/update/', views.update_cart, name='update_cart'),
     path('cart/remove/', views.remove_from_cart, name='remove_from_cart'),
+    path('cart/batch/', views.cart_batch, name='cart_batch'),
     path('dispense/<str:prescription_id>/', views.dispense_medicines, name='dispense_medicines'),
 ]
\ No newline at end of file
@@ -3,47 +3,84 @@ from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
 from django.views.decorators.http import require_http_methods
-from django.db.models import Q
 from django.utils import timezone
 from django.db import transaction
-from .models import Medicine, Prescription, PrescriptionItem, DispenseCart, CartItem
+from django.db.models import Count, Max, Q
+from .models import Prescription, DispenseCart, StockForecast
 from core.models import Notification
+from core import fanout
+from . import cart as cart_service, search, stock
 from users.models import User
 from billing.models import Payment
 from patients.models import Patient, Visit
-import random
+from core.utils import generate_payment_id, generate_receipt_number
+
+# Prescriptions listed per status on the dashboard
+DASHBOARD_LIST_LIMIT = 50
 
 @login_required
 def pharmacy_dashboard(request):
     if request.user.role not in ['PHARMACIST', 'CASHIER', 'ADMIN']:
         return render(request, '403.html', status=403)
     
-    # Get prescriptions based on user role
-    if request.user.role == 'PHARMACIST':
-        pending_prescriptions = Prescription.objects.filter(status=Prescription.Status.PENDING)
-        ready_prescriptions = Prescription.objects.filter(status=Prescription.Status.READY)
-    elif request.user.role == 'CASHIER':
-        pending_prescriptions = Prescription.objects.none()  # Cashiers don't see pending
-        ready_prescriptions = Prescription.objects.filter(status=Prescription.Status.READY)
-    else:  # ADMIN
-        pending_prescriptions = Prescription.objects.filter(status=Prescription.Status.PENDING)
-        ready_prescriptions = Prescription.objects.filter(status=Prescription.Status.READY)
+    totals = Prescription.objects.aggregate(
+        pending=Count('pk', filter=Q(status=Prescription.Status.PENDING)),
+        ready=Count('pk', filter=Q(status=Prescription.Status.READY)),
+    )
+    # Newest first with their names; the cards show the full totals
+    listed = Prescription.objects.select_related('visit__patient', 'prescribed_by').order_by('-created_at')
+    if request.user.role == 'CASHIER':
+        pending_prescriptions, totals['pending'] = [], 0  # Cashiers don't see pending
+    else:
+        pending_prescriptions = listed.filter(status=Prescription.Status.PENDING)[:DASHBOARD_LIST_LIMIT]
+    ready_prescriptions = listed.filter(status=Prescription.Status.READY)[:DASHBOARD_LIST_LIMIT]
     
-    active_carts = DispenseCart.objects.filter(pharmacist=request.user, is_active=True)
+    active_carts = list(
+        DispenseCart.objects.filter(pharmacist=request.user, is_active=True)
+        .select_related('prescription__visit__patient')
+    )
 
-    prescriptions = Prescription.objects.filter(status=Prescription.Status.PENDING).order_by('-created_at')
+    prescriptions = pending_prescriptions
     
     context = {
         'pending_prescriptions': pending_prescriptions,
         'ready_prescriptions': ready_prescriptions,
+        'pending_count': totals['pending'],
+        'ready_count': totals['ready'],
         'active_carts': active_carts,
         'prescriptions':prescriptions,
     }
     return render(request, 'pharmacy/dashboard.html', context)
 
+@login_required
+def low_stock(request):
+    """Medicines at or below their reorder point, the first to run out on top"""
+    if request.user.role not in ['PHARMACIST', 'ADMIN']:
+        return render(request, '403.html', status=403)
+
+    medicines = list(stock.low_stock().select_related('forecast').order_by('name'))
+    for medicine in medicines:
+        forecast = getattr(medicine, 'forecast', None)
+        # Live stock against the stored forecast; static reorder level without one
+        if forecast is not None:
+            medicine.days_of_cover = forecast.cover_for(medicine.quantity_in_stock)
+            medicine.suggested_order = forecast.order_for(medicine.quantity_in_stock)
+        else:
+            medicine.days_of_cover = None
+            medicine.suggested_order = max(medicine.reorder_level * 2 - medicine.quantity_in_stock, 0)
+    medicines.sort(key=lambda m: (m.days_of_cover is None, m.days_of_cover or 0))
+
+    context = {
+        'medicines': medicines,
+        'forecast_at': StockForecast.objects.aggregate(latest=Max('computed_at'))['latest'],
+    }
+    return render(request, 'pharmacy/low_stock.html', context)
+
 @login_required
 def prescription_list(request):
-    prescriptions = Prescription.objects.all().order_by('-created_at')
+    prescriptions = Prescription.objects.select_related(
+        'visit__patient', 'prescribed_by'
+    ).order_by('-created_at')
     return render(request, 'pharmacy/prescription_list.html', {'prescriptions': prescriptions})
 
 @login_required
@@ -105,91 +142,46 @@ def medicine_search(request):
     if len(query) < 2:
         return JsonResponse({'medicines': []})
     
-    medicines = Medicine.objects.filter(
-        Q(name__icontains=query) | 
-        Q(generic_name__icontains=query) |
-        Q(medicine_id__icontains=query)
-    ).filter(
-        quantity_in_stock__gt=0,
-        is_active=True
-    )[:10]  # Limit results
-    
-    results = []
-    for medicine in medicines:
-        results.append({
-            'id': medicine.id,
-            'medicine_id': medicine.medicine_id,
-            'name': medicine.name,
-            'generic_name': medicine.generic_name,
-            'quantity_in_stock': medicine.quantity_in_stock,
-            'unit_price': str(medicine.unit_price),
-            'strength': medicine.strength,
-            'dosage_form': medicine.dosage_form,
-        })
-    
-    return JsonResponse({'medicines': results})
+    # Ranked matches from the per-process catalogue index, see pharmacy.search
+    return JsonResponse({'medicines': search.search_medicines(query)})
 
 @login_required
 @require_http_methods(["POST"])
 def add_to_cart(request):
     try:
         data = json.loads(request.body)
-        prescription_id = data.get('prescription_id')
-        medicine_id = data.get('medicine_id')
-        quantity = int(data.get('quantity', 1))
-        
-        prescription = get_object_or_404(Prescription, prescription_id=prescription_id)
-        medicine = get_object_or_404(Medicine, id=medicine_id)
-        
-        # Get or create cart
-        cart, created = DispenseCart.objects.get_or_create(
-            pharmacist=request.user,
-            prescription=prescription,
-            is_active=True
+        prescription = get_object_or_404(Prescription, prescription_id=data.get('prescription_id'))
+        cart = cart_service.apply_operations(
+            cart_service.active_cart(request.user, prescription),
+            [dict(data, op='add')]
         )
         
-        # Create prescription item if not exists
-        prescription_item, created = PrescriptionItem.objects.get_or_create(
-            prescription=prescription,
-            medicine=medicine,
-            defaults={
-                'quantity': quantity,
-                'dosage': data.get('dosage', ''),
-                'duration': data.get('duration', ''),
-                'instructions': data.get('instructions', ''),
-                'unit_price': medicine.unit_price,
-                'total_price': medicine.unit_price * quantity
-            }
-        )
-        
-        if not created:
-            prescription_item.quantity += quantity
-            prescription_item.total_price = prescription_item.unit_price * prescription_item.quantity
-            prescription_item.save()
+        return JsonResponse({
+            'status': 'success',
+            'cart_total': str(cart.total_amount),
+            'message': 'Medicine added to cart successfully'
+        })
         
-        # Add to cart
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            prescription_item=prescription_item,
-            defaults={
-                'quantity_to_dispense': quantity,
-                'subtotal': medicine.unit_price * quantity
-            }
+    except Exception as e:
+        return JsonResponse({'status': 'error', 'message': str(e)})
+
+
+@login_required
+@require_http_methods(["POST"])
+def cart_batch(request):
+    """Apply a list of add / update / remove operations to the active cart in one go"""
+    try:
+        data = json.loads(request.body)
+        prescription = get_object_or_404(Prescription, prescription_id=data.get('prescription_id'))
+        cart = cart_service.apply_operations(
+            cart_service.active_cart(request.user, prescription),
+            data.get('operations', [])
         )
         
-        if not created:
-            cart_item.quantity_to_dispense += quantity
-            cart_item.subtotal = prescription_item.unit_price * cart_item.quantity_to_dispense
-            cart_item.save()
-        
-        # Update cart total
-        cart.total_amount = sum(item.subtotal for item in cart.cartitem_set.all())
-        cart.save()
-        
         return JsonResponse({
             'status': 'success',
             'cart_total': str(cart.total_amount),
-            'message': 'Medicine added to cart successfully'
+            'message': 'Cart updated successfully'
         })
         
     except Exception as e:
@@ -202,9 +194,22 @@ def dispense_medicines(request, prescription_id):
     if request.user.role != 'PHARMACIST':
         return JsonResponse({'status': 'error', 'message': 'Only pharmacists can dispense medicines'})
     
-    prescription = get_object_or_404(Prescription, prescription_id=prescription_id)
+    prescription = get_object_or_404(
+        Prescription.objects.select_related('visit__patient'), prescription_id=prescription_id
+    )
     
     if request.method == 'POST':
+        # Stock is taken at payment (pharmacy.stock); refuse now if it already can't be
+        shortfalls = stock.check_stock(stock.prescription_quantities(prescription))
+        if shortfalls:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'Insufficient stock: ' + stock.InsufficientStock(shortfalls).args[0],
+                'shortfalls': [
+                    {'medicine': name, 'needed': needed, 'available': available}
+                    for name, needed, available in shortfalls
+                ],
+            })
         try:
             with transaction.atomic():
                 # Calculate total cost from prescription items
@@ -218,7 +223,7 @@ def dispense_medicines(request, prescription_id):
                 
                 # Create pending payment record
                 payment = Payment(
-                    payment_id=f"PAY{timezone.now().strftime('%y%m%d')}{random.randint(1000, 9999)}",
+                    payment_id=generate_payment_id(),
                     patient=prescription.visit.patient,
                     visit=prescription.visit,
                     payment_type=Payment.PaymentType.MEDICINE,
@@ -228,7 +233,7 @@ def dispense_medicines(request, prescription_id):
                     processed_by=request.user,  # Pharmacist who dispensed
                     status=Payment.Status.PENDING,  # Waiting for cashier
                     notes=f'Medicine payment for prescription {prescription.prescription_id}',
-                    receipt_number=f"RCP{timezone.now().strftime('%y%m%d')}{random.randint(1000, 9999)}"
+                    receipt_number=generate_receipt_number()
                 )
                 payment.save()
                 
@@ -238,15 +243,13 @@ def dispense_medicines(request, prescription_id):
                 prescription.visit.save()
                 
                 # Create notification for cashier
-                cashiers = User.objects.filter(role=User.Role.CASHIER, is_active=True)
-                for cashier in cashiers:
-                    Notification.objects.create(
-                        recipient=cashier,
-                        notification_type=Notification.NotificationType.PAYMENT,
-                        title='Medicine Payment Required',
-                        message=f'Patient {prescription.visit.patient} needs to pay ETB {total_cost} for medicines',
-                        related_object_id=prescription.prescription_id
-                    )
+                fanout.notify_role(
+                    User.Role.CASHIER,
+                    Notification.NotificationType.PAYMENT,
+                    title='Medicine Payment Required',
+                    message=f'Patient {prescription.visit.patient} needs to pay ETB {total_cost} for medicines',
+                    related_object_id=prescription.prescription_id
+                )
                 
                 # Deactivate cart
                 DispenseCart.objects.filter(
@@ -271,22 +274,10 @@ def update_cart(request):
     try:
         data = json.loads(request.body)
         cart_item_id = data.get('cart_item_id')
-        new_quantity = int(data.get('quantity', 1))
-        
-        cart_item = get_object_or_404(CartItem, id=cart_item_id, cart__pharmacist=request.user)
         
-        if new_quantity <= 0:
-            # If quantity is 0 or negative, remove the item
-            cart_item.delete()
-        else:
-            cart_item.quantity_to_dispense = new_quantity
-            cart_item.subtotal = cart_item.prescription_item.unit_price * new_quantity
-            cart_item.save()
-        
-        # Update cart total
-        cart = cart_item.cart
-        cart.total_amount = sum(item.subtotal for item in cart.cartitem_set.all())
-        cart.save()
+        # If quantity is 0 or negative the item is removed
+        cart = get_object_or_404(DispenseCart, cartitem__id=cart_item_id, pharmacist=request.user)
+        cart = cart_service.apply_operations(cart, [dict(data, op='update')])
         
         return JsonResponse({
             'status': 'success',
@@ -304,13 +295,8 @@ def remove_from_cart(request):
         data = json.loads(request.body)
         cart_item_id = data.get('cart_item_id')
         
-        cart_item = get_object_or_404(CartItem, id=cart_item_id, cart__pharmacist=request.user)
-        cart = cart_item.cart
-        cart_item.delete()
-        
-        # Update cart total
-        cart.total_amount = sum(item.subtotal for item in cart.cartitem_set.all())
-        cart.save()
+        cart = get_object_or_404(DispenseCart, cartitem__id=cart_item_id, pharmacist=request.user)
+        cart = cart_service.apply_operations(cart, [{'op': 'remove', 'cart_item_id': cart_item_id}])
         
         return JsonResponse({
             'status': 'success',
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import FinancialReport, ReportSchedule
+from .models import FinancialReport, ReportSchedule, DailyRevenue, VisitStageDaily
 
 @admin.register(FinancialReport)
 class FinancialReportAdmin(admin.ModelAdmin):
@@ -11,6 +11,20 @@ class FinancialReportAdmin(admin.ModelAdmin):
 
 @admin.register(ReportSchedule)
 class ReportScheduleAdmin(admin.ModelAdmin):
-    list_display = ('name', 'report_period', 'is_active', 'last_run', 'next_run')
-    list_filter = ('report_period', 'is_active')
-    readonly_fields = ('created_at',)
\ No newline at end of file
+    list_display = ('name', 'report_period', 'file_format', 'is_active', 'last_run', 'next_run')
+    list_filter = ('report_period', 'file_format', 'is_active')
+    readonly_fields = ('created_at',)
+
+@admin.register(DailyRevenue)
+class DailyRevenueAdmin(admin.ModelAdmin):
+    list_display = ('date', 'payment_type', 'total_amount', 'payment_count', 'updated_at')
+    list_filter = ('payment_type',)
+    date_hierarchy = 'date'
+    readonly_fields = ('updated_at',)
+
+@admin.register(VisitStageDaily)
+class VisitStageDailyAdmin(admin.ModelAdmin):
+    list_display = ('date', 'stage', 'count', 'total_seconds', 'max_seconds', 'updated_at')
+    list_filter = ('stage',)
+    date_hierarchy = 'date'
+    readonly_fields = ('histogram', 'updated_at')
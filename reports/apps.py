@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class ReportsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'reports'
+
+    def ready(self):
+        from django.db.models.signals import post_save
+        from billing.models import Payment
+        from patients.models import VisitStatusEvent, status_events_created
+        from .rollup import update_daily_revenue
+        from .visit_stages import record_stage_event, record_stage_events
+
+        post_save.connect(update_daily_revenue, sender=Payment)
+        post_save.connect(record_stage_event, sender=VisitStatusEvent)
+        status_events_created.connect(record_stage_events, sender=VisitStatusEvent)
@@ -0,0 +1,168 @@
+"""Financial report engine shared by the report views and exports.
+
+Income is read from the ``DailyRevenue`` rollup (see reports.rollup), so
+a report costs one grouped query over at most one row per day and payment
+type rather than a scan of the payment table. The first read on a
+database whose rollup was never filled backfills it. Activity counts use
+half-open ranges on the raw timestamp columns so the database can use an
+index rather than casting every row to a date.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from billing.models import Payment
+from laboratory.models import LabTestRequest
+from patients.models import Patient, Visit
+from pharmacy.models import Prescription
+from .models import DailyRevenue
+from .rollup import ensure_backfilled
+
+# Payment types that make up the report's income lines
+INCOME_TYPES = {
+    'registration': Payment.PaymentType.REGISTRATION,
+    'lab': Payment.PaymentType.LAB_TEST,
+    'pharmacy': Payment.PaymentType.MEDICINE,
+}
+
+
+def period_range(period, year, month, today=None):
+    """Return ``(start_date, end_date, label)`` for a report period"""
+    today = today or timezone.localdate()
+    if period == 'daily':
+        return today, today, today.strftime('%B %d, %Y')
+    if period == 'weekly':
+        start_date = today - timedelta(days=7)
+        return start_date, today, f"Week of {start_date.strftime('%b %d')} to {today.strftime('%b %d, %Y')}"
+    if period == 'monthly':
+        start_date = datetime(year, month, 1).date()
+        if month == 12:
+            end_date = datetime(year + 1, 1, 1).date() - timedelta(days=1)
+        else:
+            end_date = datetime(year, month + 1, 1).date() - timedelta(days=1)
+        return start_date, end_date, start_date.strftime('%B %Y')
+    # yearly
+    return datetime(year, 1, 1).date(), datetime(year, 12, 31).date(), str(year)
+
+
+def datetime_bounds(start_date, end_date):
+    """Half-open ``[start, end)`` datetimes covering whole days ``start_date..end_date``"""
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(start_date, time.min), tz)
+    end = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min), tz)
+    return start, end
+
+
+def in_range(start_date, end_date, field='created_at'):
+    start, end = datetime_bounds(start_date, end_date)
+    return Q(**{f'{field}__gte': start, f'{field}__lt': end})
+
+
+def completed_payments(start_date, end_date):
+    return Payment.objects.filter(in_range(start_date, end_date), status=Payment.Status.COMPLETED)
+
+
+def income_totals(start_date, end_date):
+    """Income per report line for the period, in a single aggregate query"""
+    aggregates = {
+        name: Sum('total_amount', filter=Q(payment_type=payment_type))
+        for name, payment_type in INCOME_TYPES.items()
+    }
+    aggregates.update({
+        f'{name}_count': Sum('payment_count', filter=Q(payment_type=payment_type))
+        for name, payment_type in INCOME_TYPES.items()
+    })
+    ensure_backfilled()
+    totals = DailyRevenue.objects.filter(date__range=[start_date, end_date]).aggregate(**aggregates)
+
+    result = {}
+    for name in INCOME_TYPES:
+        result[f'{name}_income'] = totals[name] or 0
+        result[f'{name}_count'] = totals[f'{name}_count'] or 0
+    result['total_income'] = sum(result[f'{name}_income'] for name in INCOME_TYPES)
+    return result
+
+
+def income_series(start_date, end_date, bucket='month'):
+    """Income per report line for each month (or day) of the period.
+
+    One ``GROUP BY bucket, payment_type`` query; buckets without payments
+    are filled in with zeros so charts get a continuous series.
+    """
+    ensure_backfilled()
+    rows = DailyRevenue.objects.filter(
+        date__range=[start_date, end_date], payment_type__in=INCOME_TYPES.values()
+    )
+    if bucket == 'month':
+        rows = rows.annotate(bucket=TruncMonth('date'))
+    else:
+        rows = rows.annotate(bucket=F('date'))
+    rows = rows.values('bucket', 'payment_type').annotate(total=Sum('total_amount')).order_by()
+
+    by_type = {payment_type: name for name, payment_type in INCOME_TYPES.items()}
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row['bucket'], {})[by_type[row['payment_type']]] = row['total']
+
+    series = []
+    for key in _buckets(start_date, end_date, bucket):
+        amounts = grouped.get(key, {})
+        entry = {name: float(amounts.get(name) or 0) for name in INCOME_TYPES}
+        entry['total'] = sum(entry.values())
+        entry['date'] = key
+        series.append(entry)
+    return series
+
+
+def _buckets(start_date, end_date, bucket):
+    if bucket == 'month':
+        current = start_date.replace(day=1)
+        while current <= end_date:
+            yield current
+            current = (current.replace(day=28) + timedelta(days=4)).replace(day=1)
+    else:
+        current = start_date
+        while current <= end_date:
+            yield current
+            current += timedelta(days=1)
+
+
+def activity_counts(start_date, end_date):
+    """Patients, visits, lab tests and prescriptions created in the period"""
+    return {
+        'new_patients': Patient.objects.filter(in_range(start_date, end_date)).count(),
+        'total_visits': Visit.objects.filter(in_range(start_date, end_date)).count(),
+        'total_lab_tests': LabTestRequest.objects.filter(in_range(start_date, end_date, 'requested_at')).count(),
+        'total_prescriptions': Prescription.objects.filter(in_range(start_date, end_date)).count(),
+    }
+
+
+def financial_summary(start_date, end_date):
+    summary = income_totals(start_date, end_date)
+    summary.update(activity_counts(start_date, end_date))
+    return summary
+
+
+def today_and_month(today=None):
+    """Completed income and new patients for today and for the month so far"""
+    today = today or timezone.localdate()
+    month_start = today.replace(day=1)
+    today_start, _ = datetime_bounds(today, today)
+
+    ensure_backfilled()
+    income = DailyRevenue.objects.filter(date__range=[month_start, today]).aggregate(
+        today=Sum('total_amount', filter=Q(date=today)),
+        month=Sum('total_amount'),
+    )
+    patients = Patient.objects.filter(in_range(month_start, today)).aggregate(
+        today=Count('id', filter=Q(created_at__gte=today_start)),
+        month=Count('id'),
+    )
+    return {
+        'today_income': income['today'] or 0,
+        'today_patients': patients['today'],
+        'monthly_income': income['month'] or 0,
+        'monthly_patients': patients['month'],
+    }
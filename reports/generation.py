@@ -0,0 +1,189 @@
+"""Off-request generation of scheduled financial reports.
+
+``run_report_scheduler`` claims due ``ReportSchedule`` rows, builds the
+report for the last complete period with the report engine, stores it
+as a ``FinancialReport`` with the CSV/XLSX attached to ``report_file``
+and mails it to the schedule's recipients.
+"""
+import csv
+import io
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.mail import EmailMessage
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import engine
+from .models import FinancialReport, ReportSchedule
+
+SCHEDULABLE_PERIODS = ('DAILY', 'WEEKLY', 'MONTHLY', 'QUARTERLY', 'YEARLY')
+
+
+def _month_start(day, months_back=0):
+    month_index = day.year * 12 + day.month - 1 - months_back
+    return day.replace(year=month_index // 12, month=month_index % 12 + 1, day=1)
+
+
+def last_complete_period(report_period, today):
+    """``(start_date, end_date)`` of the most recent period that has ended"""
+    if report_period == 'DAILY':
+        day = today - timedelta(days=1)
+        return day, day
+    if report_period == 'WEEKLY':
+        return today - timedelta(days=7), today - timedelta(days=1)
+    if report_period == 'MONTHLY':
+        return _month_start(today, 1), _month_start(today) - timedelta(days=1)
+    if report_period == 'QUARTERLY':
+        quarter_start = _month_start(today, (today.month - 1) % 3)
+        return _month_start(quarter_start, 3), quarter_start - timedelta(days=1)
+    # YEARLY
+    return today.replace(year=today.year - 1, month=1, day=1), today.replace(month=1, day=1) - timedelta(days=1)
+
+
+def next_run_after(report_period, now):
+    """Midnight at the start of the next period after ``now``"""
+    today = timezone.localdate(now)
+    if report_period == 'DAILY':
+        day = today + timedelta(days=1)
+    elif report_period == 'WEEKLY':
+        day = today + timedelta(days=7)
+    elif report_period == 'MONTHLY':
+        day = _month_start(_month_start(today) + timedelta(days=32))
+    elif report_period == 'QUARTERLY':
+        quarter_start = _month_start(today, (today.month - 1) % 3)
+        day = _month_start(quarter_start + timedelta(days=95))
+    else:
+        day = today.replace(year=today.year + 1, month=1, day=1)
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def claim_due_schedule(now=None):
+    """Claim one due schedule, or return ``None``.
+
+    The row is locked with SKIP LOCKED so concurrent schedulers pick
+    different schedules, and the claim itself is a conditional UPDATE of
+    ``next_run`` so it stays exclusive on databases without row locks.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        schedule = (
+            ReportSchedule.objects.select_for_update(skip_locked=True)
+            .filter(is_active=True, report_period__in=SCHEDULABLE_PERIODS)
+            .filter(Q(next_run__lte=now) | Q(next_run__isnull=True))
+            .order_by('next_run')
+            .first()
+        )
+        if schedule is None:
+            return None
+        next_run = next_run_after(schedule.report_period, now)
+        claimed = ReportSchedule.objects.filter(
+            pk=schedule.pk, next_run=schedule.next_run
+        ).update(last_run=now, next_run=next_run)
+        if not claimed:
+            return None
+        schedule.last_run, schedule.next_run = now, next_run
+        return schedule
+
+
+def report_rows(summary):
+    return [
+        ['Category', 'Amount (ETB)'],
+        ['Registration Income', summary['registration_income']],
+        ['Laboratory Income', summary['lab_income']],
+        ['Pharmacy Income', summary['pharmacy_income']],
+        ['Total Income', summary['total_income']],
+        [],
+        ['Statistics', 'Count'],
+        ['New Patients', summary['new_patients']],
+        ['Total Visits', summary['total_visits']],
+        ['Total Lab Tests', summary['total_lab_tests']],
+        ['Total Prescriptions', summary['total_prescriptions']],
+    ]
+
+
+def render_csv(title, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([title])
+    writer.writerow([])
+    writer.writerows(rows)
+    return buffer.getvalue().encode('utf-8')
+
+
+def render_xlsx(title, rows):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Report')
+    sheet.append([title])
+    sheet.append([])
+    for row in rows:
+        sheet.append([float(value) if isinstance(value, Decimal) else value for value in row])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def generate_report(schedule, today=None):
+    today = today or timezone.localdate()
+    start_date, end_date = last_complete_period(schedule.report_period, today)
+    summary = engine.financial_summary(start_date, end_date)
+
+    report = FinancialReport(
+        title=f'{schedule.name} ({start_date} to {end_date})',
+        report_period=schedule.report_period,
+        start_date=start_date,
+        end_date=end_date,
+        total_income=summary['total_income'],
+        registration_income=summary['registration_income'],
+        lab_test_income=summary['lab_income'],
+        pharmacy_income=summary['pharmacy_income'],
+        total_patients=summary['new_patients'],
+        new_patients=summary['new_patients'],
+        total_visits=summary['total_visits'],
+        total_lab_tests=summary['total_lab_tests'],
+        total_prescriptions=summary['total_prescriptions'],
+        generated_by=schedule.created_by,
+    )
+
+    rows = report_rows(summary)
+    if schedule.file_format == 'CSV':
+        content = render_csv(report.title, rows)
+    else:
+        content = render_xlsx(report.title, rows)
+    filename = f'financial_report_{schedule.report_period.lower()}_{start_date}_{end_date}.{schedule.file_format.lower()}'
+    report.report_file.save(filename, ContentFile(content), save=False)
+    report.save()
+    return report
+
+
+def email_report(report, recipients):
+    recipients = [address.strip() for address in recipients.split(',') if address.strip()]
+    if not recipients:
+        return 0
+    message = EmailMessage(
+        subject=f'{settings.CLINIC_NAME}: {report.title}',
+        body=(
+            f'Attached is the {report.get_report_period_display().lower()} financial report '
+            f'for {report.start_date} to {report.end_date}.\n\n'
+            f'Total income: {report.total_income} ETB'
+        ),
+        from_email=settings.CLINIC_EMAIL,
+        to=recipients,
+    )
+    report.report_file.open('rb')
+    try:
+        message.attach(report.report_file.name.rsplit('/', 1)[-1], report.report_file.read())
+    finally:
+        report.report_file.close()
+    return message.send()
+
+
+def run_schedule(schedule):
+    report = generate_report(schedule)
+    email_report(report, schedule.recipients)
+    return report
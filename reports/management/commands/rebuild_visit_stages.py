@@ -0,0 +1,36 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from patients.models import VisitStatusEvent
+from reports import visit_stages
+
+
+class Command(BaseCommand):
+    help = 'Recompute the visit stage duration summary from the status event log'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=7,
+            help='Recompute the last N days (default 7)',
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Rebuild every day that has events',
+        )
+
+    def handle(self, *args, **options):
+        if options['all']:
+            days = set(
+                VisitStatusEvent.objects.annotate(day=TruncDate('changed_at'))
+                .values_list('day', flat=True).distinct().order_by()
+            )
+        else:
+            today = timezone.localdate()
+            days = {today - timedelta(days=n) for n in range(options['days'])}
+
+        rebuilt = visit_stages.rebuild_days(days)
+        self.stdout.write(self.style.SUCCESS(f'Recomputed visit stage durations for {rebuilt} day(s)'))
@@ -0,0 +1,38 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from reports import rollup
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily revenue rollup for days touched since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=0,
+            help='Also recompute the last N days regardless of activity',
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Rebuild the whole rollup (done automatically on the first run)',
+        )
+
+    def handle(self, *args, **options):
+        started_at = timezone.now()
+
+        since = rollup.last_reconciled_at()
+        if options['all'] or since is None:
+            days = rollup.payment_days()
+        else:
+            # Overlap a little so payments committed during the last run are not missed
+            days = rollup.affected_days(since - timedelta(minutes=5))
+            today = timezone.localdate()
+            days.update(today - timedelta(days=n) for n in range(options['days']))
+
+        rebuilt = rollup.rebuild_days(days)
+        rollup.mark_reconciled(started_at)
+
+        self.stdout.write(self.style.SUCCESS(f'Recomputed daily revenue for {rebuilt} day(s)'))
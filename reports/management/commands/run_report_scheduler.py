@@ -0,0 +1,47 @@
+import logging
+import time
+from django.core.management.base import BaseCommand
+from reports.generation import claim_due_schedule, run_schedule
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Generate and email scheduled financial reports (safe to run several instances)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Process the schedules that are due now, then exit',
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=60,
+            help='Seconds to sleep between polls when nothing is due',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            processed = self.process_due()
+            if options['once']:
+                break
+            if not processed:
+                time.sleep(options['interval'])
+
+    def process_due(self):
+        processed = 0
+        while True:
+            schedule = claim_due_schedule()
+            if schedule is None:
+                return processed
+            processed += 1
+            try:
+                report = run_schedule(schedule)
+            except Exception:
+                # The schedule has already moved on to its next run; log and continue
+                logger.exception('Scheduled report %s failed', schedule.pk)
+                self.stderr.write(self.style.ERROR(f'Failed to generate "{schedule.name}"'))
+                continue
+            self.stdout.write(self.style.SUCCESS(f'Generated "{report.title}"'))
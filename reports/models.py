@@ -1,6 +1,6 @@
 from django.db import models
 from django.utils.translation import gettext_lazy as _
-from patients.models import Patient
+from patients.models import Patient, Visit
 from billing.models import Payment
 from users.models import User
 from django.utils import timezone
@@ -49,8 +49,14 @@ class FinancialReport(models.Model):
 
 class ReportSchedule(models.Model):
     """Schedule for automatic report generation"""
+    FILE_FORMAT_CHOICES = [
+        ('XLSX', 'Excel (XLSX)'),
+        ('CSV', 'CSV'),
+    ]
+    
     name = models.CharField(max_length=100)
     report_period = models.CharField(max_length=20, choices=FinancialReport.REPORT_PERIOD_CHOICES)
+    file_format = models.CharField(max_length=4, choices=FILE_FORMAT_CHOICES, default='XLSX')
     is_active = models.BooleanField(default=True)
     recipients = models.TextField(help_text="Comma-separated email addresses")
     
@@ -61,4 +67,39 @@ class ReportSchedule(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+class DailyRevenue(models.Model):
+    """Completed income per day and payment type, maintained by reports.rollup"""
+    date = models.DateField()
+    payment_type = models.CharField(max_length=20, choices=Payment.PaymentType.choices)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    payment_count = models.IntegerField(default=0)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.date} {self.get_payment_type_display()}: {self.total_amount}"
+    
+    class Meta:
+        unique_together = ['date', 'payment_type']
+        ordering = ['-date', 'payment_type']
+
+class VisitStageDaily(models.Model):
+    """Time visits spent in each status, per day the stage ended; maintained by reports.visit_stages"""
+    date = models.DateField()
+    stage = models.CharField(max_length=20, choices=Visit.Status.choices)
+    count = models.IntegerField(default=0)
+    total_seconds = models.FloatField(default=0)
+    max_seconds = models.FloatField(default=0)
+    # Log-bucketed duration histogram for percentiles, see reports.visit_stages
+    histogram = models.JSONField(default=dict)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.date} {self.get_stage_display()}: {self.count}"
+    
+    class Meta:
+        unique_together = ['date', 'stage']
+        ordering = ['-date', 'stage']
@@ -0,0 +1,142 @@
+"""Incremental daily revenue rollup.
+
+``DailyRevenue`` holds one row per day and payment type. A payment that
+moves to ``COMPLETED`` adds itself to its day once the transaction
+commits (and subtracts itself again if it later leaves ``COMPLETED``),
+so reports read at most one row per day instead of scanning payments.
+``reconcile_daily_revenue`` recomputes only the days touched since its
+last run to repair any drift.
+
+Payments made before the rollup existed are folded in by the first
+reconciliation, or by the first report read if that comes sooner (see
+``ensure_backfilled``), so a freshly deployed database never reports zero.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from billing.models import Payment
+from core.models import SystemConfig
+from .models import DailyRevenue
+
+RECONCILED_AT_KEY = 'reports.daily_revenue.reconciled_at'
+
+# Set once this process has seen the rollup filled
+_backfilled = False
+
+
+def _apply(day, payment_type, amount, count):
+    rows = DailyRevenue.objects.filter(date=day, payment_type=payment_type)
+    delta = {
+        'total_amount': F('total_amount') + amount,
+        'payment_count': F('payment_count') + count,
+        'updated_at': timezone.now(),
+    }
+    if not rows.update(**delta):
+        _, created = DailyRevenue.objects.get_or_create(
+            date=day, payment_type=payment_type,
+            defaults={'total_amount': amount, 'payment_count': count},
+        )
+        if not created:
+            rows.update(**delta)
+
+
+def record_payment_change(payment, was_completed):
+    is_completed = payment.status == Payment.Status.COMPLETED
+    if is_completed == was_completed:
+        return
+    sign = 1 if is_completed else -1
+    day = timezone.localdate(payment.created_at)
+    amount = payment.amount
+    transaction.on_commit(
+        lambda: _apply(day, payment.payment_type, sign * amount, sign)
+    )
+
+
+def update_daily_revenue(sender, instance, created, raw=False, **kwargs):
+    if raw or 'status' not in instance.changed_fields:
+        return
+    was_completed = instance.changed_fields['status'] == Payment.Status.COMPLETED
+    record_payment_change(instance, was_completed)
+
+
+def rebuild_days(days):
+    """Recompute the rollup rows for ``days`` from the payment table"""
+    from .engine import completed_payments
+
+    days = sorted(set(days))
+    if not days:
+        return 0
+    rows = (
+        completed_payments(days[0], days[-1])
+        .annotate(day=TruncDate('created_at'))
+        .filter(day__in=days)
+        .values('day', 'payment_type')
+        .annotate(total=Sum('amount'), count=Count('id'))
+        .order_by()
+    )
+    with transaction.atomic():
+        DailyRevenue.objects.filter(date__in=days).delete()
+        DailyRevenue.objects.bulk_create([
+            DailyRevenue(
+                date=row['day'], payment_type=row['payment_type'],
+                total_amount=row['total'], payment_count=row['count'],
+            )
+            for row in rows
+        ])
+    return len(days)
+
+
+def payment_days():
+    """Every day with a payment"""
+    return set(
+        Payment.objects.annotate(day=TruncDate('created_at'))
+        .values_list('day', flat=True).distinct().order_by()
+    )
+
+
+def backfill():
+    """Rebuild the whole rollup from the payment table; returns the days rebuilt"""
+    started_at = timezone.now()
+    rebuilt = rebuild_days(payment_days())
+    mark_reconciled(started_at)
+    return rebuilt
+
+
+def ensure_backfilled():
+    """Fill the rollup from the payment table if it has never been reconciled"""
+    global _backfilled
+    if _backfilled:
+        return
+    if last_reconciled_at() is None:
+        try:
+            backfill()
+        except IntegrityError:
+            # Another process was backfilling at the same time and won
+            pass
+    _backfilled = True
+
+
+def affected_days(since):
+    """Days whose payments were created or completed after ``since``"""
+    changed = Payment.objects.filter(created_at__gte=since) | Payment.objects.filter(completed_at__gte=since)
+    return set(
+        changed.annotate(day=TruncDate('created_at'))
+        .values_list('day', flat=True)
+        .distinct()
+        .order_by()
+    )
+
+
+def last_reconciled_at():
+    value = SystemConfig.objects.filter(key=RECONCILED_AT_KEY).values_list('value', flat=True).first()
+    return parse_datetime(value) if value else None
+
+
+def mark_reconciled(when):
+    SystemConfig.objects.update_or_create(
+        key=RECONCILED_AT_KEY,
+        defaults={'value': when.isoformat(), 'description': 'Last daily revenue rollup reconciliation'},
+    )
@@ -1,3 +1,142 @@
-from django.test import TestCase
+import tempfile
+from datetime import date
+from decimal import Decimal
 
-# Create your tests here.
+from django.core import mail
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from billing.models import Payment
+from core.testing import make_payment, make_user, make_visit
+from patients.models import Visit, VisitStatusEvent
+from users.models import User
+
+from . import engine, generation, rollup, visit_stages
+from .models import DailyRevenue, FinancialReport, ReportSchedule, VisitStageDaily
+
+
+class RevenueBackfillTests(TestCase):
+    def setUp(self):
+        rollup._backfilled = False
+
+    def test_reports_backfill_a_rollup_that_was_never_filled(self):
+        visit = make_visit()
+        # Created without running on_commit hooks, as on a database that
+        # predates the rollup
+        make_payment(visit=visit, status=Payment.Status.COMPLETED, amount=Decimal('50.00'))
+        make_payment(
+            visit=visit, payment_type=Payment.PaymentType.LAB_TEST,
+            status=Payment.Status.COMPLETED, amount=Decimal('120.00'),
+        )
+        make_payment(visit=visit, status=Payment.Status.PENDING, amount=Decimal('999.00'))
+        self.assertFalse(DailyRevenue.objects.exists())
+
+        today = timezone.localdate()
+        totals = engine.income_totals(today, today)
+
+        self.assertEqual(totals['registration_income'], Decimal('50.00'))
+        self.assertEqual(totals['lab_income'], Decimal('120.00'))
+        self.assertEqual(totals['total_income'], Decimal('170.00'))
+        self.assertIsNotNone(rollup.last_reconciled_at())
+
+    def test_reconciled_rollup_is_not_rebuilt(self):
+        rollup.mark_reconciled(timezone.now())
+        make_payment(status=Payment.Status.COMPLETED)
+        today = timezone.localdate()
+        self.assertEqual(engine.income_totals(today, today)['total_income'], 0)
+
+
+class ExportDatasetTests(TestCase):
+    def setUp(self):
+        self.client.force_login(make_user(User.Role.ADMIN))
+
+    def test_impossible_date_is_a_bad_request(self):
+        response = self.client.get(reverse('export_dataset', args=['payments']), {'start': '2024-02-30'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_valid_range_streams_csv(self):
+        response = self.client.get(
+            reverse('export_dataset', args=['payments']), {'start': '2024-02-01', 'end': '2024-02-29'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+
+
+class IncomeSeriesTests(TestCase):
+    def setUp(self):
+        rollup.mark_reconciled(timezone.now())
+        for day, payment_type, amount in [
+            (date(2024, 1, 5), Payment.PaymentType.REGISTRATION, '50.00'),
+            (date(2024, 1, 20), Payment.PaymentType.REGISTRATION, '100.00'),
+            (date(2024, 1, 20), Payment.PaymentType.LAB_TEST, '300.00'),
+            (date(2024, 3, 1), Payment.PaymentType.MEDICINE, '75.50'),
+        ]:
+            DailyRevenue.objects.create(date=day, payment_type=payment_type, total_amount=Decimal(amount), payment_count=1)
+
+    def test_months_are_grouped_and_gaps_filled(self):
+        series = engine.income_series(date(2024, 1, 1), date(2024, 12, 31))
+        self.assertEqual(len(series), 12)
+        self.assertEqual(series[0], {
+            'registration': 150.0, 'lab': 300.0, 'pharmacy': 0.0, 'total': 450.0, 'date': date(2024, 1, 1),
+        })
+        self.assertEqual(series[1]['total'], 0)
+        self.assertEqual(series[2]['pharmacy'], 75.5)
+
+    def test_totals_count_payments_per_line(self):
+        totals = engine.income_totals(date(2024, 1, 1), date(2024, 1, 31))
+        self.assertEqual(totals['registration_count'], 2)
+        self.assertEqual(totals['total_income'], Decimal('450.00'))
+
+
+class ReportSchedulerTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        rollup.mark_reconciled(timezone.now())
+        self.schedule = ReportSchedule.objects.create(
+            name='Monthly income', report_period='MONTHLY', file_format='CSV',
+            recipients='owner@example.com, accounts@example.com', created_by=make_user(User.Role.ADMIN),
+        )
+
+    def test_due_schedule_is_claimed_once(self):
+        claimed = generation.claim_due_schedule()
+        self.assertEqual(claimed, self.schedule)
+        self.assertGreater(claimed.next_run, timezone.now())
+        self.assertIsNone(generation.claim_due_schedule())
+
+    def test_run_stores_and_mails_the_report(self):
+        report = generation.run_schedule(generation.claim_due_schedule())
+
+        self.assertEqual(FinancialReport.objects.get(), report)
+        self.assertTrue(report.report_file.name.endswith('.csv'))
+        with report.report_file.open('rb') as file:
+            self.assertIn(b'Total Income', file.read())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['owner@example.com', 'accounts@example.com'])
+        self.assertEqual(len(mail.outbox[0].attachments), 1)
+
+
+class VisitStageTests(TestCase):
+    def test_status_changes_are_logged_and_summarised(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            visit = make_visit()
+            visit.status = Visit.Status.WITH_DOCTOR
+            visit.save()
+            Visit.bulk_set_status([visit], Visit.Status.LAB_REQUESTED)
+
+        self.assertEqual(
+            list(
+                VisitStatusEvent.objects.filter(visit=visit).order_by('pk').values_list('from_status', 'to_status')
+            ),
+            [('', 'REGISTERED'), ('REGISTERED', 'WITH_DOCTOR'), ('WITH_DOCTOR', 'LAB_REQUESTED')],
+        )
+        today = timezone.localdate()
+        summary = visit_stages.stage_summary(today, today)
+        self.assertEqual(set(summary), {'REGISTERED', 'WITH_DOCTOR'})
+        self.assertEqual(summary['REGISTERED']['count'], 1)
+
+        incremental = sorted(VisitStageDaily.objects.values_list('stage', 'count', 'max_seconds'))
+        visit_stages.rebuild_days([today])
+        self.assertEqual(sorted(VisitStageDaily.objects.values_list('stage', 'count', 'max_seconds')), incremental)
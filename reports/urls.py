@@ -5,4 +5,5 @@ urlpatterns = [
     path('financial/', views.financial_reports, name='financial_reports'),
     path('financial/export/', views.export_financial_report, name='export_financial_report'),
     path('dashboard-stats/', views.dashboard_stats, name='dashboard_stats'),
+    path('export/<str:dataset>/', views.export_dataset, name='export_dataset'),
 ]
\ No newline at end of file
@@ -0,0 +1,161 @@
+"""Incremental visit stage duration summary.
+
+Every ``VisitStatusEvent`` records how long the visit spent in the status
+it just left. Once the event commits, that duration is folded into the
+``VisitStageDaily`` row for the day and stage: a count, a sum, a maximum
+and a log-bucketed histogram. Questions like "how long do patients wait
+with the doctor" or "lab turnaround by day" (the ``LAB_REQUESTED`` stage)
+then read one small row per day and stage instead of scanning visits.
+
+The histogram puts a duration of ``s`` seconds in bucket
+``ceil(log(s, GAMMA))``, so a percentile read back from it is within
+about 2.5% of the true value. Histograms of different days merge by
+adding bucket counts.
+"""
+import math
+
+from django.db import transaction
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from patients.models import VisitStatusEvent
+from .models import VisitStageDaily
+
+GAMMA = 1.05
+
+
+def _bucket(seconds):
+    if seconds <= 1:
+        return 0
+    return math.ceil(math.log(seconds, GAMMA))
+
+
+def _bucket_value(index):
+    """Representative duration of a bucket (geometric midpoint of its bounds)"""
+    if index <= 0:
+        return 0.0
+    return 2 * GAMMA ** index / (GAMMA + 1)
+
+
+def add_to_histogram(histogram, seconds, count=1):
+    key = str(_bucket(seconds))
+    histogram[key] = histogram.get(key, 0) + count
+
+
+def merge_histograms(histograms):
+    merged = {}
+    for histogram in histograms:
+        for key, count in histogram.items():
+            merged[key] = merged.get(key, 0) + count
+    return merged
+
+
+def quantile(histogram, q):
+    """Approximate ``q`` quantile (0..1) of the durations in ``histogram``"""
+    total = sum(histogram.values())
+    if not total:
+        return None
+    rank = q * (total - 1)
+    seen = 0
+    for index in sorted(int(key) for key in histogram):
+        seen += histogram[str(index)]
+        if seen > rank:
+            return _bucket_value(index)
+    return _bucket_value(index)
+
+
+def _add(day, stage, durations):
+    with transaction.atomic():
+        row, _ = VisitStageDaily.objects.select_for_update().get_or_create(date=day, stage=stage)
+        for seconds in durations:
+            row.count += 1
+            row.total_seconds += seconds
+            row.max_seconds = max(row.max_seconds, seconds)
+            add_to_histogram(row.histogram, seconds)
+        row.save()
+
+
+def _stage_durations(events):
+    """``{(day, stage): [seconds, ...]}`` of the finished stages among ``events``"""
+    durations = {}
+    for event in events:
+        if not event.from_status or event.stage_seconds is None:
+            continue
+        key = (timezone.localdate(event.changed_at), event.from_status)
+        durations.setdefault(key, []).append(max(event.stage_seconds, 0))
+    return durations
+
+
+def record_stage_event(sender, instance, created, raw=False, **kwargs):
+    """post_save for VisitStatusEvent: fold the finished stage into its day"""
+    if raw or not created:
+        return
+    record_stage_events(sender, [instance])
+
+
+def record_stage_events(sender, events, **kwargs):
+    """patients.models.status_events_created: fold bulk-created events in, one row update per day and stage"""
+    for (day, stage), durations in _stage_durations(events).items():
+        transaction.on_commit(lambda day=day, stage=stage, durations=durations: _add(day, stage, durations))
+
+
+def rebuild_days(days):
+    """Recompute the summary rows for ``days`` from the event log"""
+    days = sorted(set(days))
+    if not days:
+        return 0
+    events = (
+        VisitStatusEvent.objects
+        .exclude(from_status='')
+        .filter(stage_seconds__isnull=False)
+        .annotate(day=TruncDate('changed_at'))
+        .filter(day__in=days)
+        .values_list('day', 'from_status', 'stage_seconds')
+        .order_by()
+    )
+    rows = {}
+    for day, stage, seconds in events.iterator(chunk_size=2000):
+        seconds = max(seconds, 0)
+        row = rows.get((day, stage))
+        if row is None:
+            row = rows[(day, stage)] = VisitStageDaily(date=day, stage=stage, histogram={})
+        row.count += 1
+        row.total_seconds += seconds
+        row.max_seconds = max(row.max_seconds, seconds)
+        add_to_histogram(row.histogram, seconds)
+
+    with transaction.atomic():
+        VisitStageDaily.objects.filter(date__in=days).delete()
+        VisitStageDaily.objects.bulk_create(rows.values())
+    return len(days)
+
+
+def _summarise(rows):
+    count = sum(row.count for row in rows)
+    histogram = merge_histograms(row.histogram for row in rows)
+    return {
+        'count': count,
+        'avg_seconds': sum(row.total_seconds for row in rows) / count if count else None,
+        'p50_seconds': quantile(histogram, 0.5),
+        'p95_seconds': quantile(histogram, 0.95),
+        'max_seconds': max((row.max_seconds for row in rows), default=None),
+    }
+
+
+def stage_summary(start_date, end_date, stages=None):
+    """``{stage: {count, avg/p50/p95/max seconds}}`` for stages ended in the period"""
+    rows = VisitStageDaily.objects.filter(date__range=[start_date, end_date])
+    if stages:
+        rows = rows.filter(stage__in=stages)
+    by_stage = {}
+    for row in rows:
+        by_stage.setdefault(row.stage, []).append(row)
+    return {stage: _summarise(stage_rows) for stage, stage_rows in by_stage.items()}
+
+
+def stage_series(stage, start_date, end_date):
+    """Daily summary of one stage, oldest first, skipping days without data"""
+    rows = VisitStageDaily.objects.filter(
+        date__range=[start_date, end_date], stage=stage
+    ).order_by('date')
+    return [dict(_summarise([row]), date=row.date) for row in rows]